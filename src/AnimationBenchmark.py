@@ -0,0 +1,61 @@
+import pygame as pg
+import sys
+import time
+from Window import Window
+from AnimationSystem import AnimationSystem
+from GameObjectSystem import GameObjectSystem
+from Model import Model
+from Animator import Animator
+
+# Usage: python src/AnimationBenchmark.py [--workers N] [count ...]   (run from the repository root)
+
+def spawn_crowd(count: int, path: str = "res/N.glb"):
+    for i in range(len(AnimationSystem.animations), count):
+        animator = Animator(Model(path))
+        animator.setDefaultState("Idle" if i % 2 else "FastRunning")
+        animator.currentState.time = (i * 0.37) % animator.currentState.duration
+
+def measure(batched: bool, frames: int = 120, deltaTime: float = 1.0 / 60, workerCount: int = 0) -> float:
+    AnimationSystem.batched = batched
+    AnimationSystem.SetWorkerCount(workerCount)
+    AnimationSystem.Update(deltaTime)
+    start = time.perf_counter()
+    for _ in range(frames):
+        AnimationSystem.Update(deltaTime)
+    return (time.perf_counter() - start) * 1000 / frames
+
+def run(counts: list[int], frames: int = 120, workerCount: int = 0):
+    AnimationSystem.SetUp()
+    GameObjectSystem.SetUp()
+
+    header = f'{"models":>8} {"serial ms":>10} {"batched ms":>11}'
+    print(header + (f' {f"{workerCount} workers ms":>14}' if workerCount > 0 else ''))
+    for count in sorted(counts):
+        spawn_crowd(count)
+        serial = measure(False, frames)
+        batched = measure(True, frames)
+        line = f'{count:>8} {serial:>10.2f} {batched:>11.2f}'
+        if workerCount > 0:
+            line += f' {measure(True, frames, workerCount=workerCount):>14.2f}'
+            AnimationSystem.SetWorkerCount(0)
+        print(line)
+
+    AnimationSystem.batched = True
+    GameObjectSystem.ShutDown()
+    AnimationSystem.ShutDown()
+
+def main():
+    pg.init()
+    Window(320, 180)
+    args = sys.argv[1:]
+    workerCount = 0
+    if '--workers' in args:
+        index = args.index('--workers')
+        workerCount = int(args[index + 1])
+        del args[index:index + 2]
+    counts = [int(arg) for arg in args] or [1, 10, 50, 100, 200]
+    run(counts, workerCount=workerCount)
+    pg.quit()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,131 @@
+import numpy as np
+from Pose import Pose, PosePool, slerp
+
+PATH_ORDER = ('translation', 'rotation', 'scale')
+
+class AnimationSampler:
+    def __init__(self, interpolation: str, keyframe_times, keyframe_values, path: str):
+        assert interpolation[0] in 'SL', 'bad interpolation'
+        self.interpolation: str = interpolation
+        # Own copies, so the glTF buffer the accessors point into can be released after loading
+        self.keyframe_times = np.array(keyframe_times)
+        self.keyframe_values = np.array(keyframe_values)
+        self.step: bool = interpolation[0] == 'S'
+
+        # Segment i spans padded_times[i] .. padded_times[i + 1] and blends values[i] -> values[(i + 1) % count]
+        times = np.asarray(keyframe_times, dtype=np.float32).reshape(-1)
+        self.count: int = len(times)
+        self.padded_times = np.concatenate(([0], times)).astype(np.float32)
+        lengths = np.diff(self.padded_times)
+        self.inv_segment_lengths = np.divide(1, lengths, out=np.zeros_like(lengths), where=lengths > 0)
+
+        values = np.asarray(keyframe_values, dtype=np.float32)
+        self.values = np.zeros((len(values), 4), dtype=np.float32)
+        if path == 'rotation':
+            self.values[:] = values[:, [3, 0, 1, 2]]
+        else:
+            self.values[:, :values.shape[1]] = values
+
+class AnimationClip:
+    def __init__(self, samplers: list[AnimationSampler], channels):
+        channels = sorted(channels, key=lambda c: PATH_ORDER.index(c.path))
+        paths = [c.path for c in channels]
+        self.channelCount: int = len(channels)
+
+        start = 0
+        self.rows: dict[str, slice] = {}
+        self.nodes: dict[str, np.ndarray] = {}
+        for path in PATH_ORDER:
+            end = start + paths.count(path)
+            self.rows[path] = slice(start, end)
+            self.nodes[path] = np.array([c.node for c in channels[start:end]], dtype=np.int64)
+            start = end
+
+        used = [samplers[c.sampler] for c in channels]
+        counts = np.array([s.count for s in used], dtype=np.int64)
+        max_time = max([float(s.padded_times[-1]) for s in used], default=0)
+
+        # Every channel's padded times are shifted into a disjoint range so a single searchsorted covers all of them
+        self.stride: float = 2.0 ** (np.ceil(np.log2(max_time + 1)) + 1)
+        self.shift = np.arange(self.channelCount) * self.stride
+        self.counts = counts
+        self.key_offsets = np.concatenate(([0], np.cumsum(counts + 1)[:-1])).astype(np.int64)
+        self.value_offsets = np.concatenate(([0], np.cumsum(counts)[:-1])).astype(np.int64)
+
+        self.times = np.concatenate([s.padded_times for s in used] or [np.zeros(0)]).astype(np.float32)
+        self.keys = np.concatenate([s.padded_times + shift for s, shift in zip(used, self.shift)] or [np.zeros(0)])
+        self.inv_segment_lengths = np.concatenate([np.append(s.inv_segment_lengths, 0) for s in used] or [np.zeros(0)]).astype(np.float32)
+        self.values = np.concatenate([s.values for s in used] or [np.zeros((0, 4))]).astype(np.float32)
+        self.step = np.array([s.step for s in used], dtype=bool)
+
+        self.output = np.zeros((self.channelCount, 4), dtype=np.float32)
+        self._a = np.zeros((self.channelCount, 4), dtype=np.float32)
+        self._b = np.zeros((self.channelCount, 4), dtype=np.float32)
+
+    def sample(self, t, out=None) -> np.ndarray:
+        # t is a scalar time, or a (I,) array of times that yields (I, C, 4) values
+        batched = np.ndim(t) > 0
+        if out is None:
+            out = np.empty((len(t), self.channelCount, 4), dtype=np.float32) if batched else self.output
+        if self.channelCount == 0:
+            return out
+
+        # Keyframe times are float32, so compare in float32 like the keyframes do
+        tt = np.asarray(t, dtype=np.float32)[..., np.newaxis]
+        k = np.searchsorted(self.keys, tt.astype(np.float64) + self.shift, side='right') - 1
+        local = np.clip(k - self.key_offsets, 0, self.counts - 1)
+        k = self.key_offsets + local
+        # Shifting can round a query across a key; nudge back onto the segment that holds t
+        back = (self.times[k] > tt) & (local > 0)
+        ahead = (self.times[k + 1] <= tt) & (local < self.counts - 1)
+        local += ahead.astype(np.int64) - back
+        k = self.key_offsets + local
+        valid = (self.times[k] <= tt) & (tt < self.times[k + 1])
+
+        frac = (tt - self.times[k]) * self.inv_segment_lengths[k]
+        frac[self.step | ~valid] = 0
+        local[~valid] = 0
+        a = np.take(self.values, self.value_offsets + local, axis=0, out=None if batched else self._a)
+        b = np.take(self.values, self.value_offsets + np.where(valid, (local + 1) % self.counts, 0), axis=0, out=None if batched else self._b)
+
+        np.subtract(b, a, out=out)
+        out *= frac[..., np.newaxis]
+        out += a
+        rows = self.rows['rotation']
+        slerp(a[..., rows, :], b[..., rows, :], frac[..., rows], out[..., rows, :])
+        return out
+
+    def writePose(self, pose: Pose, values: np.ndarray):
+        rows, nodes = self.rows, self.nodes
+        pose.translations[nodes['translation']] = values[rows['translation'], :3]
+        pose.rotations[nodes['rotation']] = values[rows['rotation']]
+        pose.scales[nodes['scale']] = values[rows['scale'], :3]
+
+    def blendPose(self, pose: Pose, values: np.ndarray, weight: float):
+        rows, nodes = self.rows, self.nodes
+        current = pose.translations[nodes['translation']]
+        pose.translations[nodes['translation']] = current + (values[rows['translation'], :3] - current) * weight
+        pose.rotations[nodes['rotation']] = slerp(pose.rotations[nodes['rotation']], values[rows['rotation']], weight)
+        pose.scales[nodes['scale']] = values[rows['scale'], :3]
+
+# One row per animator: its current clip at `time`, optionally blended toward `endClip` by `weight`
+POSE_JOB = np.dtype([
+    ('slot', np.int64),
+    ('clip', np.int32),
+    ('time', np.float64),
+    ('endClip', np.int32),
+    ('endTime', np.float64),
+    ('weight', np.float64),
+])
+
+def evaluate_pose_jobs(pool: PosePool, clips: list[AnimationClip], jobs: np.ndarray):
+    for index in np.unique(jobs['clip']):
+        group = jobs[jobs['clip'] == index]
+        pool.writeClip(group['slot'], clips[index], clips[index].sample(group['time']))
+
+    blending = jobs[jobs['endClip'] >= 0]
+    for index in np.unique(blending['endClip']):
+        group = blending[blending['endClip'] == index]
+        pool.blendClip(group['slot'], clips[index], clips[index].sample(group['endTime']), group['weight'])
+
+    pool.evaluate(jobs['slot'])
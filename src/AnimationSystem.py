@@ -1,17 +1,35 @@
 from Animator import *
+from AnimationClip import POSE_JOB, evaluate_pose_jobs
+from Pose import PosePool
 
 class AnimationSystem:
     animations: list[Animator]
+    batched: bool = True
+    workers = None
     def __init__(self):
         raise RuntimeError("AnimationSystem cannot be created!")
 
     @staticmethod
-    def SetUp():
+    def SetUp(workerCount: int = 0):
         AnimationSystem.animations = []
+        BakedClipCache.Clear()
+        AnimationSystem.SetWorkerCount(workerCount)
 
     @staticmethod
     def ShutDown():
         AnimationSystem.animations = []
+        BakedClipCache.Clear()
+        AnimationSystem.SetWorkerCount(0)
+
+    @staticmethod
+    def SetWorkerCount(workerCount: int):
+        # With workers, pose evaluation is sharded across processes that write into shared-memory pools
+        if AnimationSystem.workers != None:
+            AnimationSystem.workers.shutDown()
+            AnimationSystem.workers = None
+        if workerCount > 0:
+            from AnimationWorkers import AnimationWorkerPool
+            AnimationSystem.workers = AnimationWorkerPool(workerCount)
 
     @staticmethod
     def AddAnimator(animator: Animator):
@@ -19,6 +37,38 @@ class AnimationSystem:
 
     @staticmethod
     def Update(deltaTime: float):
+        # Serial path: every animator samples and evaluates its own pose, kept as the reference output
+        if not AnimationSystem.batched:
+            for anim in AnimationSystem.animations:
+                anim.playAnimation(deltaTime)
+            return
+
+        # State machines still run here; the pose work they ask for is gathered per skeleton
+        # and evaluated as one (instances x joints) batch, in-process or on the workers
+        poolGroups: dict[PosePool, list[Animator]] = {}
+        poolJobs: dict[PosePool, list[tuple]] = {}
         for anim in AnimationSystem.animations:
-            anim.playAnimation(deltaTime)
+            if anim.currentState == None:
+                continue
+            if anim.sampleBaked() != None:
+                anim.advance(deltaTime)
+                continue
+            pool = anim.target.pose.pool
+            poolGroups.setdefault(pool, []).append(anim)
+            poolJobs.setdefault(pool, []).append(anim.poseJob())
+            anim.advance(deltaTime, blend=False)
+
+        work = []
+        for pool, group in poolGroups.items():
+            clips = [animation.clip for animation in group[0].target.animations]
+            work.append((pool, clips, np.array(poolJobs[pool], dtype=POSE_JOB)))
+
+        if AnimationSystem.workers != None:
+            AnimationSystem.workers.evaluate(work)
+        else:
+            for pool, clips, jobs in work:
+                evaluate_pose_jobs(pool, clips, jobs)
 
+        for group in poolGroups.values():
+            for anim in group:
+                anim.target.jointMatrices = anim.target.pose.jointMatrices
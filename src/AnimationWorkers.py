@@ -0,0 +1,83 @@
+import multiprocessing as mp
+import numpy as np
+from AnimationClip import AnimationClip, evaluate_pose_jobs
+from Pose import PosePool, Skeleton
+
+# worker_main only needs the NumPy-side animation modules, but spawned workers also re-import the entry script as
+# __mp_main__ (for main.py that means pygame and PyOpenGL). Entry scripts must keep their start-up under
+# `if __name__ == "__main__"` so workers only pay for the imports; nothing from them runs there
+
+def worker_main(conn):
+    skeletons: dict[int, tuple[Skeleton, list[AnimationClip]]] = {}
+    pools: dict[int, PosePool] = {}
+    while True:
+        message = conn.recv()
+        kind = message[0]
+        if kind == 'register':
+            _, key, skeleton, clips = message
+            skeletons[key] = (skeleton, clips)
+            pools[key] = PosePool(skeleton, 0)
+        elif kind == 'attach':
+            _, key, names, capacity = message
+            pools[key].attach(names, capacity)
+        elif kind == 'evaluate':
+            _, key, jobs = message
+            evaluate_pose_jobs(pools[key], skeletons[key][1], jobs)
+            conn.send(True)
+        elif kind == 'stop':
+            for pool in pools.values():
+                pool.releaseShared(unlink=False)
+            conn.close()
+            return
+
+class AnimationWorkerPool:
+    def __init__(self, workerCount: int):
+        context = mp.get_context('spawn')
+        self.connections = []
+        self.processes = []
+        for _ in range(workerCount):
+            parent, child = context.Pipe()
+            process = context.Process(target=worker_main, args=(child,), daemon=True)
+            process.start()
+            self.connections.append(parent)
+            self.processes.append(process)
+
+        self.pools: dict[int, PosePool] = {}
+        self.generations: dict[int, int] = {}
+
+    def sync(self, pool: PosePool, clips: list[AnimationClip]):
+        key = id(pool)
+        if key not in self.pools:
+            for conn in self.connections:
+                conn.send(('register', key, pool.skeleton, clips))
+            self.pools[key] = pool
+
+        names = pool.share()
+        if self.generations.get(key) != pool.generation:
+            for conn in self.connections:
+                conn.send(('attach', key, names, pool.capacity))
+            self.generations[key] = pool.generation
+
+    def evaluate(self, work: list[tuple[PosePool, list[AnimationClip], np.ndarray]]):
+        # Shards are split the same way every frame, and each slot belongs to exactly one shard
+        pending = []
+        for pool, clips, jobs in work:
+            self.sync(pool, clips)
+            for conn, shard in zip(self.connections, np.array_split(jobs, len(self.connections))):
+                if len(shard) > 0:
+                    conn.send(('evaluate', id(pool), shard))
+                    pending.append(conn)
+        for conn in pending:
+            conn.recv()
+
+    def shutDown(self):
+        for conn in self.connections:
+            conn.send(('stop',))
+        for process in self.processes:
+            process.join()
+        for conn in self.connections:
+            conn.close()
+        # Pools go back to private memory so the serial and batched paths keep working
+        for pool in self.pools.values():
+            pool.unshare()
+        self.pools = {}
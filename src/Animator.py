@@ -1,9 +1,10 @@
 from Model import Model, Animation
+from BakedClip import BakedClip, BakedClipCache
 from pyglm import glm
 import numpy as np
 
 class AnimationState:
-    def __init__(self, anim: Animation, animName: str, timeScale: float, loop: bool):
+    def __init__(self, anim: Animation, animName: str, timeScale: float, loop: bool, bake: bool = False, bakeRate: float = 30):
         self.animName: str = animName
         self.anim: Animation = anim
         self.duration: float = self.anim.duration[0] if self.anim else 0
@@ -11,47 +12,40 @@ class AnimationState:
         self.timeScale: float = timeScale
         self.loop: bool = loop
         self.finished: bool = False
-        self.frameIndexes: list[int] = [0] * len(self.anim.channels)
+        self.bake: bool = bake
+        self.bakeRate: float = bakeRate
+
+    def bakedClip(self, target: Model) -> BakedClip | None:
+        if not self.bake or self.anim == None:
+            return None
+        key = (target.path, self.animName, self.bakeRate)
+        return BakedClipCache.Get(key, lambda: BakedClip(self.anim.clip, target.pose.skeleton, float(self.duration), self.bakeRate))
 
     def calculateAnimation(self, target: Model):
         if self.anim == None:
             return
 
-        attr_map = {
-            'translation': 'translation',
-            'rotation': 'rotation',
-            'scale': 'scale',
-        }
-
-        for i, channel in enumerate(self.anim.channels):
-            sampler = self.anim.samplers[channel.sampler]
-            keyframe_times = sampler.keyframe_times
-            keyframe_values = sampler.keyframe_values
-
-            interpolated_value, self.frameIndexes[i] = interp_anim_vec(
-                    channel.path, self.time, sampler.interpolation, 
-                    keyframe_times, keyframe_values, self.frameIndexes[i]
-                )
-
-            setattr(target.nodes[channel.node], attr_map[channel.path], interpolated_value)
+        clip = self.anim.clip
+        clip.writePose(target.pose, clip.sample(self.time))
 
     def update(self, deltaTime: float):
         self.time += deltaTime * self.timeScale
         if self.time > self.duration:
             if self.loop:
                 self.time = np.fmod(self.time, self.duration)
-                self.frameIndexes = [0] * len(self.anim.channels)
             else:
                 self.time = self.duration
                 self.finished = True
 
     def reset(self):
         self.time = 0
-        self.frameIndexes = [0] * len(self.anim.channels)
         self.finished = False
 
 class Animator:
     def __init__(self, model: Model):
+        # The clips and pose of a streamed model only exist once it is ready
+        if not model.ready:
+            raise RuntimeError(f"{model.path} is still loading; create its Animator in an onReady callback!")
         from AnimationSystem import AnimationSystem
         AnimationSystem.AddAnimator(self)
         model.animating = True
@@ -71,24 +65,52 @@ class Animator:
             return
         self.transitions.append(AnimationTransition(startAnimName, endAnimName, duration, event, offset))
 
-    def addAnimationState(self, animName: str, timeScale: float = 1, loop: bool = True):
+    def addAnimationState(self, animName: str, timeScale: float = 1, loop: bool = True, bake: bool = False, bakeRate: float = 30):
         if animName not in self.target.animNameIndexMap:
             return
         animIndex = self.target.animNameIndexMap[animName]
-        self.animationStates[animName] = AnimationState(self.target.animations[animIndex], animName, timeScale, loop)
+        self.animationStates[animName] = AnimationState(self.target.animations[animIndex], animName, timeScale, loop, bake, bakeRate)
 
-    def setDefaultState(self, animName: str, timeScale: float = 1, loop: bool = True):
+    def setDefaultState(self, animName: str, timeScale: float = 1, loop: bool = True, bake: bool = False, bakeRate: float = 30):
         if animName not in self.target.animNameIndexMap:
             return
         animIndex = self.target.animNameIndexMap[animName]
-        self.currentState = self.animationStates[animName] = AnimationState(self.target.animations[animIndex], animName, timeScale, loop)
+        self.currentState = self.animationStates[animName] = AnimationState(self.target.animations[animIndex], animName, timeScale, loop, bake, bakeRate)
     
     def playAnimation(self, deltaTime: float):
         if self.currentState == None:
             return
 
-        self.currentState.calculateAnimation(self.target)
+        baked = self.sampleBaked()
+        if baked == None:
+            self.currentState.calculateAnimation(self.target)
+
+        self.advance(deltaTime)
+
+        if baked == None:
+            self.target.jointMatrices = self.target.pose.evaluate()
+
+    def sampleBaked(self) -> BakedClip | None:
+        # Baked states skip pose evaluation unless a transition needs to blend poses
+        if self.isTransitioning:
+            return None
+        baked = self.currentState.bakedClip(self.target)
+        if baked != None:
+            self.target.jointMatrices = baked.sample(self.currentState.time, self.target.pose.jointMatrices)
+        return baked
+
+    def poseJob(self) -> tuple:
+        # Pose work for this frame, captured before advance() moves the clocks on
+        indexMap = self.target.animNameIndexMap
+        state = self.currentState
+        job = (self.target.pose.slot, indexMap[state.animName], state.time, -1, 0, 0)
+        if self.isTransitioning:
+            transition = self.transitions[self.transitionIndex]
+            endState = self.animationStates[transition.endAnimName]
+            job = job[:3] + (indexMap[endState.animName], endState.time, transition.currentDuration)
+        return job
 
+    def advance(self, deltaTime: float, blend: bool = True):
         self.currentState.update(deltaTime)
 
         if not self.isTransitioning:
@@ -99,72 +121,13 @@ class Animator:
                     self.animationStates[transition.endAnimName].reset()
         else:
             transition = self.transitions[self.transitionIndex]
-            if not transition.apply(deltaTime, self):
+            if not transition.apply(deltaTime, self, blend):
                 self.currentState.reset()
                 self.isTransitioning = False
                 self.transitionIndex = -1
                 self.currentState = self.animationStates[transition.endAnimName]
                 transition.reset()
 
-        nodes = self.target.nodes
-        ordered_indexes = self.target.ordered_node_indexes
-
-        for node in nodes:
-            node.transform = calc_local_transform(node)
-        for node_index in ordered_indexes:
-            node = nodes[node_index]
-            parent_index = node.parent_index
-            if parent_index >= 0:
-                parent_node = nodes[parent_index]
-                node.transform = parent_node.transform @ node.transform
-
-        self.target.jointMatrices = calc_joint_matrices(self.target)
-
-def calc_joint_matrices(model: Model):
-    if model.skins == None:
-        return []
-    # assert len(model.skins) == 1
-    for skin in model.skins:
-        return [
-                model.nodes[joint_index].transform @ inverse_bind_matrix
-                for joint_index, inverse_bind_matrix in zip(skin.joints, skin.inverse_bind_matrices)
-            ]
-    return []
-
-def calc_local_transform(node):
-    translation = glm.mat4()
-    rotation = glm.mat4()
-    scale = glm.mat4()
-    if hasattr(node, 'translation') and node.translation is not None:
-        translation = glm.translate(translation, node.translation)
-    if hasattr(node, 'rotation') and node.rotation is not None:
-        rotation = glm.mat4_cast(node.rotation)
-    if hasattr(node, 'scale') and node.scale is not None:
-        scale = glm.scale(scale, glm.vec3(node.scale))
-    return np.array(translation @ rotation @ scale)
-
-def interp_anim_vec(path: str, t: float, interpolation: str, keyframe_times, keyframe_values, frameIndex):
-    aIndex, b, t = get_lerp(t, keyframe_times, frameIndex)
-    a = glm.quat(keyframe_values[aIndex, [3,0,1,2]]) if path[0] == 'r' else glm.vec3(keyframe_values[aIndex])
-    b = glm.quat(keyframe_values[b, [3,0,1,2]]) if path[0] == 'r' else glm.vec3(keyframe_values[b])
-    if interpolation[0] == 'S':
-        return a, aIndex
-    elif interpolation[0] == 'L':
-        if path[0] == 'r':
-            return glm.slerp(a, b, t), aIndex
-        return glm.lerp(a, b, t), aIndex
-    assert False, 'bad interpolation'
-
-def get_lerp(t: float, keyframe_times, frameIndex):
-    a = np.insert(np.array(keyframe_times, dtype=np.float32), 0, 0)
-    for i in range(frameIndex, len(a) - 1):
-        t0, t1, = a[i], a[i + 1]
-        if t0 <= t < t1:
-            j = (i + 1) % len(keyframe_times)
-            t = (t - t0) / (t1 - t0)
-            return i, j, t
-    return 0, 0, 0
-
 class AnimationTransition:
     def __init__(self, startAnimName: str, endAnimName: str, duration: float, event, offset: float):
         self.startAnimName: str = startAnimName
@@ -175,27 +138,14 @@ class AnimationTransition:
         self.event = event
         self.currentDuration: float = 0
 
-    def apply(self, deltaTime: float, animator: Animator) -> bool:
+    def apply(self, deltaTime: float, animator: Animator, blend: bool = True) -> bool:
         states = animator.animationStates
         endAnimState = states[self.endAnimName]
         endAnim = endAnimState.anim
 
-        for i, channel in enumerate(endAnim.channels):
-            sampler = endAnim.samplers[channel.sampler]
-            keyframe_times = sampler.keyframe_times
-            keyframe_values = sampler.keyframe_values
-
-            interpolated_value, endAnimState.frameIndexes[i] = interp_anim_vec(
-                    channel.path, endAnimState.time, sampler.interpolation, 
-                    keyframe_times, keyframe_values, endAnimState.frameIndexes[i]
-                )
-
-            if channel.path == 'translation':
-                animator.target.nodes[channel.node].translation = glm.lerp(animator.target.nodes[channel.node].translation, interpolated_value, self.currentDuration)
-            elif channel.path == 'rotation':
-                animator.target.nodes[channel.node].rotation = glm.slerp(glm.quat(animator.target.nodes[channel.node].rotation), interpolated_value, self.currentDuration)
-            elif channel.path == 'scale':
-                animator.target.nodes[channel.node].scale = interpolated_value
+        if blend:
+            clip = endAnim.clip
+            clip.blendPose(animator.target.pose, clip.sample(endAnimState.time), self.currentDuration)
 
         self.currentDuration += deltaTime * self.durationInverse
         endAnimState.time += deltaTime * endAnimState.timeScale
@@ -0,0 +1,103 @@
+import numpy as np
+from collections import OrderedDict
+from typing import Callable
+from AnimationClip import AnimationClip
+from Pose import Skeleton, compose_local_matrices, compose_world_matrices
+
+class BakedClip:
+    def __init__(self, clip: AnimationClip, skeleton: Skeleton, duration: float, rate: float):
+        self.rate: float = rate
+        self.duration: float = duration
+        self.frameCount: int = int(np.ceil(duration * rate)) + 1
+        times = np.minimum(np.arange(self.frameCount) / rate, duration)
+
+        # Every frame starts from the rest pose, so nodes the clip does not animate stay at rest
+        n = skeleton.nodeCount
+        translations = np.broadcast_to(skeleton.restTranslations, (self.frameCount, n, 3)).copy()
+        rotations = np.broadcast_to(skeleton.restRotations, (self.frameCount, n, 4)).copy()
+        scales = np.broadcast_to(skeleton.restScales, (self.frameCount, n, 3)).copy()
+        rows, nodes = clip.rows, clip.nodes
+        for i, t in enumerate(times):
+            values = clip.sample(t)
+            translations[i, nodes['translation']] = values[rows['translation'], :3]
+            rotations[i, nodes['rotation']] = values[rows['rotation']]
+            scales[i, nodes['scale']] = values[rows['scale'], :3]
+
+        local = compose_local_matrices(translations, rotations, scales)
+        world = compose_world_matrices(local, skeleton.levels, skeleton.parents)
+        self.jointMatrices = np.ascontiguousarray(world[:, skeleton.joints] @ skeleton.inverseBindMatrices, dtype=np.float32)
+        self.nbytes: int = self.jointMatrices.nbytes
+
+    def sample(self, t: float, out: np.ndarray) -> np.ndarray:
+        f = min(max(t, 0), self.duration) * self.rate
+        i0 = min(int(f), self.frameCount - 1)
+        i1 = min(i0 + 1, self.frameCount - 1)
+        frac = f - i0
+        if frac <= 0 or i0 == i1:
+            np.copyto(out, self.jointMatrices[i0])
+            return out
+        np.subtract(self.jointMatrices[i1], self.jointMatrices[i0], out=out)
+        out *= frac
+        out += self.jointMatrices[i0]
+        return out
+
+class BakedClipCache:
+    budget: int = 64 * 1024 * 1024
+    size: int = 0
+    clips: OrderedDict = OrderedDict()
+    oversized: set = set()
+    # When the clips in use outgrow the budget, each bake evicts one another needs next frame. A clip evicted
+    # rebakeLimit times is sampled from then on instead, like an oversized one, until the budget changes
+    rebakeLimit: int = 2
+    evictions: dict = {}
+    thrashing: set = set()
+
+    def __init__(self):
+        raise RuntimeError("BakedClipCache cannot be created!")
+
+    @staticmethod
+    def Clear():
+        BakedClipCache.clips = OrderedDict()
+        BakedClipCache.oversized = set()
+        BakedClipCache.evictions = {}
+        BakedClipCache.thrashing = set()
+        BakedClipCache.size = 0
+
+    @staticmethod
+    def SetBudget(budget: int):
+        BakedClipCache.budget = budget
+        BakedClipCache.oversized = set()
+        BakedClipCache.evictions = {}
+        BakedClipCache.thrashing = set()
+        BakedClipCache.Evict()
+
+    @staticmethod
+    def Evict():
+        clips = BakedClipCache.clips
+        while BakedClipCache.size > BakedClipCache.budget and len(clips) > 0:
+            key, baked = clips.popitem(last=False)
+            BakedClipCache.size -= baked.nbytes
+            evictions = BakedClipCache.evictions.get(key, 0) + 1
+            BakedClipCache.evictions[key] = evictions
+            if evictions >= BakedClipCache.rebakeLimit:
+                BakedClipCache.thrashing.add(key)
+
+    @staticmethod
+    def Get(key: tuple, bake: Callable[[], BakedClip]) -> BakedClip | None:
+        clips = BakedClipCache.clips
+        baked = clips.get(key)
+        if baked is not None:
+            clips.move_to_end(key)
+            return baked
+
+        if key in BakedClipCache.oversized or key in BakedClipCache.thrashing:
+            return None
+
+        baked = bake()
+        if baked.nbytes > BakedClipCache.budget:
+            BakedClipCache.oversized.add(key)
+            return None
+        clips[key] = baked
+        BakedClipCache.size += baked.nbytes
+        BakedClipCache.Evict()
+        return baked
@@ -0,0 +1,77 @@
+import sys
+import time
+import numpy as np
+from pyglm import glm
+from CollisionWorld import CollisionWorld, minimum_translation
+from Model import Transform
+
+# Usage: python src/CollisionBenchmark.py [--boxes N] [bodies ...]   (run from the repository root)
+
+WORLD_SIZE = 200.0
+
+def spawn_boxes(count: int, rng: np.random.Generator):
+    mins = rng.uniform(-WORLD_SIZE / 2, WORLD_SIZE / 2, (count, 3)) * (1, 0, 1)
+    maxs = mins + rng.uniform(0.5, 3.0, (count, 3))
+    CollisionWorld.AddStaticBoxes(mins, maxs)
+
+def spawn_bodies(count: int, rng: np.random.Generator) -> list[Transform]:
+    bodies = []
+    for _ in range(count):
+        transform = Transform()
+        transform.position = glm.vec3(*rng.uniform(-WORLD_SIZE / 2, WORLD_SIZE / 2, 3) * (1, 0, 1))
+        CollisionWorld.AddBody(transform, (-0.3, 0, -0.3), (0.3, 2, 0.3))
+        bodies.append(transform)
+    return bodies
+
+def linear_update(bodies: list[Transform]):
+    # Reference: every body tests every static box, the way the player used to
+    staticMins, staticMaxs = CollisionWorld.staticMins, CollisionWorld.staticMaxs
+    for i, body in enumerate(bodies):
+        position = np.array(body.position.to_list())
+        boxMin, boxMax = position + CollisionWorld.bodyMins[i], position + CollisionWorld.bodyMaxs[i]
+        hits = np.flatnonzero(np.all((boxMin <= staticMaxs) & (boxMax >= staticMins), axis=1))
+        if len(hits) > 0:
+            mtv = minimum_translation(np.tile(boxMin, (len(hits), 1)), np.tile(boxMax, (len(hits), 1)), staticMins[hits], staticMaxs[hits])
+            body.position = body.position + glm.vec3(*mtv.sum(axis=0))
+
+def measure(update, bodies: list[Transform], frames: int, rng: np.random.Generator) -> float:
+    steps = rng.uniform(-0.1, 0.1, (frames, len(bodies), 3)) * (1, 0, 1)
+    total = 0.0
+    for frame in range(frames):
+        for body, step in zip(bodies, steps[frame]):
+            body.position = body.position + glm.vec3(*step)
+        start = time.perf_counter()
+        update(bodies)
+        total += time.perf_counter() - start
+    return total * 1000 / frames
+
+def run(boxCount: int, counts: list[int], frames: int = 60):
+    CollisionWorld.SetUp()
+    rng = np.random.default_rng(0)
+    spawn_boxes(boxCount, rng)
+    start = time.perf_counter()
+    CollisionWorld.BuildGrid()
+    print(f'{boxCount} static boxes, grid built in {(time.perf_counter() - start) * 1000:.2f}ms')
+
+    print(f'{"bodies":>8} {"linear ms":>10} {"grid ms":>8} {"candidates":>11} {"contacts":>9}')
+    bodies = []
+    for count in sorted(counts):
+        bodies += spawn_bodies(count - len(bodies), rng)
+        linear = measure(linear_update, bodies, frames, rng)
+        grid = measure(lambda _: CollisionWorld.Update(), bodies, frames, rng)
+        print(f'{count:>8} {linear:>10.2f} {grid:>8.2f} {CollisionWorld.candidatePairs:>11} {CollisionWorld.contacts:>9}')
+
+    CollisionWorld.ShutDown()
+
+def main():
+    args = sys.argv[1:]
+    boxCount = 10000
+    if '--boxes' in args:
+        index = args.index('--boxes')
+        boxCount = int(args[index + 1])
+        del args[index:index + 2]
+    counts = [int(arg) for arg in args] or [1, 10, 100, 1000]
+    run(boxCount, counts)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,174 @@
+import numpy as np
+from pyglm import glm
+from Model import Model, Transform
+from SpatialIndex import SpatialIndex, COLLIDER_LAYER
+
+# Cell coordinates are packed 21 bits per axis into one int64 key
+CELL_BIAS = 1 << 20
+
+def cell_keys(cells: np.ndarray) -> np.ndarray:
+    biased = cells.astype(np.int64) + CELL_BIAS
+    return (biased[..., 0] << 42) | (biased[..., 1] << 21) | biased[..., 2]
+
+def expand_ranges(starts: np.ndarray, counts: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+    # For ranges [start, start + count): the range each element belongs to and the element itself
+    owners = np.repeat(np.arange(len(counts)), counts)
+    local = np.arange(len(owners)) - np.repeat(np.cumsum(counts) - counts, counts)
+    return owners, np.repeat(starts, counts) + local
+
+def box_cells(mins: np.ndarray, maxs: np.ndarray, cellSize: float) -> tuple[np.ndarray, np.ndarray]:
+    # Every grid cell each box touches, as (box index, cell key) pairs
+    low = np.floor(mins / cellSize).astype(np.int64)
+    size = np.floor(maxs / cellSize).astype(np.int64) - low + 1
+    boxes, local = expand_ranges(np.zeros(len(mins), dtype=np.int64), np.prod(size, axis=1))
+    size = size[boxes]
+    cells = low[boxes] + np.stack([local % size[:, 0], local // size[:, 0] % size[:, 1], local // (size[:, 0] * size[:, 1])], axis=1)
+    return boxes, cell_keys(cells)
+
+def minimum_translation(mins: np.ndarray, maxs: np.ndarray, boxMins: np.ndarray, boxMaxs: np.ndarray) -> np.ndarray:
+    # Per pair, the shortest single axis push that moves box A out of box B; the first axis wins ties
+    toMax = boxMaxs - mins
+    toMin = maxs - boxMins
+    push = np.where(toMax < toMin, toMax, -toMin)
+    axis = np.argmin(np.abs(push), axis=1)
+    mtv = np.zeros_like(push)
+    rows = np.arange(len(push))
+    mtv[rows, axis] = push[rows, axis]
+    return mtv
+
+class CollisionWorld:
+    # Static boxes are bucketed in a uniform grid of cellSize; dynamic bodies are boxes offset from a Transform and are
+    # pushed out of every static box they overlap once per frame
+    cellSize: float = 4.0
+    staticMins: np.ndarray = np.zeros((0, 3))
+    staticMaxs: np.ndarray = np.zeros((0, 3))
+    staticOwners: list = []
+    # Boxes touching more than maxBoxCells cells, such as ground planes, stay out of the grid and are tested against
+    # every body instead
+    maxBoxCells: int = 64
+    largeBoxes: np.ndarray = np.zeros(0, dtype=np.int64)
+    # Grid: sorted unique cell keys, and for cell i the static boxes cellItems[cellStarts[i]:cellStarts[i + 1]]
+    cellKeys: np.ndarray = np.zeros(0, dtype=np.int64)
+    cellStarts: np.ndarray = np.zeros(1, dtype=np.int64)
+    cellItems: np.ndarray = np.zeros(0, dtype=np.int64)
+    gridDirty: bool = False
+
+    bodies: list[Transform] = []
+    bodyMins: np.ndarray = np.zeros((0, 3))
+    bodyMaxs: np.ndarray = np.zeros((0, 3))
+    # Pairs tested by the exact test and pairs in contact during the last Update
+    candidatePairs: int = 0
+    contacts: int = 0
+
+    def __init__(self):
+        raise RuntimeError("CollisionWorld cannot be created!")
+
+    @staticmethod
+    def SetUp(cellSize: float = 4.0):
+        CollisionWorld.cellSize = cellSize
+        CollisionWorld.staticMins = np.zeros((0, 3))
+        CollisionWorld.staticMaxs = np.zeros((0, 3))
+        CollisionWorld.staticOwners = []
+        CollisionWorld.largeBoxes = np.zeros(0, dtype=np.int64)
+        CollisionWorld.gridDirty = True
+        CollisionWorld.bodies = []
+        CollisionWorld.bodyMins = np.zeros((0, 3))
+        CollisionWorld.bodyMaxs = np.zeros((0, 3))
+
+    @staticmethod
+    def ShutDown():
+        CollisionWorld.SetUp(CollisionWorld.cellSize)
+
+    @staticmethod
+    def AddStaticBoxes(mins, maxs, owner = None, index: SpatialIndex | None = None) -> np.ndarray:
+        # Returns the new box indexes. With an index, the boxes are also put in it on COLLIDER_LAYER
+        mins = np.asarray(mins, dtype=np.float64).reshape(-1, 3)
+        maxs = np.asarray(maxs, dtype=np.float64).reshape(-1, 3)
+        start = len(CollisionWorld.staticMins)
+        CollisionWorld.staticMins = np.concatenate([CollisionWorld.staticMins, mins])
+        CollisionWorld.staticMaxs = np.concatenate([CollisionWorld.staticMaxs, maxs])
+        CollisionWorld.staticOwners += [owner] * len(mins)
+        CollisionWorld.gridDirty = True
+        if index != None:
+            index.insert(owner, mins, maxs, COLLIDER_LAYER)
+        return np.arange(start, start + len(mins))
+
+    @staticmethod
+    def AddModelColliders(model: Model, index: SpatialIndex | None = None) -> np.ndarray:
+        # One static box per primitive at the model's current transform; skinned primitives move, so they are left out
+        model.updateMatrices()
+        mesh = model.mesh
+        skinnedMeshes = {node.mesh for node in mesh.nodes if node.mesh is not None and node.skin is not None}
+        rigid = np.array([entry.meshIndex not in skinnedMeshes for entry in mesh.layout], dtype=bool)
+        centers, extents = model.boundsCenters[rigid], model.boundsExtents[rigid]
+        return CollisionWorld.AddStaticBoxes(centers - extents, centers + extents, model, index)
+
+    @staticmethod
+    def AddBody(transform: Transform, boxMin, boxMax) -> int:
+        # boxMin and boxMax are relative to transform.position
+        CollisionWorld.bodies.append(transform)
+        CollisionWorld.bodyMins = np.concatenate([CollisionWorld.bodyMins, np.asarray(boxMin, dtype=np.float64).reshape(1, 3)])
+        CollisionWorld.bodyMaxs = np.concatenate([CollisionWorld.bodyMaxs, np.asarray(boxMax, dtype=np.float64).reshape(1, 3)])
+        return len(CollisionWorld.bodies) - 1
+
+    @staticmethod
+    def BuildGrid():
+        mins, maxs, cellSize = CollisionWorld.staticMins, CollisionWorld.staticMaxs, CollisionWorld.cellSize
+        cellCounts = np.prod(np.floor(maxs / cellSize) - np.floor(mins / cellSize) + 1, axis=1)
+        large = cellCounts > CollisionWorld.maxBoxCells
+        CollisionWorld.largeBoxes = np.flatnonzero(large)
+        gridBoxes = np.flatnonzero(~large)
+        boxes, keys = box_cells(mins[gridBoxes], maxs[gridBoxes], cellSize)
+        boxes = gridBoxes[boxes]
+        order = np.argsort(keys, kind='stable')
+        keys = keys[order]
+        CollisionWorld.cellItems = boxes[order]
+        CollisionWorld.cellKeys, starts = np.unique(keys, return_index=True)
+        CollisionWorld.cellStarts = np.append(starts, len(keys))
+        CollisionWorld.gridDirty = False
+
+    @staticmethod
+    def OverlapPairs(mins: np.ndarray, maxs: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+        # (box, static box) index pairs of overlapping boxes; touching boxes count as overlapping
+        if CollisionWorld.gridDirty:
+            CollisionWorld.BuildGrid()
+        cellKeys = CollisionWorld.cellKeys
+        boxes, keys = box_cells(mins, maxs, CollisionWorld.cellSize)
+        slots = np.searchsorted(cellKeys, keys)
+        found = slots < len(cellKeys)
+        found[found] = cellKeys[slots[found]] == keys[found]
+        boxes, slots = boxes[found], slots[found]
+
+        starts = CollisionWorld.cellStarts[slots]
+        owners, items = expand_ranges(starts, CollisionWorld.cellStarts[slots + 1] - starts)
+        # A static box spanning several cells the query also spans shows up once per shared cell
+        pairs = np.unique(boxes[owners] * len(CollisionWorld.staticMins) + CollisionWorld.cellItems[items])
+        first, second = np.divmod(pairs, max(1, len(CollisionWorld.staticMins)))
+        large = CollisionWorld.largeBoxes
+        if len(large) > 0:
+            first = np.concatenate([first, np.repeat(np.arange(len(mins)), len(large))])
+            second = np.concatenate([second, np.tile(large, len(mins))])
+        CollisionWorld.candidatePairs = len(first)
+
+        overlap = np.all((mins[first] <= CollisionWorld.staticMaxs[second]) & (maxs[first] >= CollisionWorld.staticMins[second]), axis=1)
+        return first[overlap], second[overlap]
+
+    @staticmethod
+    def Update():
+        bodies = CollisionWorld.bodies
+        if len(bodies) == 0:
+            return
+        positions = np.array([body.position.to_list() for body in bodies], dtype=np.float64)
+        mins = positions + CollisionWorld.bodyMins
+        maxs = positions + CollisionWorld.bodyMaxs
+        first, second = CollisionWorld.OverlapPairs(mins, maxs)
+        CollisionWorld.contacts = len(first)
+        if len(first) == 0:
+            return
+
+        # Each body moves by the sum of its pushes out of every box it overlapped at the start of the update
+        mtv = minimum_translation(mins[first], maxs[first], CollisionWorld.staticMins[second], CollisionWorld.staticMaxs[second])
+        offsets = np.zeros_like(positions)
+        np.add.at(offsets, first, mtv)
+        for i in np.unique(first):
+            bodies[i].position = bodies[i].position + glm.vec3(*offsets[i])
@@ -0,0 +1,31 @@
+import numpy as np
+
+def transform_bounds(matrices: np.ndarray, centers: np.ndarray, extents: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+    # World AABBs of local center/extent boxes under row-major matrices, one matrix per box
+    linear = matrices[:, :3, :3]
+    worldCenters = np.einsum('nij,nj->ni', linear, centers) + matrices[:, :3, 3]
+    worldExtents = np.einsum('nij,nj->ni', np.abs(linear), extents)
+    return worldCenters, worldExtents
+
+class Frustum:
+    def __init__(self, viewProjection):
+        # Planes (nx, ny, nz, d) pointing inwards, taken from the rows of a row-major view-projection matrix.
+        # Works for perspective and orthographic projections alike
+        m = np.array(viewProjection, dtype=np.float64)
+        planes = np.array([
+            m[3] + m[0], m[3] - m[0],
+            m[3] + m[1], m[3] - m[1],
+            m[3] + m[2], m[3] - m[2],
+        ])
+        self.planes: np.ndarray = planes / np.linalg.norm(planes[:, :3], axis=1, keepdims=True)
+
+    def testSpheres(self, centers: np.ndarray, radii: np.ndarray) -> np.ndarray:
+        # True for every sphere not entirely behind one of the planes
+        distances = centers @ self.planes[:, :3].T + self.planes[:, 3]
+        return np.all(distances >= -radii[:, None], axis=1)
+
+    def testBoxes(self, centers: np.ndarray, extents: np.ndarray) -> np.ndarray:
+        # Same test for center/extent boxes, using each box's projected radius along every plane normal
+        distances = centers @ self.planes[:, :3].T + self.planes[:, 3]
+        radii = extents @ np.abs(self.planes[:, :3]).T
+        return np.all(distances >= -radii, axis=1)
@@ -1,5 +1,11 @@
 from Window import Window
 from Model import Model
+from RenderQueue import RenderQueue
+from Frustum import Frustum
+from SpatialIndex import SpatialIndex, MODEL_LAYER
+from QuadRenderer import LAYER_TEXTURE_SLOT
+from opengl_util import glTextureArray
+import numpy as np
 
 class GameObjectSystem:
     from GameObject import GameObject
@@ -8,12 +14,30 @@ class GameObjectSystem:
     from Model import Model
     modelObjects: list[Model]
 
-    from QuadRenderer import Quad, QuadRenderer
+    from QuadRenderer import Quad, QuadBatch, BillboardBatch, QuadRenderer
     quadObjects: list[Quad]
+    quadBatches: list[QuadBatch]
+    billboardBatches: list[BillboardBatch]
+    # Textures of quads and billboards, addressed by their layer
+    quadTextures: glTextureArray | None = None
 
     from Camera import Camera
     mainCamera: Camera | None = None
 
+    from RenderQueue import RenderQueue
+    # One queue per render pass, so each keeps its own statistics
+    renderQueues: dict[str, RenderQueue] = {}
+    # Filled once per frame by PrepareModelDraws and drawn by every pass
+    singleModels: list[Model] = []
+    instancedMeshes: list = []
+    # Bumped whenever a static model becomes ready or moves, so caches of static geometry know when to rebuild
+    staticVersion: int = 0
+    staticState: list[tuple[int, int]] = []
+    # Skip primitives outside the frustum of the pass being rendered
+    culling: bool = True
+    # Boxes of every model primitive and collider, for culling and gameplay queries
+    spatialIndex: SpatialIndex = SpatialIndex()
+
     def __init__(self):
         raise RuntimeError("GmaeObjectSystem cannot be created!")
 
@@ -22,15 +46,34 @@ class GameObjectSystem:
         GameObjectSystem.objects = []
         GameObjectSystem.modelObjects = []
         GameObjectSystem.quadObjects = []
+        GameObjectSystem.quadBatches = []
+        GameObjectSystem.billboardBatches = []
+        GameObjectSystem.renderQueues = {}
+        GameObjectSystem.singleModels = []
+        GameObjectSystem.instancedMeshes = []
+        GameObjectSystem.staticState = []
+        GameObjectSystem.spatialIndex = SpatialIndex()
+        GameObjectSystem.quadTextures = glTextureArray()
         Model.CompileShader()
 
     @staticmethod
     def ShutDown():
         for obj in GameObjectSystem.modelObjects:
             obj.delete()
+        for batch in GameObjectSystem.billboardBatches:
+            batch.delete()
+        if GameObjectSystem.quadTextures != None:
+            GameObjectSystem.quadTextures.delete()
+            GameObjectSystem.quadTextures = None
         GameObjectSystem.objects = []
         GameObjectSystem.modelObjects = []
         GameObjectSystem.quadObjects = []
+        GameObjectSystem.quadBatches = []
+        GameObjectSystem.billboardBatches = []
+        GameObjectSystem.singleModels = []
+        GameObjectSystem.instancedMeshes = []
+        GameObjectSystem.spatialIndex = SpatialIndex()
+        Model.animationData = {}
 
     @staticmethod
     def AddGameObject(object: GameObject):
@@ -49,6 +92,14 @@ class GameObjectSystem:
     def AddQuadObject(object: Quad):
         GameObjectSystem.quadObjects.append(object)
 
+    @staticmethod
+    def AddQuadBatch(batch: QuadBatch):
+        GameObjectSystem.quadBatches.append(batch)
+
+    @staticmethod
+    def AddBillboardBatch(batch: BillboardBatch):
+        GameObjectSystem.billboardBatches.append(batch)
+
     @staticmethod
     def Update(window: Window):
         objs = GameObjectSystem.objects
@@ -60,16 +111,83 @@ class GameObjectSystem:
         for object in objs:
             object.OnUpdate(window)
 
+    @staticmethod
+    def PrepareModelDraws():
+        # Once per frame, after the animation update. Non-static models sharing a mesh are drawn instanced,
+        # the rest upload their own joint palette
+        index = GameObjectSystem.spatialIndex
+        groups: dict[int, list[Model]] = {}
+        singleModels = []
+        staticState = []
+        for model in GameObjectSystem.modelObjects:
+            # Streamed models are skipped until their last upload has finished
+            if not model.ready:
+                continue
+            # Only models whose transform changed refit the index
+            version = model.matrixVersion
+            model.updateMatrices()
+            boxMins, boxMaxs = model.boundsCenters - model.boundsExtents, model.boundsCenters + model.boundsExtents
+            if model.indexItems is None:
+                model.indexItems = index.insert(model, boxMins, boxMaxs, MODEL_LAYER)
+            elif model.matrixVersion != version:
+                index.update(model.indexItems, boxMins, boxMaxs)
+            if model.static:
+                staticState.append((id(model), model.matrixVersion))
+            if Model.instancing and not model.static:
+                groups.setdefault(id(model.mesh), []).append(model)
+            else:
+                singleModels.append(model)
+        if staticState != GameObjectSystem.staticState:
+            GameObjectSystem.staticState = staticState
+            GameObjectSystem.staticVersion += 1
+
+        instancedMeshes = []
+        for models in groups.values():
+            if len(models) > 1:
+                models[0].mesh.prepareInstances(models)
+                instancedMeshes.append(models[0].mesh)
+            else:
+                singleModels += models
+        for model in singleModels:
+            model.uploadJointPalette()
+        GameObjectSystem.singleModels = singleModels
+        GameObjectSystem.instancedMeshes = instancedMeshes
+
     from opengl_util import glShaderProgram
     @staticmethod
-    def RenderModel(shader: glShaderProgram):
+    def RenderModel(shader: glShaderProgram, passName: str = "scene", viewProjection = None, static: bool | None = None):
+        # Culls against viewProjection, or the main camera's when it is None. static limits the pass to static models
+        # when True and to the others when False
         mainCamera = GameObjectSystem.mainCamera
         if mainCamera == None:
             return
 
-        modelObjects = GameObjectSystem.modelObjects
-        for model in modelObjects:
-            model.render(shader, mainCamera)
+        visible = None
+        if GameObjectSystem.culling:
+            if viewProjection == None:
+                viewProjection = mainCamera.projectionMat * mainCamera.getViewMatrix()
+            index = GameObjectSystem.spatialIndex
+            visible = np.zeros(index.count, dtype=bool)
+            visible[index.queryFrustum(Frustum(viewProjection), MODEL_LAYER)] = True
+
+        # The pass shaders also draw quads; their texture array sampler must not share diffuseTexture's unit
+        shader.setUniform1i("layerTextures", LAYER_TEXTURE_SLOT)
+
+        queue = GameObjectSystem.renderQueues.get(passName)
+        if queue == None:
+            queue = GameObjectSystem.renderQueues[passName] = RenderQueue(passName)
+
+        for model in GameObjectSystem.singleModels:
+            if static != None and model.static != static:
+                continue
+            model.queueDraws(queue, None if visible is None else visible[model.indexItems])
+        # Instanced models are never static
+        instancedMeshes = GameObjectSystem.instancedMeshes if static != True else []
+        for mesh in instancedMeshes:
+            # An instance is drawn when any of its primitives is visible
+            instanceVisible = None if visible is None else np.array([visible[model.indexItems].any() for model in mesh.instanceModels])
+            mesh.queueInstancedDraws(queue, instanceVisible)
+        queue.submit(shader)
 
     @staticmethod
     def RenderQuads(renderer: QuadRenderer, shader: glShaderProgram):
@@ -81,11 +199,12 @@ class GameObjectSystem:
         from pyglm import glm
         glDisable(GL_CULL_FACE)
 
-        m = mainCamera.projectionMat * mainCamera.getViewMatrix()
-        shader.setUniformMat4("vp", 1, m.to_list())
         shader.setUniform1i("hasDiffuseTex", 0)
         shader.setUniform1i("hasAnimation", 0)
         shader.setUniformMat4("model", 1, glm.mat4(1).to_list())
+        GameObjectSystem.quadTextures.bind(LAYER_TEXTURE_SLOT)
+        shader.setUniform1i("layerTextures", LAYER_TEXTURE_SLOT)
+        shader.setUniform1i("layered", 1)
         quadObjects = GameObjectSystem.quadObjects
         for quad in quadObjects:
             quad.onRender(quad, shader)
@@ -93,8 +212,26 @@ class GameObjectSystem:
             if renderer.full:
                 renderer.submit()
                 renderer.clearBuffer()
+        # Batches using texture layers join the quads' draw; a batch's callback applies to its quads only,
+        # so a batch with one is submitted on its own
+        for batch in GameObjectSystem.quadBatches:
+            if batch.onRender != None:
+                renderer.submit()
+                batch.onRender(batch, shader)
+            renderer.drawBatch(batch)
+            if batch.onRender != None:
+                renderer.submit()
         renderer.submit()
 
+        # The model passes share these shaders, so billboard and layer modes are switched off again afterwards
+        shader.setUniform1i("billboard", 1)
+        for batch in GameObjectSystem.billboardBatches:
+            if batch.onRender != None:
+                batch.onRender(batch, shader)
+            renderer.drawBillboards(batch)
+        shader.setUniform1i("billboard", 0)
+        shader.setUniform1i("layered", 0)
+
         glEnable(GL_CULL_FACE)
 
     @staticmethod
@@ -1,26 +1,95 @@
 from opengl_util import *
+from Pose import Pose, Skeleton
+from AnimationClip import AnimationSampler, AnimationClip
+from BakedClip import BakedClip
+from ModelCache import read_model_cache, write_model_cache
+from RenderQueue import RenderQueue, JOINT_TEXTURE_SLOT
+from Frustum import transform_bounds
 import pygltflib
 import numpy as np
 from pyglm import glm
 
 from PIL import Image
 import io
+import os
+import time
+from concurrent.futures import Future, ThreadPoolExecutor, as_completed
+from itertools import chain
 
 from collections import namedtuple
-MeshData = namedtuple('MeshData', 'primitivesLayout indices vertices normals uvs boneIDs weights')
-AnimationSampler = namedtuple('AnimationSampler', 'interpolation keyframe_times keyframe_values')
+# bounds holds the local AABB (min, max) of every primitive
+MeshData = namedtuple('MeshData', 'primitivesLayout indices vertices normals uvs boneIDs weights bounds')
 AnimationChannel = namedtuple('AnimationChannel', 'sampler node path')
-Animation = namedtuple('Animation', 'name samplers channels duration')
+Animation = namedtuple('Animation', 'name samplers channels duration clip')
 Skin = namedtuple('Skin', 'joints inverse_bind_matrices')
 
 class Transform:
+    # position, rotation and scale must be assigned, not mutated component-wise, for the cached matrix to notice
     def __init__(self):
-        self.position = glm.vec3(0)
-        self.scale = glm.vec3(1.0)
-        self.rotation = glm.quat(0, 0, 0, 0)
+        self._position = glm.vec3(0)
+        self._scale = glm.vec3(1.0)
+        self._rotation = glm.quat(0, 0, 0, 0)
+        self.matrix = glm.mat4(1.0)
+        self.dirty: bool = True
+        # Bumped on every change so caches derived from the matrix know when to rebuild
+        self.version: int = 0
+
+    @property
+    def position(self) -> glm.vec3:
+        return self._position
+
+    @position.setter
+    def position(self, value):
+        self._position = glm.vec3(value)
+        self.markDirty()
+
+    @property
+    def scale(self) -> glm.vec3:
+        return self._scale
+
+    @scale.setter
+    def scale(self, value):
+        self._scale = glm.vec3(value)
+        self.markDirty()
+
+    @property
+    def rotation(self) -> glm.quat:
+        return self._rotation
+
+    @rotation.setter
+    def rotation(self, value):
+        self._rotation = glm.quat(value)
+        self.markDirty()
+
+    def markDirty(self):
+        self.dirty = True
+        self.version += 1
 
     def getMatrix(self):
-        return glm.translate(glm.mat4(1.0), glm.vec3(self.position)) * glm.mat4_cast(self.rotation) * glm.scale(glm.mat4(1.0), self.scale)
+        if self.dirty:
+            self.matrix = glm.translate(glm.mat4(1.0), glm.vec3(self._position)) * glm.mat4_cast(self._rotation) * glm.scale(glm.mat4(1.0), self._scale)
+            self.dirty = False
+        return self.matrix
+
+# std140 blocks shared by every scene shader, mirroring their GLSL declarations
+FRAME_CONSTANTS_FIELDS = [
+    ("vp", "mat4", 1),
+    ("lvp", "mat4", 1),
+    ("cameraPos", "vec3", 1),
+    ("lightPos", "vec3", 1),
+    ("lightDir", "vec3", 1),
+    ("lightColor", "vec3", 1),
+]
+MAX_JOINTS = 100
+JOINT_PALETTE_FIELDS = [("jointMatrices", "mat4", MAX_JOINTS)]
+MAX_CASCADES = 4
+# cascadeSplits holds the far view depth of each cascade
+SHADOW_CASCADES_FIELDS = [
+    ("cascadeViewProjections", "mat4", MAX_CASCADES),
+    ("cascadeSplits", "vec4", 1),
+    ("cameraForward", "vec3", 1),
+    ("cascadeCount", "int", 1),
+]
 
 model_vert_shader = """
     #version 330 core
@@ -29,24 +98,59 @@ model_vert_shader = """
     layout (location = 2) in vec2 aUV;
     layout (location = 3) in uvec4 aJointIDs;
     layout (location = 4) in vec4 aWeights;
-
-    uniform mat4 vp;
-    uniform mat4 lvp;
+    layout (location = 5) in mat4 aInstanceTransform;
+    layout (location = 9) in int aInstanceJointOffset;
+
+    layout(std140) uniform FrameConstants {
+        mat4 vp;
+        mat4 lvp;
+        vec3 cameraPos;
+        vec3 lightPos;
+        vec3 lightDir;
+        vec3 lightColor;
+    };
     uniform mat4 model;
     uniform mat4 inverseModel;
 
-    uniform mat4 jointMatrices[100];
+    layout(std140, row_major) uniform JointPalette {
+        mat4 jointMatrices[100];
+    };
 
     uniform bool hasAnimation;
 
+    // Instanced draws take the transform from the instance attributes and the joints from jointTexture,
+    // four row texels per matrix starting at the instance's joint offset (-1 when it is not animated)
+    uniform bool instanced;
+    uniform samplerBuffer jointTexture;
+
     out vec3 fragPos;
     out vec4 lightFragPos;
     out vec3 normal;
     out vec2 uv;
 
+    mat4 instanceJoint(uint joint) {
+        int texel = (aInstanceJointOffset + int(joint)) * 4;
+        return transpose(mat4(
+            texelFetch(jointTexture, texel), texelFetch(jointTexture, texel + 1),
+            texelFetch(jointTexture, texel + 2), texelFetch(jointTexture, texel + 3)));
+    }
+
     void main() {
         mat4 skinMatrix = mat4(1);
-        if (hasAnimation) {
+        mat4 world = model;
+        mat3 normalMatrix = mat3(inverseModel);
+        if (instanced) {
+            world = model * aInstanceTransform;
+            normalMatrix = transpose(inverse(mat3(world)));
+            if (aInstanceJointOffset >= 0) {
+                skinMatrix =
+                aWeights.x * instanceJoint(aJointIDs.x) +
+                aWeights.y * instanceJoint(aJointIDs.y) +
+                aWeights.z * instanceJoint(aJointIDs.z) +
+                aWeights.w * instanceJoint(aJointIDs.w);
+            }
+        }
+        else if (hasAnimation) {
             skinMatrix =
             aWeights.x * jointMatrices[aJointIDs.x] +
             aWeights.y * jointMatrices[aJointIDs.y] +
@@ -54,10 +158,10 @@ model_vert_shader = """
             aWeights.w * jointMatrices[aJointIDs.w];
         }
 
-        mat4 fullTransform = model * skinMatrix;
+        mat4 fullTransform = world * skinMatrix;
         fragPos = vec3(fullTransform * vec4(aPos, 1.0));
         gl_Position = vp * vec4(fragPos, 1.0);
-        normal = mat3(inverseModel) * mat3(skinMatrix) * aNormal;
+        normal = normalMatrix * mat3(skinMatrix) * aNormal;
         uv = aUV;
 
         lightFragPos = lvp * vec4(fragPos, 1.0);
@@ -69,15 +173,29 @@ model_frag_shader = """
 
     out vec4 FragColor;
 
-    uniform vec3 cameraPos;
-    uniform vec3 lightPos;
+    layout(std140) uniform FrameConstants {
+        mat4 vp;
+        mat4 lvp;
+        vec3 cameraPos;
+        vec3 lightPos;
+        vec3 lightDir;
+        vec3 lightColor;
+    };
+
+    layout(std140) uniform ShadowCascades {
+        mat4 cascadeViewProjections[4];
+        vec4 cascadeSplits;
+        vec3 cameraForward;
+        int cascadeCount;
+    };
 
     uniform vec3 color;
     uniform sampler2D diffuseTexture;
     uniform sampler2D shadowMap;
+    // Shadows come from the cascade covering the fragment's view depth instead of shadowMap
+    uniform bool cascaded;
+    uniform sampler2DArray shadowCascades;
     uniform bool hasDiffuseTex;
-    uniform vec3 lightDir;
-    uniform vec3 lightColor;
     uniform float shininess;
 
     in vec3 fragPos;
@@ -85,11 +203,23 @@ model_frag_shader = """
     in vec3 normal;
     in vec2 uv;
 
+    float shadowDepth(inout vec3 lightUV) {
+        if (!cascaded)
+            return texture(shadowMap, lightUV.xy).r;
+        float viewDepth = dot(fragPos - cameraPos, cameraForward);
+        int cascade = 0;
+        while (cascade < cascadeCount - 1 && viewDepth > cascadeSplits[cascade])
+            cascade++;
+        vec4 position = cascadeViewProjections[cascade] * vec4(fragPos, 1.0);
+        lightUV = position.xyz / position.w * 0.5 + 0.5;
+        return texture(shadowCascades, vec3(lightUV.xy, cascade)).r;
+    }
+
     float getShadowFactor(in vec3 lightUV, in vec3 N, in vec3 L) {
+        float depth = shadowDepth(lightUV);
         if (lightUV.z > 1)
             lightUV.z = 1;
         float bias = max(0.0003, mix(0.003, 0, abs(dot(N, L))));
-        float depth = texture(shadowMap, lightUV.xy).r;
         float sunHeight = dot(vec3(0, 1, 0), L);
         sunHeight = clamp(1 - sunHeight, 0.1, 0.6);
         return lightUV.z > depth + bias ? 1 - pow(sunHeight - 1, 2) : 1.0;
@@ -150,16 +280,18 @@ class Material:
         self.hasDiffuseTex: bool = False
         self.roughness: float = 0
         self.shininess: float = 32
+        self.imageIndex: int | None = None
 
 class PrimitiveEntry:
     def __init__(self):
         self.indexCount: int = 0
         self.indexOffset: int = 0
         self.vertexOffset: int = 0
+        self.vertexCount: int = 0
         self.materialIndex: int | None = None
         self.meshIndex: int = 0
 
-def init_materials(gltf, layout):
+def load_materials(gltf, layout) -> list[Material]:
     materials = []
     for entry in layout:
         m = Material()
@@ -182,19 +314,52 @@ def init_materials(gltf, layout):
         if color:
             m.baseColor = color[0:3]
         if texture:
-            image_index = gltf.textures[texture.index].source
-            image = gltf.images[image_index]
-            view = gltf.bufferViews[image.bufferView]
-            data = gltf.get_data_from_buffer_uri(gltf.buffers[view.buffer].uri)
-            image_data = data[view.byteOffset : view.byteOffset + view.byteLength]
-            img = Image.open(io.BytesIO(image_data)).convert("RGBA")
-            pixels = img.tobytes()
-            width, height = img.size
-            m.diffuseTexture = glTexture(width, height, GL_NEAREST, data=pixels)
-            m.hasDiffuseTex = True
+            m.imageIndex = gltf.textures[texture.index].source
         materials.append(m)
     return materials
 
+def used_image_indexes(gltf) -> list[int]:
+    # Read from the glTF JSON alone, so decoding can start before any mesh data is loaded
+    indexes = []
+    for mesh in gltf.meshes:
+        for primitive in mesh.primitives:
+            if primitive.material == None:
+                continue
+            pbr = gltf.materials[primitive.material].pbrMetallicRoughness
+            if pbr == None or pbr.baseColorTexture == None:
+                continue
+            index = gltf.textures[pbr.baseColorTexture.index].source
+            if index not in indexes:
+                indexes.append(index)
+    return indexes
+
+def decode_image(image_data) -> np.ndarray:
+    # Decoded RGBA pixels, shape (height, width, 4)
+    return np.asarray(Image.open(io.BytesIO(image_data)).convert("RGBA"))
+
+image_decoder: ThreadPoolExecutor | None = None
+
+def start_image_decoding(gltf) -> dict[int, Future]:
+    global image_decoder
+    if image_decoder == None:
+        image_decoder = ThreadPoolExecutor(max_workers=min(8, os.cpu_count() or 1), thread_name_prefix='ImageDecoder')
+    # Buffer views are sliced here on the loading thread, each image is submitted once however many materials share it
+    return {index: image_decoder.submit(decode_image, load_buffer_view(gltf, gltf.images[index].bufferView)) for index in used_image_indexes(gltf)}
+
+def upload_textures(materials: list[Material], images: dict[int, np.ndarray | Future]):
+    # Must run on the GL context thread; decodes still in flight are uploaded in the order they finish.
+    # Yields (image index, pixels) after each upload
+    pending = {image: index for index, image in images.items() if isinstance(image, Future)}
+    decoded = [(index, image) for index, image in images.items() if not isinstance(image, Future)]
+    textures = {}
+    for index, pixels in chain(decoded, ((pending[future], future.result()) for future in as_completed(pending))):
+        textures[index] = glTexture(pixels.shape[1], pixels.shape[0], GL_NEAREST, data=np.ascontiguousarray(pixels))
+        for m in materials:
+            if m.imageIndex == index:
+                m.diffuseTexture = textures[index]
+                m.hasDiffuseTex = True
+        yield index, pixels
+
 M_num_components = {
     "SCALAR": 1,
     "VEC2": 2,
@@ -214,59 +379,125 @@ M_dtype = {
     pygltflib.FLOAT: np.float32,
 }
 
+def load_buffer_data(gltf, bufferIndex: int) -> memoryview:
+    # Each buffer is decoded once per GLTF2 and shared as memoryview slices until release_buffer_data
+    if not hasattr(gltf, 'decodedBuffers'):
+        gltf.decodedBuffers = {}
+    data = gltf.decodedBuffers.get(bufferIndex)
+    if data is None:
+        data = memoryview(gltf.get_data_from_buffer_uri(gltf.buffers[bufferIndex].uri))
+        gltf.decodedBuffers[bufferIndex] = data
+    return data
+
+def load_buffer_view(gltf, bufferViewIndex: int) -> memoryview:
+    view = gltf.bufferViews[bufferViewIndex]
+    offset = view.byteOffset or 0
+    return load_buffer_data(gltf, view.buffer)[offset : offset + view.byteLength]
+
+def release_buffer_data(gltf):
+    if hasattr(gltf, 'decodedBuffers'):
+        del gltf.decodedBuffers
+
 def load_accessor_buffer(gltf, accessorIndex):
     accessor = gltf.accessors[accessorIndex]
     bufferView = gltf.bufferViews[accessor.bufferView]
-    buffer = gltf.buffers[bufferView.buffer]
-    data = gltf.get_data_from_buffer_uri(buffer.uri)
+    data = load_buffer_data(gltf, bufferView.buffer)
 
     offset = (bufferView.byteOffset or 0) + (accessor.byteOffset or 0)
     count = M_num_components[accessor.type]
-    buffer = np.frombuffer(data, dtype=M_dtype[accessor.componentType], count=accessor.count * count, offset=offset)
+    dtype = np.dtype(M_dtype[accessor.componentType])
+    if bufferView.byteStride and bufferView.byteStride != dtype.itemsize * count:
+        return np.ndarray((accessor.count, count), dtype=dtype, buffer=data, offset=offset, strides=(bufferView.byteStride, dtype.itemsize))
+    buffer = np.frombuffer(data, dtype=dtype, count=accessor.count * count, offset=offset)
     return np.reshape(buffer, (-1, count))
 
 def load_mesh_data(gltf) -> MeshData:
-    I = np.array([], dtype=np.uint32)
-    V = np.array([], dtype=np.float32)
-    N = np.array([], dtype=np.float32)
-    UV = np.array([], dtype=np.float32)
-    BID = np.array([], dtype=np.uint8)
-    W = np.array([], dtype=np.float32)
-
-    lastIndex = 0
+    primitives = [(i, primitive) for i, mesh in enumerate(gltf.meshes) for primitive in mesh.primitives]
+
+    # Sizing pass: accessor counts give every output size before anything is decoded
+    indexTotal = sum(gltf.accessors[primitive.indices].count for _, primitive in primitives)
+    vertexTotal = sum(gltf.accessors[primitive.attributes.POSITION].count for _, primitive in primitives)
+    hasUV = any(primitive.attributes.TEXCOORD_0 is not None for _, primitive in primitives)
+    hasJoints = any(primitive.attributes.JOINTS_0 is not None for _, primitive in primitives)
+    hasWeights = any(primitive.attributes.WEIGHTS_0 is not None for _, primitive in primitives)
+
+    I = np.empty(indexTotal, dtype=np.uint32)
+    V = np.empty((vertexTotal, 3), dtype=np.float32)
+    N = np.empty((vertexTotal, 3), dtype=np.float32)
+    UV = np.zeros((vertexTotal if hasUV else 0, 2), dtype=np.float32)
+    BID = np.zeros((vertexTotal if hasJoints else 0, 4), dtype=np.uint8)
+    W = np.zeros((vertexTotal if hasWeights else 0, 4), dtype=np.float32)
+    B = np.empty((len(primitives), 2, 3), dtype=np.float32)
 
     primitivesLayout: list[PrimitiveEntry] = []
-
-    for i, mesh in enumerate(gltf.meshes):
-        for primitive in mesh.primitives:
-            entry = PrimitiveEntry()
-            entry.meshIndex = i
-            entry.materialIndex = primitive.material
-            entry.vertexOffset = int(len(V) / 3)
-
-            I = np.append(I, load_accessor_buffer(gltf, primitive.indices))
-            N = np.append(N, load_accessor_buffer(gltf, primitive.attributes.NORMAL))
-            V = np.append(V, load_accessor_buffer(gltf, primitive.attributes.POSITION))
-            if primitive.attributes.TEXCOORD_0:
-                UV = np.append(UV, load_accessor_buffer(gltf, primitive.attributes.TEXCOORD_0))
-            if primitive.attributes.JOINTS_0:
-                BID = np.append(BID, load_accessor_buffer(gltf, primitive.attributes.JOINTS_0))
-            if primitive.attributes.WEIGHTS_0:
-                W = np.append(W, load_accessor_buffer(gltf, primitive.attributes.WEIGHTS_0))
-
-            assert len(N) == len(V)
-            assert N.dtype == np.float32
-            assert V.dtype == np.float32
-            if len(UV) > 0:
-                assert UV.dtype == np.float32
-
-            entry.indexOffset = lastIndex
-            entry.indexCount = len(I) - entry.indexOffset
-            lastIndex = len(I)
-
-            primitivesLayout.append(entry)
-
-    return MeshData(primitivesLayout, I, V, N, UV, BID, W)
+    indexOffset = 0
+    vertexOffset = 0
+
+    for i, primitive in primitives:
+        attributes = primitive.attributes
+        entry = PrimitiveEntry()
+        entry.meshIndex = i
+        entry.materialIndex = primitive.material
+        entry.vertexOffset = vertexOffset
+        entry.indexOffset = indexOffset
+
+        indices = load_accessor_buffer(gltf, primitive.indices)
+        entry.indexCount = indices.size
+        I[indexOffset : indexOffset + indices.size] = indices.reshape(-1)
+
+        positions = load_accessor_buffer(gltf, attributes.POSITION)
+        # glTF requires min/max on POSITION accessors, but not every exporter writes them
+        accessor = gltf.accessors[attributes.POSITION]
+        if accessor.min is not None and accessor.max is not None:
+            B[len(primitivesLayout)] = accessor.min, accessor.max
+        else:
+            B[len(primitivesLayout)] = positions.min(axis=0), positions.max(axis=0)
+        vertexEnd = vertexOffset + len(positions)
+        entry.vertexCount = len(positions)
+        V[vertexOffset : vertexEnd] = positions
+        N[vertexOffset : vertexEnd] = load_accessor_buffer(gltf, attributes.NORMAL)
+        if attributes.TEXCOORD_0 is not None:
+            UV[vertexOffset : vertexEnd] = load_accessor_buffer(gltf, attributes.TEXCOORD_0)
+        if attributes.JOINTS_0 is not None:
+            BID[vertexOffset : vertexEnd] = load_accessor_buffer(gltf, attributes.JOINTS_0)
+        if attributes.WEIGHTS_0 is not None:
+            W[vertexOffset : vertexEnd] = load_accessor_buffer(gltf, attributes.WEIGHTS_0)
+
+        indexOffset += indices.size
+        vertexOffset = vertexEnd
+        primitivesLayout.append(entry)
+
+    return MeshData(primitivesLayout, I, V, N, UV, BID, W, B)
+
+def make_animation(name: str, channels: list[AnimationChannel], samplerData) -> Animation:
+    # samplerData holds (interpolation, keyframe_times, keyframe_values) for every sampler of the animation
+    paths = {channel.sampler: channel.path for channel in channels}
+    samplers = []
+    duration = 0
+    for j, (interpolation, keyframe_times, keyframe_values) in enumerate(samplerData):
+        sampler = AnimationSampler(interpolation, keyframe_times, keyframe_values, paths.get(j, ''))
+        samplers.append(sampler)
+        if sampler.keyframe_times[-1] > duration:
+            duration = sampler.keyframe_times[-1]
+    return Animation(name, samplers, channels, duration, AnimationClip(samplers, channels))
+
+def order_nodes_root_first(nodes):
+    for node in nodes:
+        node.parent_index = -1
+    for i, node in enumerate(nodes):
+        for child_node_index in node.children:
+            nodes[child_node_index].parent_index = i
+    ordered_parent_indexes = {}
+    for i in range(len(nodes)):
+        def add_node(j):
+            if j in ordered_parent_indexes:
+                return
+            parent_index = nodes[j].parent_index
+            if parent_index >= 0:
+                add_node(parent_index)
+            ordered_parent_indexes[j] = 1
+        add_node(i)
+    return list(ordered_parent_indexes)
 
 def load_animations(gltf):
     if len(gltf.animations) == 0:
@@ -276,21 +507,10 @@ def load_animations(gltf):
 
     animations = []
     for i, anim in enumerate(gltf.animations):
-        samplers = []
-        channels = []
-        duration = 0
-        for sampler in anim.samplers:
-            keyframe_times = load_accessor_buffer(gltf, sampler.input)
-            keyframe_values = load_accessor_buffer(gltf,sampler.output)
-            samplers.append(AnimationSampler(sampler.interpolation, keyframe_times, keyframe_values))
-            if keyframe_times[-1] > duration:
-                duration = keyframe_times[-1]
-        for chnl in anim.channels:
-            channels.append(AnimationChannel(chnl.sampler, chnl.target.node, chnl.target.path))
-        
+        channels = [AnimationChannel(chnl.sampler, chnl.target.node, chnl.target.path) for chnl in anim.channels]
+        samplerData = [(sampler.interpolation, load_accessor_buffer(gltf, sampler.input), load_accessor_buffer(gltf, sampler.output)) for sampler in anim.samplers]
         animNameIndexMap[anim.name] = i
-        a = Animation(anim.name, samplers, channels, duration)
-        animations.append(a)
+        animations.append(make_animation(anim.name, channels, samplerData))
 
     skins = []
     for skin in gltf.skins:
@@ -300,53 +520,388 @@ def load_animations(gltf):
         assert inverse_bind_matrices.dtype == np.float32
         skins.append(Skin(joints, inverse_bind_matrices))
 
-    def order_nodes_root_first(nodes):
-        for node in nodes:
-            node.parent_index = -1
-        for i, node in enumerate(nodes):
-            for child_node_index in node.children:
-                nodes[child_node_index].parent_index = i
-        ordered_parent_indexes = {}
-        for i in range(len(nodes)):
-            def add_node(j):
-                if j in ordered_parent_indexes:
-                    return
-                parent_index = nodes[j].parent_index
-                if parent_index >= 0:
-                    add_node(parent_index)
-                ordered_parent_indexes[j] = 1
-            add_node(i)
-        return list(ordered_parent_indexes)
-
     ordered_node_indexes = order_nodes_root_first(gltf.nodes)
-    root = gltf.nodes[ordered_node_indexes[0]]
-    if root.rotation is not None:
-        root.rotation = [root.rotation[3], root.rotation[0], root.rotation[1], root.rotation[2]]
     return animNameIndexMap, animations, skins, ordered_node_indexes
 
+# Everything Model needs from a glTF file, in the form the preprocessed cache stores it
+ModelAsset = namedtuple('ModelAsset', 'meshData nodes materials images animationData')
+
+NODE_FIELDS = ('mesh', 'skin', 'children', 'translation', 'rotation', 'scale')
+MESH_ARRAYS = ('indices', 'vertices', 'normals', 'uvs', 'boneIDs', 'weights', 'bounds')
+
+def pack_model_asset(asset: ModelAsset) -> tuple[dict, dict[str, np.ndarray]]:
+    meshData = asset.meshData
+    arrays = {name: getattr(meshData, name) for name in MESH_ARRAYS}
+    header = {
+        'layout': [[e.meshIndex, e.materialIndex, e.vertexOffset, e.vertexCount, e.indexOffset, e.indexCount] for e in meshData.primitivesLayout],
+        'nodes': [{field: getattr(node, field) for field in NODE_FIELDS} for node in asset.nodes],
+        'materials': [[list(m.baseColor), m.roughness, m.shininess, m.imageIndex] for m in asset.materials],
+        'images': list(asset.images),
+        'animations': [],
+        'skins': None,
+        'ordered_node_indexes': None,
+    }
+    for index, pixels in asset.images.items():
+        arrays[f'image{index}'] = pixels
+
+    animNameIndexMap, animations, skins, ordered_node_indexes = asset.animationData
+    for i, anim in enumerate(animations):
+        header['animations'].append({
+            'name': anim.name,
+            'channels': [list(channel) for channel in anim.channels],
+            'interpolations': [sampler.interpolation for sampler in anim.samplers],
+        })
+        for j, sampler in enumerate(anim.samplers):
+            arrays[f'anim{i}.times{j}'] = sampler.keyframe_times
+            arrays[f'anim{i}.values{j}'] = sampler.keyframe_values
+    if skins != None:
+        header['skins'] = [skin.joints for skin in skins]
+        header['ordered_node_indexes'] = ordered_node_indexes
+        for i, skin in enumerate(skins):
+            arrays[f'skin{i}'] = skin.inverse_bind_matrices
+    return header, arrays
+
+def unpack_model_asset(header: dict, arrays: dict[str, np.ndarray], withAnimations: bool = True) -> ModelAsset:
+    layout = []
+    for meshIndex, materialIndex, vertexOffset, vertexCount, indexOffset, indexCount in header['layout']:
+        entry = PrimitiveEntry()
+        entry.meshIndex, entry.materialIndex = meshIndex, materialIndex
+        entry.vertexOffset, entry.vertexCount = vertexOffset, vertexCount
+        entry.indexOffset, entry.indexCount = indexOffset, indexCount
+        layout.append(entry)
+    meshData = MeshData(layout, *[arrays[name] for name in MESH_ARRAYS])
+
+    nodes = [pygltflib.Node(**node) for node in header['nodes']]
+    materials = []
+    for baseColor, roughness, shininess, imageIndex in header['materials']:
+        m = Material()
+        m.baseColor, m.roughness, m.shininess, m.imageIndex = baseColor, roughness, shininess, imageIndex
+        materials.append(m)
+    images = {index: arrays[f'image{index}'] for index in header['images']}
+
+    animationData = None
+    if withAnimations and len(header['animations']) > 0:
+        animNameIndexMap = {}
+        animations = []
+        for i, anim in enumerate(header['animations']):
+            channels = [AnimationChannel(*channel) for channel in anim['channels']]
+            samplerData = [(interpolation, arrays[f'anim{i}.times{j}'], arrays[f'anim{i}.values{j}']) for j, interpolation in enumerate(anim['interpolations'])]
+            animNameIndexMap[anim['name']] = i
+            animations.append(make_animation(anim['name'], channels, samplerData))
+        skins = [Skin(joints, np.array(arrays[f'skin{i}'])) for i, joints in enumerate(header['skins'])]
+        order_nodes_root_first(nodes)
+        animationData = (animNameIndexMap, animations, skins, header['ordered_node_indexes'])
+    elif withAnimations:
+        animationData = ({}, [], None, None)
+    return ModelAsset(meshData, nodes, materials, images, animationData)
+
+# Primitives of one glTF material drawn with a single glMultiDrawElementsBaseVertex; entries are their layout indexes
+StaticBatch = namedtuple('StaticBatch', 'material counts offsets baseVertices entries')
+
+def build_static_batches(meshData: MeshData, materials: list[Material], modelMats: dict, skinnedMeshes: set[int]):
+    # Bakes each non-skinned primitive's node matrix into its vertices and groups those primitives by material.
+    # Returns the baked mesh data, the batches and the layout indexes left to draw one by one
+    vertices = np.array(meshData.vertices, dtype=np.float32)
+    normals = np.array(meshData.normals, dtype=np.float32)
+    groups: dict[int | None, list[int]] = {}
+    dynamic = []
+    for i, entry in enumerate(meshData.primitivesLayout):
+        if entry.meshIndex in skinnedMeshes:
+            dynamic.append(i)
+            continue
+        matrix = np.array(modelMats[entry.meshIndex], dtype=np.float32)
+        rows = slice(entry.vertexOffset, entry.vertexOffset + entry.vertexCount)
+        vertices[rows] = vertices[rows] @ matrix[:3, :3].T + matrix[:3, 3]
+        normals[rows] = normals[rows] @ np.linalg.inv(matrix[:3, :3])
+        groups.setdefault(entry.materialIndex, []).append(i)
+
+    layout = meshData.primitivesLayout
+    batches = []
+    for indexes in groups.values():
+        batches.append(StaticBatch(
+            materials[indexes[0]],
+            np.array([layout[i].indexCount for i in indexes], dtype=np.int32),
+            np.array([4 * layout[i].indexOffset for i in indexes], dtype=np.uintp),
+            np.array([layout[i].vertexOffset for i in indexes], dtype=np.int32),
+            np.array(indexes),
+        ))
+    return meshData._replace(vertices=vertices, normals=normals), batches, dynamic
+
+def primitive_matrices(world: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+    # World and normal matrices of row-major world matrices, stored column-major as glUniformMatrix4fv reads them.
+    # The row-major inverse is already the column-major inverse transpose
+    return np.ascontiguousarray(world.transpose(0, 2, 1), dtype=np.float32), np.linalg.inv(world).astype(np.float32)
+
+# Frames per second of every clip sampled to fit the culling boxes of skinned primitives
+SKINNED_BOUNDS_RATE = 30
+
+def skinned_bounds(vertices: np.ndarray, boneIDs: np.ndarray, weights: np.ndarray, jointMatrices: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+    # Box around every position the vertices reach under jointMatrices (frames, joints, 4, 4). A skinned vertex is a
+    # weighted average of its joints' transforms of it, so it stays inside the union of every joint's transformed box
+    # of the vertices it influences
+    influenced = weights > 0
+    ids = boneIDs[influenced].astype(np.int64)
+    positions = np.broadcast_to(vertices[:, None], influenced.shape + (3,))[influenced]
+    jointCount = jointMatrices.shape[1]
+    mins = np.full((jointCount, 3), np.inf)
+    maxs = np.full((jointCount, 3), -np.inf)
+    np.minimum.at(mins, ids, positions)
+    np.maximum.at(maxs, ids, positions)
+    used = np.flatnonzero(np.isfinite(mins[:, 0]))
+    if len(used) == 0:
+        return vertices.min(axis=0), vertices.max(axis=0)
+
+    corners = np.stack([np.where([(corner >> axis) & 1 for axis in range(3)], maxs[used], mins[used]) for corner in range(8)])
+    matrices = jointMatrices[:, used]
+    reached = np.einsum('fuij,cuj->fcui', matrices[..., :3, :3], corners) + matrices[:, None, :, :3, 3]
+    return reached.min(axis=(0, 1, 2)), reached.max(axis=(0, 1, 2))
+
+# Per-instance attributes of an instanced draw: column-major transform at locations 5-8, joint offset at location 9
+INSTANCE_DTYPE = np.dtype([('transform', np.float32, 16), ('jointOffset', np.int32)])
+
+class SharedMesh:
+    # GPU buffers, textures and node data of one file, shared by every Model loaded from it
+    def __init__(self, path: str, static: bool):
+        self.path: str = path
+        self.static: bool = static
+        self.ready: bool = False
+        # Models holding this mesh; the GL objects are deleted with the last one
+        self.users: int = 0
+        # Models created while the first load of the file was still streaming in
+        self.waiting: list = []
+        self.vao = None
+        self.vbos: glBuffers | None = None
+        self.layout: list[PrimitiveEntry] = []
+        self.materials: list[Material] = []
+        self.nodes = []
+        self.modelMats: dict[int, glm.mat4] = {}
+        # Node matrix of every primitive, row-major, after an identity at index 0 that stands for the bare transform
+        self.nodeMatrices: np.ndarray = np.eye(4)[None]
+        # Local center/extent box of every primitive
+        self.boundsCenters: np.ndarray = np.zeros((0, 3))
+        self.boundsExtents: np.ndarray = np.zeros((0, 3))
+        self.staticBatches: list[StaticBatch] = []
+        self.dynamicEntries: list[int] = []
+        # Created when the mesh is first drawn instanced
+        self.instanceBuffer: glVertexBuffer | None = None
+        self.jointTexture: glTextureBuffer | None = None
+        self.instances: np.ndarray = np.empty(0, dtype=INSTANCE_DTYPE)
+        self.instanceModels: list = []
+        self.skinnedInstances: int = 0
+        self.instanceNodeMatrices: tuple[np.ndarray, np.ndarray] | None = None
+
+    def enableInstancing(self):
+        self.instanceBuffer = glVertexBuffer(None, INSTANCE_DTYPE.itemsize, GL_STREAM_DRAW)
+        self.jointTexture = glTextureBuffer(JOINT_TEXTURE_SLOT)
+        self.instanceNodeMatrices = primitive_matrices(self.nodeMatrices)
+        glBindVertexArray(self.vao)
+        self.instanceBuffer.bind()
+        stride = INSTANCE_DTYPE.itemsize
+        for column in range(4):
+            glEnableVertexAttribArray(5 + column)
+            glVertexAttribPointer(5 + column, 4, GL_FLOAT, GL_FALSE, stride, ctypes.c_void_p(16 * column))
+            glVertexAttribDivisor(5 + column, 1)
+        glEnableVertexAttribArray(9)
+        glVertexAttribIPointer(9, 1, GL_INT, stride, ctypes.c_void_p(INSTANCE_DTYPE.fields['jointOffset'][1]))
+        glVertexAttribDivisor(9, 1)
+        glBindVertexArray(0)
+
+    def setBounds(self, meshData: MeshData, skinnedMeshes: set[int], skeleton: Skeleton | None, animations: list):
+        # Skinned primitives are culled with a box around both their bind pose and every frame of every clip
+        minimum, maximum = meshData.bounds[:, 0].astype(np.float64), meshData.bounds[:, 1].astype(np.float64)
+        if skeleton != None and len(meshData.boneIDs) > 0:
+            jointMatrices = np.concatenate([BakedClip(animation.clip, skeleton, float(animation.duration[0]), SKINNED_BOUNDS_RATE).jointMatrices for animation in animations])
+            for i, entry in enumerate(self.layout):
+                if entry.meshIndex not in skinnedMeshes:
+                    continue
+                vertices = slice(entry.vertexOffset, entry.vertexOffset + entry.vertexCount)
+                low, high = skinned_bounds(meshData.vertices[vertices], meshData.boneIDs[vertices], meshData.weights[vertices], jointMatrices)
+                minimum[i] = np.minimum(minimum[i], low)
+                maximum[i] = np.maximum(maximum[i], high)
+        self.boundsCenters = (minimum + maximum) / 2
+        self.boundsExtents = (maximum - minimum) / 2
+
+    def prepareInstances(self, models: list):
+        # Once per frame, after the animation update; every pass then uploads the instances it sees
+        if self.instanceBuffer == None:
+            self.enableInstancing()
+        instances = np.empty(len(models), dtype=INSTANCE_DTYPE)
+        instances['transform'] = np.array([model.transform.getMatrix().to_list() for model in models], dtype=np.float32).reshape(-1, 16)
+        instances['jointOffset'] = -1
+        palettes = []
+        jointCount = 0
+        for i, model in enumerate(models):
+            if model.animating and len(model.jointMatrices) > 0:
+                instances['jointOffset'][i] = jointCount
+                palettes.append(model.jointMatrices)
+                jointCount += len(model.jointMatrices)
+        if len(palettes) > 0:
+            self.jointTexture.setData(np.concatenate(palettes).astype(np.float32, copy=False))
+        self.instances = instances
+        self.instanceModels = models
+        self.skinnedInstances = len(palettes)
+
+    def queueInstancedDraws(self, queue: RenderQueue, visible: np.ndarray | None = None):
+        # visible holds one flag per instance. model holds only the node matrix here; the shader multiplies in each instance transform
+        instances = self.instances
+        if visible is not None:
+            queue.markCulled(int(len(instances) - np.count_nonzero(visible)) * len(self.layout))
+            instances = instances[visible]
+        if len(instances) == 0:
+            return
+        # Orphans the previous pass's data, which the GPU may still be reading
+        self.instanceBuffer.setBuffer(instances, instances.nbytes)
+
+        palette = self.jointTexture if self.skinnedInstances > 0 else None
+        worldMatrices, normalMatrices = self.instanceNodeMatrices
+        for i, entry in enumerate(self.layout):
+            queue.push(self.vao, palette, self.materials[i], entry.indexCount, entry.indexOffset, entry.vertexOffset, worldMatrices[i + 1], normalMatrices[i + 1], len(instances))
+
+    def delete(self):
+        # Also frees what a load cut short has made so far, and leaves the mesh ready to be loaded again
+        if self.vbos != None:
+            self.vbos.delete()
+            self.vbos = None
+        if self.vao != None:
+            glDeleteVertexArrays(1, [self.vao])
+            self.vao = None
+        if self.instanceBuffer != None:
+            self.instanceBuffer.delete()
+            self.jointTexture.delete()
+            self.instanceBuffer = None
+            self.jointTexture = None
+        textures = {id(material.diffuseTexture): material.diffuseTexture for material in self.materials if material.hasDiffuseTex}
+        for texture in textures.values():
+            texture.delete()
+        self.materials = []
+
 class Model:
     shader: glShaderProgram
+    # Clips and skeleton by path, shared by every mesh of the file and dropped with the last of them
+    animationData: dict[str, tuple] = {}
+    # Read and write a preprocessed <path>.modelcache next to each asset instead of parsing the glTF every launch
+    useCache: bool = True
+    # Meshes by (path, static); a Model of an already loaded file reuses its GPU buffers instead of loading it again
+    sharedMeshes: dict[tuple[str, bool], SharedMesh] = {}
+    # Draw non-static models that share a mesh with one instanced call per primitive
+    instancing: bool = True
     @staticmethod
     def CompileShader():
         Model.shader = glShaderProgram(model_vert_shader, model_frag_shader)
 
-    def __init__(self, path: str):
+    def __init__(self, path: str, streamed: bool = False, static: bool = False):
         from GameObjectSystem import GameObjectSystem
         GameObjectSystem.AddModelObject(self)
+        self.path: str = path
         self.transform = Transform()
+        self.jointMatrices = []
+        self.animating = False
+        self.pose: Pose | None = None
+        self.mesh: SharedMesh | None = None
+        self.jointPalette: glUniformBuffer | None = None
+        # Per-primitive matrices in SharedMesh.nodeMatrices order, rebuilt when transform.version moves on
+        self.worldMatrices: np.ndarray | None = None
+        self.normalMatrices: np.ndarray | None = None
+        # World center/extent box of every primitive, rebuilt with the matrices
+        self.boundsCenters: np.ndarray | None = None
+        self.boundsExtents: np.ndarray | None = None
+        self.matrixVersion: int = -1
+        # Ids of the primitive boxes in GameObjectSystem.spatialIndex, in layout order
+        self.indexItems: np.ndarray | None = None
+        # False until every GPU resource exists; render passes skip the model before that
+        self.ready: bool = False
+        self.onReady: list = []
+        # Seconds spent in each loading stage, printed once the model is ready
+        self.loadTimes: dict[str, float] = {}
+        self.writeCache: bool = False
+        # Static models bake node matrices into their vertices and draw each material with one multi-draw call.
+        # Their Transform is applied after the node matrices
+        self.static: bool = static
+
+        key = (path, static)
+        mesh = Model.sharedMeshes.get(key)
+        if mesh != None and mesh.ready:
+            self.attachMesh(mesh)
+        elif mesh != None and streamed:
+            self.mesh = mesh
+            mesh.waiting.append(self)
+        else:
+            self.mesh = SharedMesh(path, static)
+            # A blocking load racing a streamed one of the same file keeps its own copy
+            if mesh == None:
+                Model.sharedMeshes[key] = self.mesh
+            if streamed:
+                from ModelLoader import ModelLoader
+                ModelLoader.Submit(self)
+            else:
+                for _ in self.uploadSteps(self.loadAsset()):
+                    pass
+
+    @staticmethod
+    def loadAsync(path: str, onReady = None, static: bool = False) -> "Model":
+        # Returns at once; parsing runs on the ModelLoader thread and ModelLoader.Update uploads over the next frames.
+        # The transform can be set straight away, but an Animator needs the clips, so create it in onReady
+        model = Model(path, streamed=True, static=static)
+        if onReady != None:
+            model.onReady.append(onReady)
+        return model
+
+    def loadAsset(self, streamed: bool = False) -> ModelAsset:
+        # No GL calls here, so streamed models run this on a background thread
+        path = self.path
+        start = time.perf_counter()
+        if Model.useCache:
+            cached = read_model_cache(path)
+            if cached != None:
+                asset = unpack_model_asset(*cached, withAnimations=path not in Model.animationData)
+                self.markLoadStage('cache', start)
+                return asset
 
         gltf = pygltflib.GLTF2().load(path)
         if gltf == None:
             raise RuntimeError(f"Failed to load {path}")
+        images = start_image_decoding(gltf)
+        start = self.markLoadStage('parse', start)
 
         meshData = load_mesh_data(gltf)
-        self.layout = meshData.primitivesLayout
-        self.animNameIndexMap, self.animations, self.skins, self.ordered_node_indexes = load_animations(gltf)
-        self.nodes = gltf.nodes
-
-        self.modelMats = {}
-
-        for node in self.nodes:
+        start = self.markLoadStage('mesh', start)
+        animationData = load_animations(gltf) if Model.useCache or path not in Model.animationData else None
+        start = self.markLoadStage('animation', start)
+        materials = load_materials(gltf, meshData.primitivesLayout)
+        asset = ModelAsset(meshData, gltf.nodes, materials, images, animationData)
+        release_buffer_data(gltf)
+        start = self.markLoadStage('materials', start)
+
+        self.writeCache = Model.useCache
+        if streamed:
+            # Finish decoding off the context thread, which then only has uploads left
+            asset = asset._replace(images={index: image.result() for index, image in images.items()})
+            start = self.markLoadStage('textures', start)
+            self.saveCache(asset)
+        return asset
+
+    def saveCache(self, asset: ModelAsset):
+        if self.writeCache:
+            start = time.perf_counter()
+            write_model_cache(self.path, *pack_model_asset(asset))
+            self.markLoadStage('cache write', start)
+            self.writeCache = False
+
+    def uploadSteps(self, asset: ModelAsset):
+        # Must run on the GL context thread; yields after every texture and buffer upload so the work can be spread over frames
+        path = self.path
+        mesh = self.mesh
+        start = time.perf_counter()
+        meshData = asset.meshData
+        mesh.layout = meshData.primitivesLayout
+        # Models loaded from the same file share clips and skeleton so their animators can be batched
+        if path not in Model.animationData:
+            animNameIndexMap, animations, skins, ordered_node_indexes = asset.animationData
+            skeleton = Skeleton(asset.nodes, skins, ordered_node_indexes) if len(animations) > 0 else None
+            Model.animationData[path] = (animNameIndexMap, animations, skins, ordered_node_indexes, skeleton)
+        mesh.nodes = asset.nodes
+
+        for node in mesh.nodes:
             if node.mesh is None:
                 continue
             T = glm.mat4()
@@ -359,75 +914,161 @@ class Model:
                 R = glm.mat4_cast(glm.quat(node.rotation[3], node.rotation[0], node.rotation[1], node.rotation[2]))
             if node.scale is not None:
                 S = glm.scale(glm.mat4(1.0), glm.vec3(node.scale))
-            self.modelMats[node.mesh] = glm.mat4(T * R * S)
-
-        self.materials = init_materials(gltf, self.layout)
-
-        self.vbos = glBuffers(6)
-
-        self.vao = glGenVertexArrays(1)
-        glBindVertexArray(self.vao)
-
-        self.vbos.setVertexBuffer(1, meshData.vertices, meshData.vertices.nbytes, GL_STATIC_DRAW)
-        glEnableVertexAttribArray(0)
-        glVertexAttribPointer(0, 3, GL_FLOAT, GL_FALSE, 0, ctypes.c_void_p(0))
-
-        self.vbos.setVertexBuffer(2, meshData.normals, meshData.normals.nbytes, GL_STATIC_DRAW)
-        glEnableVertexAttribArray(1)
-        glVertexAttribPointer(1, 3, GL_FLOAT, GL_FALSE, 0, ctypes.c_void_p(0))
-
-        if len(meshData.uvs) > 0:
-            self.vbos.setVertexBuffer(3, meshData.uvs, meshData.uvs.nbytes, GL_STATIC_DRAW)
-            glEnableVertexAttribArray(2)
-            glVertexAttribPointer(2, 2, GL_FLOAT, GL_FALSE, 0, ctypes.c_void_p(0))
-
-        if len(meshData.boneIDs) > 0:
-            self.vbos.setVertexBuffer(4, meshData.boneIDs, meshData.boneIDs.nbytes, GL_STATIC_DRAW)
-            glEnableVertexAttribArray(3)
-            glVertexAttribIPointer(3, 4, GL_UNSIGNED_BYTE, 0, ctypes.c_void_p(0))
-
-        if len(meshData.weights) > 0:
-            self.vbos.setVertexBuffer(5, meshData.weights, meshData.weights.nbytes, GL_STATIC_DRAW)
-            glEnableVertexAttribArray(4)
-            glVertexAttribPointer(4, 4, GL_FLOAT, GL_FALSE, 0, ctypes.c_void_p(0))
-
-        self.vbos.setIndexBuffer(0, meshData.indices, meshData.indices.size, GL_STATIC_DRAW)
-
-        self.jointMatrices = []
-        self.animating = False
+            mesh.modelMats[node.mesh] = glm.mat4(T * R * S)
+        mesh.nodeMatrices = np.array([np.eye(4)] + [np.array(mesh.modelMats[entry.meshIndex]) for entry in mesh.layout])
+
+        skinnedMeshes = {node.mesh for node in mesh.nodes if node.mesh is not None and node.skin is not None}
+        _, animations, _, _, skeleton = Model.animationData[path]
+        mesh.setBounds(meshData, skinnedMeshes, skeleton, animations)
+        mesh.materials = asset.materials
+        if self.static:
+            meshData, mesh.staticBatches, mesh.dynamicEntries = build_static_batches(meshData, mesh.materials, mesh.modelMats, skinnedMeshes)
+
+        images = {}
+        for index, pixels in upload_textures(mesh.materials, asset.images):
+            images[index] = pixels
+            self.markLoadStage('textures', start)
+            yield
+            start = time.perf_counter()
+        self.saveCache(asset._replace(images=images))
+        start = time.perf_counter()
+
+        mesh.vbos = glBuffers(6)
+        mesh.vao = glGenVertexArrays(1)
+
+        attributes = [
+            (1, 0, meshData.vertices, 3, GL_FLOAT),
+            (2, 1, meshData.normals, 3, GL_FLOAT),
+            (3, 2, meshData.uvs, 2, GL_FLOAT),
+            (4, 3, meshData.boneIDs, 4, GL_UNSIGNED_BYTE),
+            (5, 4, meshData.weights, 4, GL_FLOAT),
+        ]
+        for bufferIndex, location, data, size, type in attributes:
+            if len(data) == 0:
+                continue
+            glBindVertexArray(mesh.vao)
+            mesh.vbos.setVertexBuffer(bufferIndex, data, data.nbytes, GL_STATIC_DRAW)
+            glEnableVertexAttribArray(location)
+            if type == GL_UNSIGNED_BYTE:
+                glVertexAttribIPointer(location, size, type, 0, ctypes.c_void_p(0))
+            else:
+                glVertexAttribPointer(location, size, type, GL_FALSE, 0, ctypes.c_void_p(0))
+            glBindVertexArray(0)
+            self.markLoadStage('upload', start)
+            yield
+            start = time.perf_counter()
+
+        glBindVertexArray(mesh.vao)
+        mesh.vbos.setIndexBuffer(0, meshData.indices, meshData.indices.size, GL_STATIC_DRAW)
         glBindVertexArray(0)
+        self.markLoadStage('upload', start)
+
+        stages = ', '.join(f'{name} {seconds * 1000:.1f}ms' for name, seconds in self.loadTimes.items())
+        print(f'Loaded {path} in {sum(self.loadTimes.values()) * 1000:.1f}ms ({stages})')
+        mesh.ready = True
+        self.attachMesh(mesh)
+        waiting, mesh.waiting = mesh.waiting, []
+        for model in waiting:
+            model.attachMesh(mesh)
+
+    def attachMesh(self, mesh: SharedMesh):
+        # Only the pose and its joint palette are per model
+        self.mesh = mesh
+        mesh.users += 1
+        self.animNameIndexMap, self.animations, self.skins, self.ordered_node_indexes, skeleton = Model.animationData[self.path]
+        self.pose = Pose(skeleton) if skeleton != None else None
+        if self.pose != None:
+            self.jointPalette = glUniformBuffer("JointPalette", JOINT_PALETTE_FIELDS)
+
+        self.ready = True
+        for callback in self.onReady:
+            callback(self)
+
+    def markLoadStage(self, name: str, start: float) -> float:
+        now = time.perf_counter()
+        self.loadTimes[name] = self.loadTimes.get(name, 0) + now - start
+        return now
 
     def delete(self):
-        self.vbos.delete()
-        glDeleteVertexArrays(1, [self.vao])
-
-    from Camera import Camera
-    def render(self, shader: glShaderProgram, camera: Camera):
-        m = camera.projectionMat * camera.getViewMatrix()
-
-        shader.setUniformMat4("vp", 1, m.to_list())
-        if self.animating:
-            shader.setUniform1i("hasAnimation", 1)
-            shader.setUniformMat4("jointMatrices", len(self.jointMatrices), np.array(self.jointMatrices), GL_TRUE)
+        mesh = self.mesh
+        if self.indexItems is not None:
+            from GameObjectSystem import GameObjectSystem
+            GameObjectSystem.spatialIndex.remove(self.indexItems)
+            self.indexItems = None
+        if self.pose != None:
+            self.pose.release()
+        if self.jointPalette != None:
+            self.jointPalette.delete()
+
+        if not self.ready:
+            if self in mesh.waiting:
+                mesh.waiting.remove(self)
+                return
+            from ModelLoader import ModelLoader
+            ModelLoader.Cancel(self)
+            # A model waiting on this load takes it over, and starts it again on an emptied mesh
+            if len(mesh.waiting) > 0:
+                mesh.delete()
+                ModelLoader.Submit(mesh.waiting.pop(0))
+                return
         else:
-            shader.setUniform1i("hasAnimation", 0)
-
-        shader.setUniform3f("cameraPos", camera.position)
-
-        transformMatrix = self.transform.getMatrix()
-
-        glBindVertexArray(self.vao)
-        for i, entry in enumerate(self.layout):
-            shader.setUniform3f("color", self.materials[i].baseColor)
-            shader.setUniform1f("shininess", self.materials[i].shininess)
-            model = self.modelMats[entry.meshIndex] * transformMatrix
-            shader.setUniformMat4("model", 1, model.to_list())
-            inverseModel = glm.transpose(glm.inverse(model))
-            shader.setUniformMat4("inverseModel", 1, inverseModel.to_list())
-
-            shader.setUniform1i("hasDiffuseTex", self.materials[i].hasDiffuseTex)
-            if self.materials[i].hasDiffuseTex:
-                self.materials[i].diffuseTexture.bind(0)
-                shader.setUniform1i("diffuseTexture", 0)
-
-            glDrawElementsBaseVertex(GL_TRIANGLES, entry.indexCount, GL_UNSIGNED_INT, ctypes.c_void_p(4 * entry.indexOffset), entry.vertexOffset)
+            mesh.users -= 1
+            if mesh.users > 0:
+                return
+
+        mesh.delete()
+        key = (mesh.path, mesh.static)
+        if Model.sharedMeshes.get(key) is mesh:
+            del Model.sharedMeshes[key]
+        # A later load of the file then reads its clips again, and sees any change made to it
+        if not any(path == mesh.path for path, _ in Model.sharedMeshes):
+            Model.animationData.pop(mesh.path, None)
+
+    def uploadJointPalette(self):
+        # Once per frame, after the animation update; every pass then only binds the buffer
+        if self.animating:
+            self.jointPalette.set("jointMatrices", np.asarray(self.jointMatrices, dtype=np.float32))
+            self.jointPalette.upload()
+
+    def updateMatrices(self):
+        # One vectorized rebuild per transform change, shared by every pass
+        if self.matrixVersion == self.transform.version:
+            return
+        self.matrixVersion = self.transform.version
+        mesh = self.mesh
+        transform = np.array(self.transform.getMatrix())
+        world = mesh.nodeMatrices @ transform
+        self.worldMatrices, self.normalMatrices = primitive_matrices(world)
+        boundsMatrices = world[1:]
+        if self.static:
+            # Batched primitives are drawn from vertices with their node matrix baked in, under the bare transform
+            boundsMatrices = transform @ mesh.nodeMatrices[1:]
+            boundsMatrices[mesh.dynamicEntries] = world[1:][mesh.dynamicEntries]
+        self.boundsCenters, self.boundsExtents = transform_bounds(boundsMatrices, mesh.boundsCenters, mesh.boundsExtents)
+
+    def queueDraws(self, queue: RenderQueue, visible: np.ndarray | None = None):
+        # visible holds one flag per primitive, or None to draw them all.
+        # vp and cameraPos come from the FrameConstants block, the joints from this model's JointPalette block
+        mesh = self.mesh
+        palette = self.jointPalette if self.animating else None
+        self.updateMatrices()
+        worldMatrices, normalMatrices = self.worldMatrices, self.normalMatrices
+        if visible is None:
+            visible = np.ones(len(mesh.layout), dtype=bool)
+
+        if self.static:
+            for batch in mesh.staticBatches:
+                # Culled primitives are dropped from the multi-draw arrays
+                batchVisible = visible[batch.entries]
+                queue.markCulled(len(batch.entries) - int(np.count_nonzero(batchVisible)))
+                if np.all(batchVisible):
+                    queue.push(mesh.vao, None, batch.material, batch.counts, batch.offsets, batch.baseVertices, worldMatrices[0], normalMatrices[0])
+                elif np.any(batchVisible):
+                    queue.push(mesh.vao, None, batch.material, batch.counts[batchVisible], batch.offsets[batchVisible], batch.baseVertices[batchVisible], worldMatrices[0], normalMatrices[0])
+
+        for i in mesh.dynamicEntries if self.static else range(len(mesh.layout)):
+            if not visible[i]:
+                queue.markCulled(1)
+                continue
+            entry = mesh.layout[i]
+            queue.push(mesh.vao, palette, mesh.materials[i], entry.indexCount, entry.indexOffset, entry.vertexOffset, worldMatrices[i + 1], normalMatrices[i + 1])
@@ -0,0 +1,107 @@
+import hashlib
+import json
+import os
+import numpy as np
+
+# Layout: MAGIC, uint64 header size, JSON header, then every array aligned to ALIGNMENT bytes
+MAGIC = b'PYGMODL1'
+VERSION = 3
+ALIGNMENT = 64
+
+def model_cache_path(path: str) -> str:
+    return path + '.modelcache'
+
+def align(size: int) -> int:
+    return -(-size // ALIGNMENT) * ALIGNMENT
+
+def source_hash(path: str) -> str:
+    with open(path, 'rb') as file:
+        return hashlib.sha1(file.read()).hexdigest()
+
+def source_matches(path: str, source: dict) -> bool:
+    stat = os.stat(path)
+    if stat.st_size != source['size']:
+        return False
+    # A checkout can touch the mtime without changing the file, so only then fall back to hashing
+    return stat.st_mtime_ns == source['mtime'] or source_hash(path) == source['sha1']
+
+def rewrite_header(cache: str, header: dict, size: int) -> bool:
+    # In place and padded with spaces to the old size, so the arrays after it stay where they are
+    data = json.dumps(header).encode()
+    if len(data) > size:
+        return False
+    try:
+        with open(cache, 'r+b') as file:
+            file.seek(len(MAGIC) + 8)
+            file.write(data.ljust(size))
+    except OSError:
+        return False
+    return True
+
+def write_model_cache(path: str, header: dict, arrays: dict[str, np.ndarray]) -> bool:
+    # Returns whether the cache was written; a read-only or full asset directory only costs the cache
+    stat = os.stat(path)
+    header = dict(header, version=VERSION, arrays={})
+    header['source'] = {'sha1': source_hash(path), 'mtime': stat.st_mtime_ns, 'size': stat.st_size}
+
+    arrays = {name: np.ascontiguousarray(array) for name, array in arrays.items()}
+    offset = 0
+    for name, array in arrays.items():
+        header['arrays'][name] = [array.dtype.str, list(array.shape), offset]
+        offset += align(array.nbytes)
+
+    data = json.dumps(header).encode()
+    start = align(len(MAGIC) + 8 + len(data))
+    cache = model_cache_path(path)
+    temporary = cache + '.tmp'
+    # Written beside the final file and moved into place, so a reader never sees a half written cache
+    try:
+        with open(temporary, 'wb') as file:
+            file.write(MAGIC)
+            file.write(np.uint64(len(data)).tobytes())
+            file.write(data)
+            for name, array in arrays.items():
+                file.seek(start + header['arrays'][name][2])
+                file.write(array.tobytes())
+            file.truncate(start + offset)
+        os.replace(temporary, cache)
+    except OSError as error:
+        print(f"Could not write {cache}: {error}")
+        try:
+            os.remove(temporary)
+        except OSError:
+            pass
+        return False
+    return True
+
+def read_model_cache(path: str) -> tuple[dict, dict[str, np.ndarray]] | None:
+    cache = model_cache_path(path)
+    if not os.path.exists(cache) or os.path.getsize(cache) < len(MAGIC) + 8:
+        return None
+
+    # A truncated or corrupt file is a miss like a stale one; the next write replaces it
+    try:
+        memory = np.memmap(cache, dtype=np.uint8, mode='r')
+        if bytes(memory[:len(MAGIC)]) != MAGIC:
+            return None
+        size = int(memory[len(MAGIC) : len(MAGIC) + 8].view(np.uint64)[0])
+        header = json.loads(bytes(memory[len(MAGIC) + 8 : len(MAGIC) + 8 + size]))
+        if header.get('version') != VERSION or not source_matches(path, header['source']):
+            return None
+
+        # Arrays are read-only views into the mapping, nothing is copied until it is used
+        start = align(len(MAGIC) + 8 + size)
+        arrays = {}
+        for name, (dtype, shape, offset) in header['arrays'].items():
+            dtype = np.dtype(dtype)
+            nbytes = int(np.prod(shape)) * dtype.itemsize
+            arrays[name] = memory[start + offset : start + offset + nbytes].view(dtype).reshape(shape)
+    except (OSError, ValueError, KeyError, TypeError, AttributeError):
+        return None
+
+    mtime = os.stat(path).st_mtime_ns
+    if header['source']['mtime'] != mtime:
+        # Matched by hash; storing the new mtime saves hashing the file again on every later launch
+        header['source']['mtime'] = mtime
+        rewrite_header(cache, header, size)
+    return header, arrays
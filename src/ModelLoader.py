@@ -0,0 +1,74 @@
+import time
+from typing import Generator
+from concurrent.futures import Future, ThreadPoolExecutor
+from Model import Model
+
+class ModelLoader:
+    # Seconds of GPU upload work Update may spend per frame
+    uploadBudget: float = 0.004
+    executor: ThreadPoolExecutor | None = None
+    # Models whose asset is still being parsed on the loader thread
+    loading: list[tuple[Model, Future]] = []
+    # Models whose asset is ready, with the upload steps still left to run
+    uploading: list[tuple[Model, Generator]] = []
+
+    def __init__(self):
+        raise RuntimeError("ModelLoader cannot be created!")
+
+    @staticmethod
+    def SetUp(uploadBudget: float = 0.004):
+        ModelLoader.uploadBudget = uploadBudget
+        ModelLoader.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='ModelLoader')
+        ModelLoader.loading = []
+        ModelLoader.uploading = []
+
+    @staticmethod
+    def ShutDown():
+        if ModelLoader.executor != None:
+            ModelLoader.executor.shutdown(wait=True, cancel_futures=True)
+            ModelLoader.executor = None
+        ModelLoader.loading = []
+        ModelLoader.uploading = []
+
+    @staticmethod
+    def Submit(model: Model):
+        if ModelLoader.executor == None:
+            raise RuntimeError("ModelLoader is not set up!")
+        future = ModelLoader.executor.submit(model.loadAsset, True)
+        ModelLoader.loading.append((model, future))
+
+    @staticmethod
+    def Cancel(model: Model):
+        for entry in ModelLoader.loading:
+            if entry[0] is model:
+                entry[1].cancel()
+        ModelLoader.loading = [entry for entry in ModelLoader.loading if entry[0] is not model]
+        ModelLoader.uploading = [entry for entry in ModelLoader.uploading if entry[0] is not model]
+
+    @staticmethod
+    def Pending() -> int:
+        return len(ModelLoader.loading) + len(ModelLoader.uploading)
+
+    @staticmethod
+    def Update():
+        deadline = time.perf_counter() + ModelLoader.uploadBudget
+
+        loading = []
+        for model, future in ModelLoader.loading:
+            if future.done():
+                # Re-raises a failed load on the main thread
+                ModelLoader.uploading.append((model, model.uploadSteps(future.result())))
+            else:
+                loading.append((model, future))
+        ModelLoader.loading = loading
+
+        # At least one step runs every frame so a step longer than the budget cannot stall a model forever
+        uploading = ModelLoader.uploading
+        while len(uploading) > 0:
+            model, steps = uploading[0]
+            try:
+                next(steps)
+            except StopIteration:
+                uploading.pop(0)
+            if time.perf_counter() >= deadline:
+                break
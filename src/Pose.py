@@ -0,0 +1,256 @@
+import numpy as np
+
+def quat_to_mat3(q, out=None):
+    # q: (..., 4) quaternions in w-first order
+    w, x, y, z = q[..., 0], q[..., 1], q[..., 2], q[..., 3]
+    if out is None:
+        out = np.empty(q.shape[:-1] + (3, 3), dtype=np.float32)
+    xx, yy, zz = x * x, y * y, z * z
+    xy, xz, yz = x * y, x * z, y * z
+    wx, wy, wz = w * x, w * y, w * z
+    out[..., 0, 0] = 1 - 2 * (yy + zz)
+    out[..., 0, 1] = 2 * (xy - wz)
+    out[..., 0, 2] = 2 * (xz + wy)
+    out[..., 1, 0] = 2 * (xy + wz)
+    out[..., 1, 1] = 1 - 2 * (xx + zz)
+    out[..., 1, 2] = 2 * (yz - wx)
+    out[..., 2, 0] = 2 * (xz - wy)
+    out[..., 2, 1] = 2 * (yz + wx)
+    out[..., 2, 2] = 1 - 2 * (xx + yy)
+    return out
+
+def slerp(a, b, t, out=None):
+    # Batched glm.slerp over (..., 4) quaternions, shortest path
+    cos_theta = np.einsum('...i,...i->...', a, b)
+    sign = np.where(cos_theta < 0, -1, 1).astype(np.float32)
+    cos_theta = cos_theta * sign
+    t = np.broadcast_to(t, cos_theta.shape)
+
+    angle = np.arccos(np.clip(cos_theta, -1, 1))
+    sin_angle = np.sin(angle)
+    near = cos_theta > 1 - np.finfo(np.float32).eps
+    safe = np.where(near, 1, sin_angle)
+    wa = np.where(near, 1 - t, np.sin((1 - t) * angle) / safe)
+    wb = np.where(near, t, np.sin(t * angle) / safe) * sign
+
+    if out is None:
+        out = np.empty(np.broadcast_shapes(a.shape, b.shape), dtype=np.float32)
+    np.multiply(a, wa[..., np.newaxis], out=out)
+    out += b * wb[..., np.newaxis]
+    return out
+
+def compose_local_matrices(translations, rotations, scales, out=None):
+    # Batched T * R * S for (..., N) nodes, row-major (..., N, 4, 4)
+    if out is None:
+        out = np.zeros(translations.shape[:-1] + (4, 4), dtype=np.float32)
+        out[..., 3, 3] = 1
+    quat_to_mat3(rotations, out[..., :3, :3])
+    out[..., :3, :3] *= scales[..., np.newaxis, :]
+    out[..., :3, 3] = translations
+    return out
+
+def compose_world_matrices(local, levels: list[np.ndarray], parents: np.ndarray, out=None):
+    # Parents are always resolved one level before their children
+    if out is None:
+        out = np.empty_like(local)
+    roots = levels[0]
+    out[..., roots, :, :] = local[..., roots, :, :]
+    for level in levels[1:]:
+        out[..., level, :, :] = out[..., parents[level], :, :] @ local[..., level, :, :]
+    return out
+
+def node_levels(parents: np.ndarray, ordered_node_indexes: list[int]) -> list[np.ndarray]:
+    depth = np.zeros(len(parents), dtype=np.int32)
+    for i in ordered_node_indexes:
+        if parents[i] >= 0:
+            depth[i] = depth[parents[i]] + 1
+    ordered = np.array(ordered_node_indexes, dtype=np.int64)
+    return [ordered[depth[ordered] == d] for d in range(depth.max() + 1)]
+
+class Skeleton:
+    def __init__(self, nodes, skins, ordered_node_indexes: list[int]):
+        self.nodeCount: int = len(nodes)
+        self.parents = np.array([node.parent_index for node in nodes], dtype=np.int64)
+        self.levels: list[np.ndarray] = node_levels(self.parents, ordered_node_indexes)
+
+        self.restTranslations = np.zeros((self.nodeCount, 3), dtype=np.float32)
+        self.restRotations = np.zeros((self.nodeCount, 4), dtype=np.float32)
+        self.restRotations[:, 0] = 1
+        self.restScales = np.ones((self.nodeCount, 3), dtype=np.float32)
+        for i, node in enumerate(nodes):
+            if node.translation is not None:
+                self.restTranslations[i] = node.translation
+            if node.rotation is not None:
+                x, y, z, w = node.rotation
+                self.restRotations[i] = (w, x, y, z)
+            if node.scale is not None:
+                self.restScales[i] = node.scale
+
+        # Only the first skin drives jointMatrices
+        self.joints = np.array(skins[0].joints if skins else [], dtype=np.int64)
+        self.inverseBindMatrices = np.array(skins[0].inverse_bind_matrices if skins else np.zeros((0, 4, 4)), dtype=np.float32)
+
+        self.pool: PosePool = PosePool(self)
+
+    def __getstate__(self):
+        # Workers receive the topology only; the pool stays with the process that owns it
+        state = self.__dict__.copy()
+        del state['pool']
+        return state
+
+POOL_ARRAYS = ('translations', 'rotations', 'scales', 'jointMatrices')
+
+def attach_shared_array(name: str, shape: tuple):
+    from multiprocessing import shared_memory
+    block = shared_memory.SharedMemory(name=name)
+    return np.ndarray(shape, dtype=np.float32, buffer=block.buf), block
+
+class PosePool:
+    # Pose arrays of every instance sharing a skeleton, so crowds can be evaluated as one batch
+    def __init__(self, skeleton: Skeleton, capacity: int = 4):
+        self.skeleton: Skeleton = skeleton
+        self.capacity: int = 0
+        self.poses: list = []
+        self.free: list[int] = []
+        # Shared memory blocks backing the arrays once the pool is handed to worker processes
+        self.sharedBlocks: list | None = None
+        self.retiredBlocks: list = []
+        self.generation: int = 0
+        self.translations = np.zeros((0, skeleton.nodeCount, 3), dtype=np.float32)
+        self.rotations = np.zeros((0, skeleton.nodeCount, 4), dtype=np.float32)
+        self.scales = np.zeros((0, skeleton.nodeCount, 3), dtype=np.float32)
+        self.jointMatrices = np.zeros((0, len(skeleton.joints), 4, 4), dtype=np.float32)
+        self.grow(capacity)
+
+    def newArray(self, shape: tuple, blocks: list | None):
+        if blocks is None:
+            return np.empty(shape, dtype=np.float32)
+        from multiprocessing import shared_memory
+        block = shared_memory.SharedMemory(create=True, size=max(1, int(np.prod(shape)) * 4))
+        blocks.append(block)
+        return np.ndarray(shape, dtype=np.float32, buffer=block.buf)
+
+    def grow(self, capacity: int, shared: bool | None = None):
+        skeleton = self.skeleton
+        shared = self.sharedBlocks is not None if shared is None else shared
+        blocks = [] if shared else None
+        rests = (skeleton.restTranslations, skeleton.restRotations, skeleton.restScales, np.identity(4, dtype=np.float32))
+        for name, rest in zip(POOL_ARRAYS, rests):
+            array = getattr(self, name)
+            grown = self.newArray((capacity,) + array.shape[1:], blocks)
+            grown[:len(array)] = array
+            grown[len(array):] = rest
+            setattr(self, name, grown)
+        self.releaseShared()
+        self.sharedBlocks = blocks
+        self.generation += 1
+
+        self.free.extend(range(capacity - 1, self.capacity - 1, -1))
+        self.poses.extend([None] * (capacity - self.capacity))
+        self.capacity = capacity
+
+        for slot, pose in enumerate(self.poses):
+            if pose is not None:
+                pose.bind(slot)
+
+    def share(self) -> list[str]:
+        if self.sharedBlocks is None:
+            self.grow(self.capacity, shared=True)
+        return [block.name for block in self.sharedBlocks]
+
+    def unshare(self):
+        if self.sharedBlocks is not None:
+            self.grow(self.capacity, shared=False)
+
+    def attach(self, names: list[str], capacity: int):
+        # Worker side: map the arrays another process shares
+        self.releaseShared(unlink=False)
+        self.sharedBlocks = []
+        self.capacity = capacity
+        for name, shmName in zip(POOL_ARRAYS, names):
+            shape = (capacity,) + getattr(self, name).shape[1:]
+            array, block = attach_shared_array(shmName, shape)
+            setattr(self, name, array)
+            self.sharedBlocks.append(block)
+
+    def releaseShared(self, unlink: bool = True):
+        if self.sharedBlocks is None:
+            return
+        if unlink:
+            for block in self.sharedBlocks:
+                block.unlink()
+        # Old views may still be alive (e.g. a Model's jointMatrices), so a block is only closed once nothing references it
+        retired = []
+        for block in self.sharedBlocks + self.retiredBlocks:
+            try:
+                block.close()
+            except BufferError:
+                retired.append(block)
+        self.retiredBlocks = retired
+        self.sharedBlocks = None
+
+    def allocate(self, pose) -> int:
+        if len(self.free) == 0:
+            self.grow(self.capacity * 2)
+        slot = self.free.pop()
+        self.poses[slot] = pose
+        self.translations[slot] = self.skeleton.restTranslations
+        self.rotations[slot] = self.skeleton.restRotations
+        self.scales[slot] = self.skeleton.restScales
+        return slot
+
+    def release(self, slot: int):
+        self.poses[slot] = None
+        self.free.append(slot)
+
+    def writeClip(self, slots: np.ndarray, clip, values: np.ndarray):
+        rows, nodes = clip.rows, clip.nodes
+        slots = slots[:, np.newaxis]
+        self.translations[slots, nodes['translation']] = values[:, rows['translation'], :3]
+        self.rotations[slots, nodes['rotation']] = values[:, rows['rotation']]
+        self.scales[slots, nodes['scale']] = values[:, rows['scale'], :3]
+
+    def blendClip(self, slots: np.ndarray, clip, values: np.ndarray, weights: np.ndarray):
+        rows, nodes = clip.rows, clip.nodes
+        slots = slots[:, np.newaxis]
+        weights = weights[:, np.newaxis]
+        current = self.translations[slots, nodes['translation']]
+        self.translations[slots, nodes['translation']] = current + (values[:, rows['translation'], :3] - current) * weights[..., np.newaxis]
+        self.rotations[slots, nodes['rotation']] = slerp(self.rotations[slots, nodes['rotation']], values[:, rows['rotation']], weights)
+        self.scales[slots, nodes['scale']] = values[:, rows['scale'], :3]
+
+    def evaluate(self, slots: np.ndarray):
+        skeleton = self.skeleton
+        local = compose_local_matrices(self.translations[slots], self.rotations[slots], self.scales[slots])
+        world = compose_world_matrices(local, skeleton.levels, skeleton.parents)
+        self.jointMatrices[slots] = world[:, skeleton.joints] @ skeleton.inverseBindMatrices
+
+class Pose:
+    def __init__(self, skeleton: Skeleton):
+        self.skeleton: Skeleton = skeleton
+        self.pool: PosePool = skeleton.pool
+        self.slot: int = self.pool.allocate(self)
+        self.bind(self.slot)
+
+        n = skeleton.nodeCount
+        self.local = np.zeros((n, 4, 4), dtype=np.float32)
+        self.local[:, 3, 3] = 1
+        self.world = np.empty((n, 4, 4), dtype=np.float32)
+
+    def bind(self, slot: int):
+        pool = self.pool
+        self.slot = slot
+        self.translations = pool.translations[slot]
+        self.rotations = pool.rotations[slot]
+        self.scales = pool.scales[slot]
+        self.jointMatrices = pool.jointMatrices[slot]
+
+    def release(self):
+        self.pool.release(self.slot)
+
+    def evaluate(self) -> np.ndarray:
+        skeleton = self.skeleton
+        compose_local_matrices(self.translations, self.rotations, self.scales, self.local)
+        compose_world_matrices(self.local, skeleton.levels, skeleton.parents, self.world)
+        np.matmul(self.world[skeleton.joints], skeleton.inverseBindMatrices, out=self.jointMatrices)
+        return self.jointMatrices
@@ -1,6 +1,10 @@
 from opengl_util import *
 from pyglm import glm
 
+# Texture unit of the quad texture array, and the layer of quads that do not use it
+LAYER_TEXTURE_SLOT = 4
+NO_LAYER = -1
+
 class Quad:
     def __init__(self, size: glm.vec2 = glm.vec2(1.0), pos: glm.vec3 = glm.vec3(0.0), rotation: glm.quat = glm.quat(glm.vec3(0))):
         self.size: glm.vec3 = glm.vec3(size[0], size[1], 0)
@@ -8,6 +12,8 @@ class Quad:
         self.rotation: glm.quat = rotation
         self.vertices = np.array([glm.vec3(0.0)] * 4)
         self.updateVertices()
+        # Layer in the quad texture array, or NO_LAYER to sample what onRender binds
+        self.layer: int = NO_LAYER
 
         self.onRender = lambda quad, shader: None
 
@@ -18,19 +24,170 @@ class Quad:
         self.vertices[2] = self.rotation * (glm.vec3(hsize[0], -hsize[1], hsize[2])) + self.pos
         self.vertices[3] = self.rotation * (glm.vec3(-hsize[0], -hsize[1], hsize[2])) + self.pos
 
+# Corner order of drawQuad's vertices, drawn as triangles (0, 1, 3) and (0, 2, 3)
+QUAD_INDICES = np.array([0, 1, 3, 0, 2, 3], dtype=np.uint32)
+# Memory Layout of a quad vertex:
+#   (loc = 0) position: 3 x f32 = 12bytes
+#   (loc = 2) uv: 2 x f32 = 8bytes
+#   (loc = 13) texture layer: 1 x f32 = 4bytes
+QUAD_VERTEX_FLOATS = 6
+QUAD_FLOATS = 4 * QUAD_VERTEX_FLOATS
+# Corners as (x, y) signs of the half size, and the (u, v) columns of a (u0, v0, u1, v1) rect each one takes
+QUAD_CORNERS = np.array([[1, 1, 0], [-1, 1, 0], [1, -1, 0], [-1, -1, 0]], dtype=np.float32)
+QUAD_CORNER_U = [2, 0, 2, 0]
+QUAD_CORNER_V = [3, 3, 1, 1]
+FULL_UV_RECT = np.array([[0, 0, 1, 1]], dtype=np.float32)
+FULL_UVS = FULL_UV_RECT[0, np.stack([QUAD_CORNER_U, QUAD_CORNER_V], axis=1)]
+
+# Rotations are quaternions in glm's (w, x, y, z) order, so list(quat) can be stored as is
+QUAD_DTYPE = np.dtype([
+    ('position', np.float32, 3),
+    ('size', np.float32, 2),
+    ('rotation', np.float32, 4),
+    ('uvRect', np.float32, 4),
+    ('layer', np.int32),
+])
+
+# Billboards turn about every axis to face the camera, or only about the world Y axis
+BILLBOARD_SPHERICAL = 0
+BILLBOARD_CYLINDRICAL = 1
+
+# One instance per billboard; the shaders place the unit quad's corners around center, facing cameraPos
+BILLBOARD_DTYPE = np.dtype([
+    ('center', np.float32, 3),
+    ('size', np.float32, 2),
+    ('mode', np.int32),
+    ('layer', np.int32),
+])
+
+def quad_indices(count: int) -> np.ndarray:
+    return (QUAD_INDICES + 4 * np.arange(count, dtype=np.uint32)[:, None]).reshape(-1)
+
+def cross(a: np.ndarray, b: np.ndarray) -> np.ndarray:
+    # np.cross without its per-call overhead, for arrays of 3 vectors that broadcast against each other
+    return np.stack([
+        a[..., 1] * b[..., 2] - a[..., 2] * b[..., 1],
+        a[..., 2] * b[..., 0] - a[..., 0] * b[..., 2],
+        a[..., 0] * b[..., 1] - a[..., 1] * b[..., 0],
+    ], axis=-1)
+
+def quad_corners(positions: np.ndarray, sizes: np.ndarray, rotations: np.ndarray) -> np.ndarray:
+    # (n, 4, 3) world corners, the same as Quad.updateVertices for every quad at once
+    local = QUAD_CORNERS * np.concatenate([sizes * 0.5, np.zeros((len(sizes), 1), dtype=np.float32)], axis=1)[:, None]
+    w, axis = rotations[:, None, 0:1], rotations[:, None, 1:]
+    twice = 2 * cross(axis, local)
+    return local + w * twice + cross(axis, twice) + positions[:, None]
+
+def quad_vertices(corners: np.ndarray, uvRects: np.ndarray, layers: np.ndarray) -> np.ndarray:
+    # (n, QUAD_FLOATS) rows in QuadRenderer's vertex layout
+    uvs = np.stack([uvRects[:, QUAD_CORNER_U], uvRects[:, QUAD_CORNER_V]], axis=2)
+    layers = np.broadcast_to(np.asarray(layers, dtype=np.float32).reshape(-1, 1, 1), (len(corners), 4, 1))
+    return np.concatenate([corners, np.broadcast_to(uvs, (len(corners), 4, 2)), layers], axis=2).reshape(-1, QUAD_FLOATS)
+
+class QuadBatch:
+    # Many quads with an optional render callback. Corners are generated for all quads at once when the batch is
+    # drawn after a change; edits made through the quads array directly must call markDirty
+    def __init__(self, capacity: int = 256):
+        self.quads: np.ndarray = np.zeros(capacity, dtype=QUAD_DTYPE)
+        self.count: int = 0
+        self.vertices: np.ndarray = np.zeros((0, QUAD_FLOATS), dtype=np.float32)
+        self.dirty: bool = True
+
+        # Batches without a callback are drawn together with the other quads, so they should use texture layers
+        self.onRender = None
+
+    def add(self, positions, sizes, rotations = None, uvRects = None, layers = NO_LAYER) -> np.ndarray:
+        # Returns the indexes of the new quads in quads
+        positions = np.asarray(positions, dtype=np.float32).reshape(-1, 3)
+        count = len(positions)
+        if self.count + count > len(self.quads):
+            quads = np.zeros(max(self.count + count, 2 * len(self.quads)), dtype=QUAD_DTYPE)
+            quads[:self.count] = self.quads[:self.count]
+            self.quads = quads
+        added = self.quads[self.count : self.count + count]
+        added['position'] = positions
+        added['size'] = np.asarray(sizes, dtype=np.float32).reshape(-1, 2)
+        added['rotation'] = (1, 0, 0, 0) if rotations is None else np.asarray(rotations, dtype=np.float32).reshape(-1, 4)
+        added['uvRect'] = FULL_UV_RECT if uvRects is None else np.asarray(uvRects, dtype=np.float32).reshape(-1, 4)
+        added['layer'] = layers
+        self.count += count
+        self.markDirty()
+        return np.arange(self.count - count, self.count)
+
+    def clear(self):
+        self.count = 0
+        self.markDirty()
+
+    def markDirty(self):
+        self.dirty = True
+
+    def getVertices(self) -> np.ndarray:
+        if self.dirty:
+            quads = self.quads[:self.count]
+            corners = quad_corners(quads['position'], quads['size'], quads['rotation'])
+            self.vertices = quad_vertices(corners, quads['uvRect'], quads['layer']).astype(np.float32)
+            self.dirty = False
+        return self.vertices
+
+class BillboardBatch:
+    # Billboards drawn with one instanced call per pass. The records are uploaded only after a change; edits made
+    # through the billboards array directly must call markDirty
+    def __init__(self, capacity: int = 256):
+        self.billboards: np.ndarray = np.zeros(capacity, dtype=BILLBOARD_DTYPE)
+        self.count: int = 0
+        self.dirty: bool = True
+        # Created by QuadRenderer on the first draw
+        self.vao = None
+        self.instanceBuffer: glVertexBuffer | None = None
+
+        self.onRender = None
+
+    def add(self, centers, sizes, modes = BILLBOARD_SPHERICAL, layers = NO_LAYER) -> np.ndarray:
+        # Returns the indexes of the new billboards in billboards
+        centers = np.asarray(centers, dtype=np.float32).reshape(-1, 3)
+        count = len(centers)
+        if self.count + count > len(self.billboards):
+            billboards = np.zeros(max(self.count + count, 2 * len(self.billboards)), dtype=BILLBOARD_DTYPE)
+            billboards[:self.count] = self.billboards[:self.count]
+            self.billboards = billboards
+        added = self.billboards[self.count : self.count + count]
+        added['center'] = centers
+        added['size'] = np.asarray(sizes, dtype=np.float32).reshape(-1, 2)
+        added['mode'] = modes
+        added['layer'] = layers
+        self.count += count
+        self.markDirty()
+        return np.arange(self.count - count, self.count)
+
+    def clear(self):
+        self.count = 0
+        self.markDirty()
+
+    def markDirty(self):
+        self.dirty = True
+
+    def delete(self):
+        if self.vao != None:
+            glDeleteVertexArrays(1, [self.vao])
+            self.instanceBuffer.delete()
+            self.vao = None
+
 class QuadRenderer:
-    def __init__(self, window: Window, quads_size: int = 4000):
+    def __init__(self, window: Window, quads_size: int = 4096 * QUAD_FLOATS):
+        # quads_size is the float capacity of one batch; a batch holds whole quads only
         self.quads_size = quads_size
-        self.vertexBuff = np.zeros(quads_size, dtype=np.float32)
-        self.indexBuff = np.zeros(quads_size, dtype=np.uint32)
+        self.maxQuads = quads_size // QUAD_FLOATS
+        self.vertexBuff = np.zeros(self.maxQuads * QUAD_FLOATS, dtype=np.float32)
         self.window = window
 
         self.vao = glGenVertexArrays(1)
-        self.vbo = glVertexBuffer(self.vertexBuff, self.vertexBuff.nbytes, GL_DYNAMIC_DRAW)
+        stride = QUAD_VERTEX_FLOATS * 4
+        # Batches are streamed into a ring and drawn with a base vertex, so the attribute pointers never change
+        self.vbo = glStreamBuffer(GL_ARRAY_BUFFER, self.vertexBuff.nbytes, alignment=stride)
 
         glBindVertexArray(self.vao)
+        self.vbo.bind()
 
-        stride = 5 * 4
         # Position (location = 0)
         glEnableVertexAttribArray(0)
         glVertexAttribPointer(0, 3, GL_FLOAT, GL_FALSE, stride, ctypes.c_void_p(0))
@@ -39,77 +196,104 @@ class QuadRenderer:
         glEnableVertexAttribArray(2)
         glVertexAttribPointer(2, 2, GL_FLOAT, GL_FALSE, stride, ctypes.c_void_p(3 * 4))
 
-        self.ibo = glIndexBuffer(self.indexBuff, self.indexBuff.size);
+        # Texture layer (location = 13)
+        glEnableVertexAttribArray(13)
+        glVertexAttribPointer(13, 1, GL_FLOAT, GL_FALSE, stride, ctypes.c_void_p(5 * 4))
+
+        # Every batch uses the same index pattern, so it is uploaded once
+        indices = quad_indices(self.maxQuads)
+        self.ibo = glIndexBuffer(indices, indices.size);
+        glBindVertexArray(0)
         self.vbIndex = 0
-        self.ibIndex = 0
         self.full = False
 
+        # Unit quad in drawQuad's corner order, which is also a triangle strip; billboards take their layer per instance
+        unitQuad = np.concatenate([QUAD_CORNERS * 0.5, FULL_UVS], axis=1).astype(np.float32)
+        self.unitQuad = glVertexBuffer(unitQuad, unitQuad.nbytes, GL_STATIC_DRAW)
+
     def clearBuffer(self):
         self.vbIndex = 0
-        self.ibIndex = 0
         self.full = False
 
     def drawQuad(self, q: Quad):
-        if self.vbIndex >= self.quads_size - 12 - 8:
-            self.full = True
-            return
-
-        if self.vbIndex >= self.quads_size - 6:
-            self.full = True
-            return
-
-        cur = self.vbIndex / 5;
-        self.indexBuff[self.ibIndex + 0] = cur + 0;
-        self.indexBuff[self.ibIndex + 1] = cur + 1;
-        self.indexBuff[self.ibIndex + 2] = cur + 3;
-        self.indexBuff[self.ibIndex + 3] = cur + 0;
-        self.indexBuff[self.ibIndex + 4] = cur + 2;
-        self.indexBuff[self.ibIndex + 5] = cur + 3;
-        self.ibIndex += 6;
-
-        # Memory Layout: 
-        #   (loc = 0) position: 3 x f32 = 12bytes
-        #   (loc = 2) uv: 2 x f32 = 8bytes
-
-        self.vertexBuff[self.vbIndex + 0] = q.vertices[0][0];
-        self.vertexBuff[self.vbIndex + 1] = q.vertices[0][1];
-        self.vertexBuff[self.vbIndex + 2] = q.vertices[0][2];
-
-        self.vertexBuff[self.vbIndex + 3] = 1;
-        self.vertexBuff[self.vbIndex + 4] = 1;
+        if self.full:
+            self.submit()
+        vertices = self.vertexBuff[self.vbIndex : self.vbIndex + QUAD_FLOATS].reshape(4, QUAD_VERTEX_FLOATS)
+        vertices[:, :3] = q.vertices
+        vertices[:, 3:5] = FULL_UVS
+        vertices[:, 5] = q.layer
+        self.vbIndex += QUAD_FLOATS
+        self.full = self.vbIndex == len(self.vertexBuff)
 
-        self.vertexBuff[self.vbIndex + 5] = q.vertices[1][0];
-        self.vertexBuff[self.vbIndex + 6] = q.vertices[1][1];
-        self.vertexBuff[self.vbIndex + 7] = q.vertices[1][2];
+    def drawBatch(self, batch: QuadBatch):
+        self.drawVertices(batch.getVertices())
 
-        self.vertexBuff[self.vbIndex + 8] = 0;
-        self.vertexBuff[self.vbIndex + 9] = 1;
+    def drawVertices(self, vertices: np.ndarray):
+        # Copies whole quads into the current batch, submitting each time it fills up
+        start = 0
+        while start < len(vertices):
+            if self.full:
+                self.submit()
+            count = min(len(vertices) - start, (len(self.vertexBuff) - self.vbIndex) // QUAD_FLOATS)
+            end = self.vbIndex + count * QUAD_FLOATS
+            self.vertexBuff[self.vbIndex : end] = vertices[start : start + count].reshape(-1)
+            self.vbIndex = end
+            self.full = self.vbIndex == len(self.vertexBuff)
+            start += count
 
-        self.vertexBuff[self.vbIndex + 10] = q.vertices[2][0];
-        self.vertexBuff[self.vbIndex + 11] = q.vertices[2][1];
-        self.vertexBuff[self.vbIndex + 12] = q.vertices[2][2];
-
-        self.vertexBuff[self.vbIndex + 13] = 1;
-        self.vertexBuff[self.vbIndex + 14] = 0;
+    def drawBillboards(self, batch: BillboardBatch):
+        # Expects the shader's billboard uniform to be set
+        if batch.count == 0:
+            return
+        if batch.vao == None:
+            self.createBillboardVAO(batch)
+        if batch.dirty:
+            batch.instanceBuffer.setBuffer(batch.billboards[:batch.count], batch.count * BILLBOARD_DTYPE.itemsize)
+            batch.dirty = False
+        glBindVertexArray(batch.vao)
+        glDrawArraysInstanced(GL_TRIANGLE_STRIP, 0, 4, batch.count)
+        glBindVertexArray(0)
 
-        self.vertexBuff[self.vbIndex + 15] = q.vertices[3][0];
-        self.vertexBuff[self.vbIndex + 16] = q.vertices[3][1];
-        self.vertexBuff[self.vbIndex + 17] = q.vertices[3][2];
+    def createBillboardVAO(self, batch: BillboardBatch):
+        batch.vao = glGenVertexArrays(1)
+        glBindVertexArray(batch.vao)
+        stride = 5 * 4
+        self.unitQuad.bind()
+        glEnableVertexAttribArray(0)
+        glVertexAttribPointer(0, 3, GL_FLOAT, GL_FALSE, stride, ctypes.c_void_p(0))
+        glEnableVertexAttribArray(2)
+        glVertexAttribPointer(2, 2, GL_FLOAT, GL_FALSE, stride, ctypes.c_void_p(3 * 4))
 
-        self.vertexBuff[self.vbIndex + 18] = 0;
-        self.vertexBuff[self.vbIndex + 19] = 0;
-        self.vbIndex += 20;
+        # Per instance: center (location = 10), size (location = 11), mode (location = 12), layer (location = 13)
+        stride = BILLBOARD_DTYPE.itemsize
+        batch.instanceBuffer = glVertexBuffer(None, 0, GL_DYNAMIC_DRAW)
+        glEnableVertexAttribArray(10)
+        glVertexAttribPointer(10, 3, GL_FLOAT, GL_FALSE, stride, ctypes.c_void_p(BILLBOARD_DTYPE.fields['center'][1]))
+        glVertexAttribDivisor(10, 1)
+        glEnableVertexAttribArray(11)
+        glVertexAttribPointer(11, 2, GL_FLOAT, GL_FALSE, stride, ctypes.c_void_p(BILLBOARD_DTYPE.fields['size'][1]))
+        glVertexAttribDivisor(11, 1)
+        glEnableVertexAttribArray(12)
+        glVertexAttribIPointer(12, 1, GL_INT, stride, ctypes.c_void_p(BILLBOARD_DTYPE.fields['mode'][1]))
+        glVertexAttribDivisor(12, 1)
+        glEnableVertexAttribArray(13)
+        glVertexAttribPointer(13, 1, GL_INT, GL_FALSE, stride, ctypes.c_void_p(BILLBOARD_DTYPE.fields['layer'][1]))
+        glVertexAttribDivisor(13, 1)
+        glBindVertexArray(0)
 
     def submit(self):
-        glBindVertexArray(self.vao)
-        self.vbo.setBuffer(self.vertexBuff, self.vertexBuff.nbytes)
-        self.ibo.setBuffer(self.indexBuff, self.indexBuff.size)
-
-        glDrawElements(GL_TRIANGLES, self.ibIndex, GL_UNSIGNED_INT, None)
+        quadCount = self.vbIndex // QUAD_FLOATS
+        if quadCount > 0:
+            # Only the quads written since the last submit are uploaded
+            offset = self.vbo.write(self.vertexBuff[:self.vbIndex])
+            glBindVertexArray(self.vao)
+            glDrawElementsBaseVertex(GL_TRIANGLES, 6 * quadCount, GL_UNSIGNED_INT, None, offset // (QUAD_VERTEX_FLOATS * 4))
+            glBindVertexArray(0)
         self.vbIndex = 0;
-        self.ibIndex = 0;
+        self.full = False
 
     def delete(self):
         glDeleteVertexArrays(1, [self.vao])
         self.vbo.delete()
         self.ibo.delete()
+        self.unitQuad.delete()
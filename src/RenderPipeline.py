@@ -1,33 +1,101 @@
 from opengl_util import *
+from pyglm import glm
+import math
+from Camera import Camera, OrthogonalCameraState
+from Model import SHADOW_CASCADES_FIELDS, MAX_CASCADES
+
+def split_depths(first: float, last: float, count: int, blend: float) -> list[float]:
+    # Far view depth of each of count slices between first and last, blending even (0) and logarithmic (1) spacing
+    splits = []
+    for slice in range(1, count + 1):
+        fraction = slice / count
+        split = first + (last - first) * fraction
+        if blend > 0 and first > 0:
+            split = glm.mix(split, first * (last / first) ** fraction, blend)
+        splits.append(split)
+    return splits
 
 """
 RenderPipeline:
     ShadowPass
+    CascadedShadowPass
     ScenePass
     PostProcessingPass
 """
 
 class ShadowPass:
+    # Static casters are rendered into a cached map, which is copied into the shadow map every frame before the
+    # dynamic casters are drawn over it. The cache, and the light matrix every part of the frame uses, are only
+    # renewed when the light turns more than angleThreshold radians, the focus moves more than recenterDistance
+    # from the map's center, the projection changes or a static model changes
+    caching: bool = True
+
     def __init__(self, shaderProgram: glShaderProgram, width: int, height: int):
-        self.shadowMap = glFramebuffer(shaderProgram, width, height)
-        self.shadowMap.bind()
-        self.shadowMapTexture = glTexture(
-                self.shadowMap.width, self.shadowMap.height, 
+        self.shadowMap, self.shadowMapTexture = ShadowPass.createDepthMap(shaderProgram, width, height)
+        self.staticMap, self.staticMapTexture = ShadowPass.createDepthMap(shaderProgram, width, height)
+
+        self.angleThreshold: float = 0.005
+        self.recenterDistance: float = 4.0
+        self.lightPosition: glm.vec3 | None = None
+        self.center: glm.vec3 = glm.vec3(0)
+        self.projection: glm.mat4 = glm.mat4(1)
+        self.staticVersion: int = -1
+        self.viewProjection: glm.mat4 = glm.mat4(1)
+        self.staticDirty: bool = True
+        # Static map renders since start up, shown in the window title
+        self.staticUpdates: int = 0
+
+    @staticmethod
+    def createDepthMap(shaderProgram: glShaderProgram, width: int, height: int) -> tuple[glFramebuffer, glTexture]:
+        depthMap = glFramebuffer(shaderProgram, width, height)
+        depthMap.bind()
+        depthMapTexture = glTexture(
+                depthMap.width, depthMap.height, 
                 GL_NEAREST, format=GL_DEPTH_COMPONENT, type=GL_FLOAT, mipmap=False, wrapStyle=GL_CLAMP_TO_BORDER, internal=GL_DEPTH_COMPONENT16)
-        self.shadowMap.attachTexture(self.shadowMapTexture, attachment=GL_DEPTH_ATTACHMENT)
+        depthMap.attachTexture(depthMapTexture, attachment=GL_DEPTH_ATTACHMENT)
 
         glDrawBuffer(GL_NONE)
         glReadBuffer(GL_NONE)
 
-        if not self.shadowMap.isCompleted():
+        if not depthMap.isCompleted():
             raise RuntimeError("Imcompleted framebuffer")
 
-        self.shadowMap.unbind()
+        depthMap.unbind()
+        return depthMap, depthMapTexture
+
+    def setLight(self, lightPosition: glm.vec3, focus: glm.vec3, projection: glm.mat4, staticVersion: int) -> glm.mat4:
+        # lightPosition is relative to focus. Returns the light view-projection to render and sample shadows with
+        direction = glm.normalize(lightPosition)
+        if (not ShadowPass.caching or self.lightPosition == None or
+                glm.dot(direction, glm.normalize(self.lightPosition)) < glm.cos(self.angleThreshold) or
+                glm.distance(focus, self.center) > self.recenterDistance or
+                projection != self.projection or staticVersion != self.staticVersion):
+            self.lightPosition = glm.vec3(lightPosition)
+            self.center = glm.vec3(focus)
+            self.projection = glm.mat4(projection)
+            self.staticVersion = staticVersion
+
+            forward = -direction
+            rotation = glm.quatLookAt(forward, glm.vec3(0, 1, 0))
+            target = lightPosition + forward
+            view = glm.lookAt(lightPosition + focus, target + focus, rotation * glm.vec3(0, 1, 0))
+            self.viewProjection = projection * view
+            self.staticDirty = True
+        return self.viewProjection
+
+    def bindStatic(self):
+        self.staticMap.bind()
+        glViewport(0, 0, self.staticMap.width, self.staticMap.height)
+        glClear(GL_DEPTH_BUFFER_BIT)
+        self.staticDirty = False
+        self.staticUpdates += 1
 
     def bind(self):
+        # Starts from the cached static depth instead of a cleared map
+        glBindFramebuffer(GL_READ_FRAMEBUFFER, self.staticMap.fbo)
         self.shadowMap.bind()
+        glBlitFramebuffer(0, 0, self.staticMap.width, self.staticMap.height, 0, 0, self.shadowMap.width, self.shadowMap.height, GL_DEPTH_BUFFER_BIT, GL_NEAREST)
         glViewport(0, 0, self.shadowMap.width, self.shadowMap.height)
-        glClear(GL_DEPTH_BUFFER_BIT)
 
     def unbind(self):
         self.shadowMap.unbind()
@@ -42,9 +110,174 @@ class ShadowPass:
         glPolygonOffset(1.0, 2.0)
 
     def delete(self):
+        # Both maps share the shader, which the shadow map's delete frees
+        glDeleteFramebuffers(1, [self.staticMap.fbo])
+        self.staticMapTexture.delete()
         self.shadowMap.delete()
         self.shadowMapTexture.delete()
 
+class CascadedShadowPass:
+    # The camera's view depth is split into cascades, each shadowed by one layer of a depth texture array through a
+    # light projection fitted to its slice, so near shadows get more texels than far ones. A cascade is bounded by a
+    # sphere, which keeps its size while the camera turns, and only moves in whole texels, which keeps its shadow
+    # edges from shimmering. As in ShadowPass, each cascade caches its static casters; its projection, and with it
+    # the cache, is only renewed when the light turns more than angleThreshold radians, its slice moves more than
+    # recenterDistance from the cascade's center, the camera projection changes or a static model changes
+    caching: bool = True
+
+    def __init__(self, shaderProgram: glShaderProgram, resolution: int = 2048, cascadeCount: int = 3, splitBlend: float | None = None):
+        if cascadeCount < 2 or cascadeCount > MAX_CASCADES:
+            raise RuntimeError(f"Between 2 and {MAX_CASCADES} cascades are supported, got {cascadeCount}")
+        self.shader = shaderProgram
+        self.cascadeCount = cascadeCount
+        # 0 spaces the splits evenly in view depth, 1 logarithmically. None picks even splits for orthographic
+        # cameras, which see the same area at every depth, and a 0.5 blend for perspective ones
+        self.splitBlend: float | None = splitBlend
+        # With a focus, the cascades cover these view depths around the focus's depth instead of the camera's
+        # near to far planes, so none is spent on the empty space between a third person camera and the player.
+        # The first cascade is centered on the focus, so the player never sits on a seam
+        self.focusRange: tuple[float, float] = (-10.0, 50.0)
+        self.angleThreshold: float = 0.005
+        self.recenterDistance: float = 2.0
+        # Depth kept in front of every slice along the light, for casters outside the slice
+        self.casterDistance: float = 50.0
+
+        self.direction: glm.vec3 | None = None
+        self.lightView: glm.mat4 = glm.mat4(1)
+        self.staticVersion: int = -1
+        self.splits: list[float] = [0.0] * cascadeCount
+        # Light space center and radius of each cascade's projection
+        self.centers: list[glm.vec3 | None] = [None] * cascadeCount
+        self.radii: list[float] = [0.0] * cascadeCount
+        self.viewProjections: list[glm.mat4] = [glm.mat4(1)] * cascadeCount
+        self.staticDirty: list[bool] = [True] * cascadeCount
+        # Static layer renders since start up, shown in the window title
+        self.staticUpdates: int = 0
+
+        # Bound from the start, as the scene shaders declare the block even while they sample the single map
+        self.cascadeConstants = glUniformBuffer("ShadowCascades", SHADOW_CASCADES_FIELDS)
+        self.cascadeConstants.set("cascadeCount", cascadeCount)
+        self.cascadeConstants.upload()
+        self.cascadeConstants.bind()
+        self.shadowMaps: glDepthTextureArray | None = None
+        self.staticMaps: glDepthTextureArray | None = None
+        self.setResolution(resolution)
+
+    def setResolution(self, resolution: int):
+        # Texels per side of every cascade; the static casters of every cascade are rendered again
+        if self.shadowMaps != None:
+            self.shadowMaps.delete()
+            self.staticMaps.delete()
+        self.resolution = resolution
+        self.shadowMaps = glDepthTextureArray(resolution, resolution, self.cascadeCount)
+        self.staticMaps = glDepthTextureArray(resolution, resolution, self.cascadeCount)
+        self.centers = [None] * self.cascadeCount
+
+    def setLight(self, lightPosition: glm.vec3, camera: Camera, staticVersion: int, focus: glm.vec3 | None = None):
+        # lightPosition only gives the light direction. Fits every cascade to camera, around focus when given, and
+        # uploads them
+        direction = glm.normalize(lightPosition)
+        if (not CascadedShadowPass.caching or self.direction == None or
+                glm.dot(direction, self.direction) < glm.cos(self.angleThreshold) or staticVersion != self.staticVersion):
+            self.direction = glm.vec3(direction)
+            self.staticVersion = staticVersion
+            forward = -direction
+            rotation = glm.quatLookAt(forward, glm.vec3(0, 1, 0))
+            # No translation, so cascade centers snap to a texel grid fixed in light space
+            self.lightView = glm.lookAt(glm.vec3(0), forward, rotation * glm.vec3(0, 1, 0))
+            self.centers = [None] * self.cascadeCount
+
+        near, far = camera.state.near, camera.state.far
+        blend = self.splitBlend
+        if blend == None:
+            blend = 0.0 if isinstance(camera.state, OrthogonalCameraState) else 0.5
+        first = near
+        if focus == None:
+            splits = split_depths(near, far, self.cascadeCount, blend)
+        else:
+            focusDepth = glm.dot(focus - camera.position, camera.forward())
+            first = glm.clamp(focusDepth + self.focusRange[0], near, far)
+            last = glm.clamp(focusDepth + self.focusRange[1], first, far)
+            focusEnd = glm.clamp(2 * focusDepth - first, first, last)
+            splits = [focusEnd] + split_depths(focusEnd, last, self.cascadeCount - 1, blend)
+
+        inverse = glm.inverse(camera.projectionMat * camera.getViewMatrix())
+        nearCorners, farCorners = [], []
+        for x, y in ((-1, -1), (1, -1), (1, 1), (-1, 1)):
+            corner = inverse * glm.vec4(x, y, -1, 1)
+            nearCorners.append(glm.vec3(corner) / corner.w)
+            corner = inverse * glm.vec4(x, y, 1, 1)
+            farCorners.append(glm.vec3(corner) / corner.w)
+
+        start = (first - near) / (far - near)
+        for cascade, split in enumerate(splits):
+            end = (split - near) / (far - near)
+            corners = [a + (b - a) * t for t in (start, end) for a, b in zip(nearCorners, farCorners)]
+            center = sum(corners, glm.vec3(0)) / len(corners)
+            # Rounded up so float noise as the camera turns does not resize the cascade
+            radius = math.ceil(max(glm.distance(corner, center) for corner in corners) * 16) / 16
+            self.fitCascade(cascade, center, radius + self.recenterDistance)
+            self.splits[cascade] = split
+            start = end
+
+        self.cascadeConstants.set("cascadeViewProjections", [matrix.to_list() for matrix in self.viewProjections])
+        self.cascadeConstants.set("cascadeSplits", self.splits + [far] * (MAX_CASCADES - self.cascadeCount))
+        self.cascadeConstants.set("cameraForward", camera.forward())
+        self.cascadeConstants.set("cascadeCount", self.cascadeCount)
+        self.cascadeConstants.upload()
+        self.cascadeConstants.bind()
+
+    def fitCascade(self, cascade: int, center: glm.vec3, radius: float):
+        lightCenter = glm.vec3(self.lightView * glm.vec4(center, 1))
+        previous = self.centers[cascade]
+        # radius already has room for the slice to move recenterDistance
+        if (CascadedShadowPass.caching and previous != None and radius == self.radii[cascade] and
+                glm.distance(lightCenter, previous) <= self.recenterDistance):
+            return
+
+        # Whole texels, so every texel covers the same world positions as before the move
+        texel = 2 * radius / self.resolution
+        lightCenter.x = math.floor(lightCenter.x / texel) * texel
+        lightCenter.y = math.floor(lightCenter.y / texel) * texel
+        self.centers[cascade] = lightCenter
+        self.radii[cascade] = radius
+        # The light looks down -z, so the slice lies between -lightCenter.z - radius and -lightCenter.z + radius
+        projection = glm.ortho(
+                lightCenter.x - radius, lightCenter.x + radius, lightCenter.y - radius, lightCenter.y + radius,
+                -lightCenter.z - radius - self.casterDistance, -lightCenter.z + radius)
+        self.viewProjections[cascade] = projection * self.lightView
+        self.staticDirty[cascade] = True
+
+    def bindStatic(self, cascade: int):
+        self.staticMaps.bindLayer(cascade)
+        glClear(GL_DEPTH_BUFFER_BIT)
+        self.staticDirty[cascade] = False
+        self.staticUpdates += 1
+
+    def bind(self, cascade: int):
+        # Starts from the cascade's cached static depth instead of a cleared layer
+        glBindFramebuffer(GL_READ_FRAMEBUFFER, self.staticMaps.framebuffers[cascade])
+        self.shadowMaps.bindLayer(cascade)
+        glBlitFramebuffer(0, 0, self.resolution, self.resolution, 0, 0, self.resolution, self.resolution, GL_DEPTH_BUFFER_BIT, GL_NEAREST)
+
+    def unbind(self):
+        glBindFramebuffer(GL_FRAMEBUFFER, 0)
+        glDisable(GL_POLYGON_OFFSET_FILL)
+
+    def getShader(self) -> glShaderProgram:
+        return self.shader
+
+    def enable(self):
+        glUseProgram(self.shader.program)
+        glEnable(GL_POLYGON_OFFSET_FILL)
+        glPolygonOffset(1.0, 2.0)
+
+    def delete(self):
+        # The shader is shared with ShadowPass, which frees it
+        self.shadowMaps.delete()
+        self.staticMaps.delete()
+        self.cascadeConstants.delete()
+
 class DepthNormalPass:
     def __init__(self, width: int, height: int):
         depthShader = glShaderProgram(
@@ -55,28 +288,93 @@ class DepthNormalPass:
                 layout (location = 2) in vec2 aUV;
                 layout (location = 3) in uvec4 aJointIDs;
                 layout (location = 4) in vec4 aWeights;
+                layout (location = 5) in mat4 aInstanceTransform;
+                layout (location = 9) in int aInstanceJointOffset;
+                layout (location = 10) in vec3 aBillboardCenter;
+                layout (location = 11) in vec2 aBillboardSize;
+                layout (location = 12) in int aBillboardMode;
+                layout (location = 13) in float aLayer;
 
-                uniform mat4 vp;
+                layout(std140) uniform FrameConstants {
+                    mat4 vp;
+                    mat4 lvp;
+                    vec3 cameraPos;
+                    vec3 lightPos;
+                    vec3 lightDir;
+                    vec3 lightColor;
+                };
                 uniform mat4 model;
                 uniform mat4 inverseModel;
 
-                uniform mat4 jointMatrices[100];
+                layout(std140, row_major) uniform JointPalette {
+                    mat4 jointMatrices[100];
+                };
                 uniform bool hasAnimation;
+                uniform bool instanced;
+                uniform samplerBuffer jointTexture;
+                uniform bool billboard;
+                // Quads sample layer of layerTextures; models, which have no layer attribute, sample diffuseTexture
+                uniform bool layered;
+                flat out int layer;
+
+                vec3 billboardForward() {
+                    vec3 forward = cameraPos - aBillboardCenter;
+                    if (aBillboardMode == 1)
+                        forward.y = 0;
+                    return normalize(forward);
+                }
+
+                vec3 billboardCorner(vec3 forward) {
+                    // Same axes glm.quatLookAt(forward, up) gives a Quad
+                    vec3 right = normalize(cross(forward, vec3(0, 1, 0)));
+                    vec3 up = cross(right, forward);
+                    return aBillboardCenter + right * aPos.x * aBillboardSize.x + up * aPos.y * aBillboardSize.y;
+                }
+
                 out vec2 uv;
                 out vec3 normal;
 
+                mat4 instanceJoint(uint joint) {
+                    int texel = (aInstanceJointOffset + int(joint)) * 4;
+                    return transpose(mat4(
+                        texelFetch(jointTexture, texel), texelFetch(jointTexture, texel + 1),
+                        texelFetch(jointTexture, texel + 2), texelFetch(jointTexture, texel + 3)));
+                }
+
                 void main() {
+                    uv = aUV;
+                    layer = layered ? int(aLayer) : -1;
+                    if (billboard) {
+                        // Billboards always face the camera
+                        vec3 forward = billboardForward();
+                        gl_Position = vp * vec4(billboardCorner(forward), 1.0);
+                        normal = forward;
+                        return;
+                    }
+
                     mat4 skinMatrix = mat4(1);
-                    if (hasAnimation) {
+                    mat4 world = model;
+                    mat3 normalMatrix = mat3(inverseModel);
+                    if (instanced) {
+                        world = model * aInstanceTransform;
+                        normalMatrix = transpose(inverse(mat3(world)));
+                        if (aInstanceJointOffset >= 0) {
+                            skinMatrix =
+                            aWeights.x * instanceJoint(aJointIDs.x) +
+                            aWeights.y * instanceJoint(aJointIDs.y) +
+                            aWeights.z * instanceJoint(aJointIDs.z) +
+                            aWeights.w * instanceJoint(aJointIDs.w);
+                        }
+                    }
+                    else if (hasAnimation) {
                         skinMatrix =
                         aWeights.x * jointMatrices[aJointIDs.x] +
                         aWeights.y * jointMatrices[aJointIDs.y] +
                         aWeights.z * jointMatrices[aJointIDs.z] +
                         aWeights.w * jointMatrices[aJointIDs.w];
                     }
-                    gl_Position = vp * model * skinMatrix * vec4(aPos, 1.0);
-                    uv = aUV;
-                    normal = mat3(inverseModel) * mat3(skinMatrix) * aNormal;
+                    gl_Position = vp * world * skinMatrix * vec4(aPos, 1.0);
+                    normal = normalMatrix * mat3(skinMatrix) * aNormal;
                 }
                 """,
                 """
@@ -84,12 +382,19 @@ class DepthNormalPass:
                 layout(location = 0) out vec4 fragColor;
 
                 uniform sampler2D diffuseTexture;
+                uniform sampler2DArray layerTextures;
                 uniform bool hasDiffuseTex;
                 in vec2 uv;
+                flat in int layer;
                 in vec3 normal;
 
                 void main() {
-                    if (hasDiffuseTex && texture(diffuseTexture, uv).a < 0.1) {
+                    float alpha = 1.0;
+                    if (layer >= 0)
+                        alpha = texture(layerTextures, vec3(uv, layer)).a;
+                    else if (hasDiffuseTex)
+                        alpha = texture(diffuseTexture, uv).a;
+                    if (alpha < 0.1) {
                         discard;
                     }
                     fragColor = vec4(normalize(normal) * 0.5 + 0.5, gl_FragCoord.z);
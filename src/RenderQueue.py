@@ -0,0 +1,125 @@
+from opengl_util import *
+from collections import namedtuple
+
+# One indexed draw; palette is the JointPalette buffer of a skinned model or None.
+# A multi-draw item holds arrays of index counts, byte offsets and base vertices instead of single values.
+# An instanced item draws `instances` copies whose transforms and joint offsets come from the VAO's instance attributes,
+# and its palette is the joint texture buffer those offsets point into
+DrawItem = namedtuple('DrawItem', 'key vao palette material indexCount indexOffset baseVertex transform inverseTransform instances', defaults=(0,))
+
+# Texture unit of the samplerBuffer holding the joint matrices of instanced models
+JOINT_TEXTURE_SLOT = 2
+
+class RenderStats:
+    def __init__(self):
+        self.items: int = 0
+        self.drawCalls: int = 0
+        self.vaoChanges: int = 0
+        self.paletteChanges: int = 0
+        self.textureChanges: int = 0
+        self.materialChanges: int = 0
+        # Models drawn through instanced calls
+        self.instances: int = 0
+        # Primitives drawn, counting every instance and every multi-draw entry, and primitives dropped by culling
+        self.primitives: int = 0
+        self.culled: int = 0
+
+    def stateChanges(self) -> int:
+        return self.vaoChanges + self.paletteChanges + self.textureChanges + self.materialChanges
+
+class RenderQueue:
+    # Sort key fields from most to least expensive to change; each holds a per-queue rank of 16 bits
+    KEY_FIELDS = ('vao', 'palette', 'texture', 'material')
+
+    def __init__(self, name: str):
+        self.name: str = name
+        self.items: list[DrawItem] = []
+        self.culled: int = 0
+        self.ranks: dict[str, dict] = {field: {} for field in RenderQueue.KEY_FIELDS}
+        # Statistics of the last submit
+        self.stats: RenderStats = RenderStats()
+
+    def rank(self, field: str, key) -> int:
+        ranks = self.ranks[field]
+        if key not in ranks:
+            ranks[key] = len(ranks) & 0xFFFF
+        return ranks[key]
+
+    def sortKey(self, vao: int, palette, material) -> int:
+        texture = material.diffuseTexture._id if material.hasDiffuseTex else 0
+        return (
+            self.rank('vao', vao) << 48 |
+            self.rank('palette', id(palette)) << 32 |
+            self.rank('texture', texture) << 16 |
+            self.rank('material', id(material))
+        )
+
+    def push(self, vao: int, palette, material, indexCount: int, indexOffset: int, baseVertex: int, transform, inverseTransform, instances: int = 0):
+        key = self.sortKey(vao, palette, material)
+        self.items.append(DrawItem(key, vao, palette, material, indexCount, indexOffset, baseVertex, transform, inverseTransform, instances))
+
+    def markCulled(self, count: int):
+        self.culled += count
+
+    def submit(self, shader: glShaderProgram):
+        stats = RenderStats()
+        self.items.sort(key=lambda item: item.key)
+        stats.items = len(self.items)
+        stats.culled = self.culled
+
+        vao = None
+        palette = 0
+        texture = None
+        material = None
+        instanced = None
+        shader.setUniform1i("diffuseTexture", 0)
+        shader.setUniform1i("jointTexture", JOINT_TEXTURE_SLOT)
+        for item in self.items:
+            if item.vao != vao:
+                vao = item.vao
+                glBindVertexArray(vao)
+                stats.vaoChanges += 1
+            if item.palette is not palette:
+                palette = item.palette
+                if palette != None:
+                    palette.bind()
+                shader.setUniform1i("hasAnimation", int(palette != None))
+                stats.paletteChanges += 1
+            if item.material is not material:
+                material = item.material
+                shader.setUniform3f("color", material.baseColor)
+                shader.setUniform1f("shininess", material.shininess)
+                shader.setUniform1i("hasDiffuseTex", material.hasDiffuseTex)
+                stats.materialChanges += 1
+                if material.hasDiffuseTex and material.diffuseTexture is not texture:
+                    texture = material.diffuseTexture
+                    texture.bind(0)
+                    stats.textureChanges += 1
+
+            if (item.instances > 0) != instanced:
+                instanced = item.instances > 0
+                shader.setUniform1i("instanced", int(instanced))
+
+            shader.setUniformMat4("model", 1, item.transform)
+            shader.setUniformMat4("inverseModel", 1, item.inverseTransform)
+            if instanced:
+                glDrawElementsInstancedBaseVertex(GL_TRIANGLES, item.indexCount, GL_UNSIGNED_INT, ctypes.c_void_p(4 * item.indexOffset), item.instances, item.baseVertex)
+                stats.instances += item.instances
+                stats.primitives += item.instances
+            elif isinstance(item.indexCount, np.ndarray):
+                glMultiDrawElementsBaseVertex(GL_TRIANGLES, item.indexCount, GL_UNSIGNED_INT, item.indexOffset, len(item.indexCount), item.baseVertex)
+                stats.primitives += len(item.indexCount)
+            else:
+                glDrawElementsBaseVertex(GL_TRIANGLES, item.indexCount, GL_UNSIGNED_INT, ctypes.c_void_p(4 * item.indexOffset), item.baseVertex)
+                stats.primitives += 1
+            stats.drawCalls += 1
+
+        glBindVertexArray(0)
+        # Quads drawn later with the same shader have no instance attributes
+        if instanced:
+            shader.setUniform1i("instanced", 0)
+        self.stats = stats
+        self.items = []
+        self.culled = 0
+        for ranks in self.ranks.values():
+            ranks.clear()
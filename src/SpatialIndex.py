@@ -0,0 +1,210 @@
+import numpy as np
+from Frustum import Frustum
+
+# Item layers, combined as bit masks in queries
+MODEL_LAYER = 1
+COLLIDER_LAYER = 2
+ALL_LAYERS = 0xFFFFFFFF
+
+def morton_codes(points: np.ndarray) -> np.ndarray:
+    # 30 bit Morton codes of points quantized to 1024 steps per axis of their own bounds
+    low, high = points.min(axis=0), points.max(axis=0)
+    scaled = (points - low) / np.maximum(high - low, 1e-9) * 1023
+    codes = np.zeros(len(points), dtype=np.uint64)
+    for axis in range(3):
+        v = scaled[:, axis].astype(np.uint64)
+        v = (v | (v << np.uint64(16))) & np.uint64(0x030000FF)
+        v = (v | (v << np.uint64(8))) & np.uint64(0x0300F00F)
+        v = (v | (v << np.uint64(4))) & np.uint64(0x030C30C3)
+        v = (v | (v << np.uint64(2))) & np.uint64(0x09249249)
+        codes |= v << np.uint64(axis)
+    return codes
+
+class SpatialIndex:
+    # Bounding volume hierarchy over axis aligned boxes. Items are sorted along a Morton curve into leaves of
+    # LEAF_SIZE and the tree above them is complete, so it is stored as one box array per level and every query
+    # walks it a level at a time over all surviving nodes at once
+    LEAF_SIZE = 8
+
+    def __init__(self, capacity: int = 256):
+        self.count: int = 0
+        self.mins: np.ndarray = np.full((capacity, 3), np.inf)
+        self.maxs: np.ndarray = np.full((capacity, 3), -np.inf)
+        self.layers: np.ndarray = np.zeros(capacity, dtype=np.uint32)
+        self.owners: list = [None] * capacity
+        self.freeItems: list[int] = []
+
+        # Tree, level 0 is the root; leafItems holds item ids with -1 padding.
+        # levelLayers ORs the layers of every item below a node, so empty and filtered out nodes are never tested
+        self.levelMins: list[np.ndarray] = []
+        self.levelMaxs: list[np.ndarray] = []
+        self.levelLayers: list[np.ndarray] = []
+        self.leafItems: np.ndarray = np.full((0, SpatialIndex.LEAF_SIZE), -1)
+        self.itemLeaves: np.ndarray = np.full(capacity, -1)
+        self.dirtyLeaves: set[int] = set()
+        # Queries build the tree on first use, so an empty index answers them too
+        self.needsRebuild: bool = True
+
+    def insert(self, owner, mins, maxs, layer: int = MODEL_LAYER) -> np.ndarray:
+        # Adds one item per box row and returns their ids; ids stay valid until removed
+        mins = np.asarray(mins, dtype=np.float64).reshape(-1, 3)
+        maxs = np.asarray(maxs, dtype=np.float64).reshape(-1, 3)
+        ids = np.empty(len(mins), dtype=np.int64)
+        for i in range(len(mins)):
+            if len(self.freeItems) > 0:
+                ids[i] = self.freeItems.pop()
+            else:
+                if self.count == len(self.mins):
+                    self.grow()
+                ids[i] = self.count
+                self.count += 1
+        self.mins[ids] = mins
+        self.maxs[ids] = maxs
+        self.layers[ids] = layer
+        for id in ids:
+            self.owners[id] = owner
+        # New items belong to no leaf yet
+        self.needsRebuild = True
+        return ids
+
+    def grow(self):
+        capacity = len(self.mins) * 2
+        self.mins = np.concatenate([self.mins, np.full((capacity - len(self.mins), 3), np.inf)])
+        self.maxs = np.concatenate([self.maxs, np.full((capacity - len(self.maxs), 3), -np.inf)])
+        self.layers = np.concatenate([self.layers, np.zeros(capacity - len(self.layers), dtype=np.uint32)])
+        self.itemLeaves = np.concatenate([self.itemLeaves, np.full(capacity - len(self.itemLeaves), -1)])
+        self.owners += [None] * (capacity - len(self.owners))
+
+    def remove(self, ids):
+        # Removed items become empty boxes, which no query can hit, until their ids are reused
+        ids = np.asarray(ids, dtype=np.int64).reshape(-1)
+        self.update(ids, np.full((len(ids), 3), np.inf), np.full((len(ids), 3), -np.inf))
+        self.layers[ids] = 0
+        for id in ids:
+            self.owners[id] = None
+        self.freeItems += ids.tolist()
+
+    def update(self, ids, mins, maxs):
+        # Moved items only refit the leaves that hold them and those leaves' ancestors
+        ids = np.asarray(ids, dtype=np.int64).reshape(-1)
+        self.mins[ids] = np.asarray(mins, dtype=np.float64).reshape(-1, 3)
+        self.maxs[ids] = np.asarray(maxs, dtype=np.float64).reshape(-1, 3)
+        leaves = self.itemLeaves[ids]
+        self.dirtyLeaves.update(leaves[leaves >= 0].tolist())
+
+    def rebuild(self):
+        # Restores tree quality after many moves; queries call it on their own after inserts
+        live = np.flatnonzero(np.all(self.mins[:self.count] <= self.maxs[:self.count], axis=1))
+        order = live
+        if len(live) > 1:
+            order = live[np.argsort(morton_codes((self.mins[live] + self.maxs[live]) / 2), kind='stable')]
+        leafCount = 1 << max(0, int(np.ceil(np.log2(max(1, -(-len(order) // SpatialIndex.LEAF_SIZE))))))
+        slots = np.full(leafCount * SpatialIndex.LEAF_SIZE, -1)
+        slots[:len(order)] = order
+        self.leafItems = slots.reshape(leafCount, SpatialIndex.LEAF_SIZE)
+        self.itemLeaves[:] = -1
+        self.itemLeaves[order] = np.arange(len(order)) // SpatialIndex.LEAF_SIZE
+
+        depth = leafCount.bit_length() - 1
+        self.levelMins = [None] * (depth + 1)
+        self.levelMaxs = [None] * (depth + 1)
+        self.levelLayers = [None] * (depth + 1)
+        self.levelMins[depth], self.levelMaxs[depth], self.levelLayers[depth] = self.leafBounds(self.leafItems)
+        for level in range(depth - 1, -1, -1):
+            childMins, childMaxs, childLayers = self.levelMins[level + 1], self.levelMaxs[level + 1], self.levelLayers[level + 1]
+            self.levelMins[level] = np.minimum(childMins[0::2], childMins[1::2])
+            self.levelMaxs[level] = np.maximum(childMaxs[0::2], childMaxs[1::2])
+            self.levelLayers[level] = childLayers[0::2] | childLayers[1::2]
+        self.dirtyLeaves.clear()
+        self.needsRebuild = False
+
+    def leafBounds(self, leafItems: np.ndarray) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+        valid = leafItems >= 0
+        mins = np.where(valid[..., None], self.mins[leafItems], np.inf).min(axis=1)
+        maxs = np.where(valid[..., None], self.maxs[leafItems], -np.inf).max(axis=1)
+        layers = np.bitwise_or.reduce(np.where(valid, self.layers[leafItems], 0).astype(np.uint32), axis=1)
+        return mins, maxs, layers
+
+    def refit(self):
+        if self.needsRebuild:
+            self.rebuild()
+            return
+        if len(self.dirtyLeaves) == 0:
+            return
+        nodes = np.fromiter(self.dirtyLeaves, dtype=np.int64)
+        depth = len(self.levelMins) - 1
+        self.levelMins[depth][nodes], self.levelMaxs[depth][nodes], self.levelLayers[depth][nodes] = self.leafBounds(self.leafItems[nodes])
+        for level in range(depth - 1, -1, -1):
+            nodes = np.unique(nodes // 2)
+            childMins, childMaxs, childLayers = self.levelMins[level + 1], self.levelMaxs[level + 1], self.levelLayers[level + 1]
+            self.levelMins[level][nodes] = np.minimum(childMins[2 * nodes], childMins[2 * nodes + 1])
+            self.levelMaxs[level][nodes] = np.maximum(childMaxs[2 * nodes], childMaxs[2 * nodes + 1])
+            self.levelLayers[level][nodes] = childLayers[2 * nodes] | childLayers[2 * nodes + 1]
+        self.dirtyLeaves.clear()
+
+    def descend(self, level: int, nodes: np.ndarray, layers: int) -> np.ndarray:
+        # Children of nodes on the next level, or the items of the leaves, that hold any of the layers
+        if level < len(self.levelMins) - 1:
+            children = (nodes[:, None] * 2 + np.arange(2)).reshape(-1)
+            return children[(self.levelLayers[level + 1][children] & np.uint32(layers)) != 0]
+        items = self.leafItems[nodes].reshape(-1)
+        items = items[items >= 0]
+        return items[(self.layers[items] & np.uint32(layers)) != 0]
+
+    def traverse(self, test, layers: int) -> np.ndarray:
+        # test(mins, maxs) -> bool mask; applied to the surviving nodes of every level, then to the items
+        self.refit()
+        nodes = np.zeros(1, dtype=np.int64)
+        nodes = nodes[(self.levelLayers[0][nodes] & np.uint32(layers)) != 0]
+        for level in range(len(self.levelMins)):
+            nodes = nodes[test(self.levelMins[level][nodes], self.levelMaxs[level][nodes])]
+            nodes = self.descend(level, nodes, layers)
+        return nodes[test(self.mins[nodes], self.maxs[nodes])]
+
+    def queryFrustum(self, frustum: Frustum, layers: int = ALL_LAYERS) -> np.ndarray:
+        return self.traverse(lambda mins, maxs: frustum.testBoxes((mins + maxs) / 2, (maxs - mins) / 2), layers)
+
+    def queryBox(self, boxMin, boxMax, layers: int = ALL_LAYERS) -> np.ndarray:
+        boxMin = np.asarray(boxMin, dtype=np.float64)
+        boxMax = np.asarray(boxMax, dtype=np.float64)
+        return self.traverse(lambda mins, maxs: np.all((mins <= boxMax) & (maxs >= boxMin), axis=1), layers)
+
+    def rayCast(self, origin, direction, maxDistance: float = np.inf, layers: int = ALL_LAYERS) -> tuple[int, float] | None:
+        # Nearest item whose box the ray enters within maxDistance, as (id, distance along direction)
+        origin = np.asarray(origin, dtype=np.float64)
+        direction = np.asarray(direction, dtype=np.float64)
+        inverse = 1 / np.where(direction == 0, 1e-30, direction)
+
+        def entry(mins, maxs):
+            t1 = (mins - origin) * inverse
+            t2 = (maxs - origin) * inverse
+            near = np.minimum(t1, t2).max(axis=1)
+            far = np.maximum(t1, t2).min(axis=1)
+            return np.where((near <= far) & (far >= 0) & (near <= maxDistance), np.maximum(near, 0), np.inf)
+
+        items = self.traverse(lambda mins, maxs: entry(mins, maxs) < np.inf, layers)
+        if len(items) == 0:
+            return None
+        distances = entry(self.mins[items], self.maxs[items])
+        best = int(np.argmin(distances))
+        return int(items[best]), float(distances[best])
+
+    def nearest(self, point, layers: int = ALL_LAYERS) -> tuple[int, float] | None:
+        # Closest item box to point, as (id, distance); nodes farther than another node's farthest corner are pruned
+        self.refit()
+        point = np.asarray(point, dtype=np.float64)
+        nodes = np.zeros(1, dtype=np.int64)
+        nodes = nodes[(self.levelLayers[0][nodes] & np.uint32(layers)) != 0]
+        for level in range(len(self.levelMins)):
+            if len(nodes) == 0:
+                return None
+            mins, maxs = self.levelMins[level][nodes], self.levelMaxs[level][nodes]
+            nearDistances = np.linalg.norm(np.maximum(np.maximum(mins - point, point - maxs), 0), axis=1)
+            farDistances = np.linalg.norm(np.maximum(np.abs(point - mins), np.abs(point - maxs)), axis=1)
+            nodes = self.descend(level, nodes[nearDistances <= farDistances.min()], layers)
+        items = nodes
+        if len(items) == 0:
+            return None
+        distances = np.linalg.norm(np.maximum(np.maximum(self.mins[items] - point, point - self.maxs[items]), 0), axis=1)
+        best = int(np.argmin(distances))
+        return int(items[best]), float(distances[best])
@@ -2,7 +2,7 @@ import pygame as pg
 from Application import *
 from opengl_util import *
 from QuadRenderer import *
-from RenderPipeline import PostProcessingPass, DepthNormalPass, ShadowPass
+from RenderPipeline import PostProcessingPass, DepthNormalPass, ShadowPass, CascadedShadowPass
 from Camera import *
 from CameraController import *
 
@@ -11,11 +11,16 @@ from GameObjectSystem import *
 
 from Player import Player
 
-from Model import Model
+from Model import Model, FRAME_CONSTANTS_FIELDS
+from ModelLoader import ModelLoader
+from CollisionWorld import CollisionWorld
 
 from QuadTest import QuadTest
 
 class Game(Application):
+    # Shadows from CascadedShadowPass, or from ShadowPass's single map when False
+    cascadedShadows: bool = True
+
     def __init__(self):
         scale = (2, 2)
         PIXEL_WIDTH, PIXEL_HEIGHT = int(320 * 2.25), int(180 * 2.25)
@@ -39,6 +44,8 @@ class Game(Application):
         # Initialize Systems
         AnimationSystem.SetUp()
         GameObjectSystem.SetUp()
+        ModelLoader.SetUp()
+        CollisionWorld.SetUp()
 
         self.quadRenderer = QuadRenderer(self.window)
         self.quadShader = glShaderProgram(
@@ -46,15 +53,47 @@ class Game(Application):
                 #version 330 core
                 layout (location = 0) in vec3 aPos;
                 layout (location = 2) in vec2 aUV;
-
-                uniform mat4 vp;
-                uniform mat4 lvp;
+                layout (location = 10) in vec3 aBillboardCenter;
+                layout (location = 11) in vec2 aBillboardSize;
+                layout (location = 12) in int aBillboardMode;
+                layout (location = 13) in float aLayer;
+
+                layout(std140) uniform FrameConstants {
+                    mat4 vp;
+                    mat4 lvp;
+                    vec3 cameraPos;
+                    vec3 lightPos;
+                    vec3 lightDir;
+                    vec3 lightColor;
+                };
                 out vec2 uv;
+                out vec3 fragPos;
                 out vec4 lightFragPos;
+                uniform bool billboard;
+                // Quads sample layer of layerTextures; models, which have no layer attribute, sample diffuseTexture
+                uniform bool layered;
+                flat out int layer;
+
+                vec3 billboardForward() {
+                    vec3 forward = cameraPos - aBillboardCenter;
+                    if (aBillboardMode == 1)
+                        forward.y = 0;
+                    return normalize(forward);
+                }
+
+                vec3 billboardCorner(vec3 forward) {
+                    // Same axes glm.quatLookAt(forward, up) gives a Quad
+                    vec3 right = normalize(cross(forward, vec3(0, 1, 0)));
+                    vec3 up = cross(right, forward);
+                    return aBillboardCenter + right * aPos.x * aBillboardSize.x + up * aPos.y * aBillboardSize.y;
+                }
 
                 void main() {
-                    gl_Position = vp * vec4(aPos, 1.0);
-                    lightFragPos = lvp * vec4(aPos, 1.0);
+                    layer = layered ? int(aLayer) : -1;
+                    vec3 position = billboard ? billboardCorner(billboardForward()) : aPos;
+                    gl_Position = vp * vec4(position, 1.0);
+                    fragPos = position;
+                    lightFragPos = lvp * vec4(position, 1.0);
                     uv = aUV;
                 }
                 """,
@@ -63,17 +102,47 @@ class Game(Application):
                 layout(location = 0) out vec4 fragColor;
 
                 in vec2 uv;
+                in vec3 fragPos;
                 in vec4 lightFragPos;
+                flat in int layer;
                 uniform sampler2D diffuseTexture;
-                uniform vec3 lightDir;
-                uniform vec3 lightColor;
+                uniform sampler2DArray layerTextures;
+                layout(std140) uniform FrameConstants {
+                    mat4 vp;
+                    mat4 lvp;
+                    vec3 cameraPos;
+                    vec3 lightPos;
+                    vec3 lightDir;
+                    vec3 lightColor;
+                };
+                layout(std140) uniform ShadowCascades {
+                    mat4 cascadeViewProjections[4];
+                    vec4 cascadeSplits;
+                    vec3 cameraForward;
+                    int cascadeCount;
+                };
 
                 uniform sampler2D shadowMap;
+                uniform bool cascaded;
+                uniform sampler2DArray shadowCascades;
+
+                float shadowDepth(inout vec3 lightUV) {
+                    // Same cascade choice as the model shader
+                    if (!cascaded)
+                        return texture(shadowMap, lightUV.xy).r;
+                    float viewDepth = dot(fragPos - cameraPos, cameraForward);
+                    int cascade = 0;
+                    while (cascade < cascadeCount - 1 && viewDepth > cascadeSplits[cascade])
+                        cascade++;
+                    vec4 position = cascadeViewProjections[cascade] * vec4(fragPos, 1.0);
+                    lightUV = position.xyz / position.w * 0.5 + 0.5;
+                    return texture(shadowCascades, vec3(lightUV.xy, cascade)).r;
+                }
 
                 float getShadowFactor(in vec3 lightUV, in vec3 L) {
+                    float depth = shadowDepth(lightUV);
                     if (lightUV.z > 1)
                         lightUV.z = 1;
-                    float depth = texture(shadowMap, lightUV.xy).r;
                     float sunHeight = dot(vec3(0, 1, 0), L);
                     sunHeight = clamp(1 - sunHeight, 0.1, 1);
                     return lightUV.z > depth + 0.001 ? 1 - pow(sunHeight - 1, 2) : 1.0;
@@ -86,7 +155,7 @@ class Game(Application):
                     vec3 L = -normalize(lightDir);
                     float shadowFactor = getShadowFactor(lightUV, L);
 
-                    vec4 color = texture(diffuseTexture, uv);
+                    vec4 color = layer >= 0 ? texture(layerTextures, vec3(uv, layer)) : texture(diffuseTexture, uv);
                     color.rgb *= vec3(0.515, 0.8, 0.552);
 
                     color.rgb = color.rgb * 0.7 * shadowFactor * lightColor;
@@ -104,36 +173,103 @@ class Game(Application):
                 layout (location = 2) in vec2 aUV;
                 layout (location = 3) in uvec4 aJointIDs;
                 layout (location = 4) in vec4 aWeights;
-
-                uniform mat4 lvp;
+                layout (location = 5) in mat4 aInstanceTransform;
+                layout (location = 9) in int aInstanceJointOffset;
+                layout (location = 10) in vec3 aBillboardCenter;
+                layout (location = 11) in vec2 aBillboardSize;
+                layout (location = 12) in int aBillboardMode;
+                layout (location = 13) in float aLayer;
+
+                layout(std140) uniform FrameConstants {
+                    mat4 vp;
+                    mat4 lvp;
+                    vec3 cameraPos;
+                    vec3 lightPos;
+                    vec3 lightDir;
+                    vec3 lightColor;
+                };
                 uniform mat4 model;
 
-                uniform mat4 jointMatrices[100];
+                layout(std140, row_major) uniform JointPalette {
+                    mat4 jointMatrices[100];
+                };
                 uniform bool hasAnimation;
+                uniform bool instanced;
+                uniform samplerBuffer jointTexture;
+                uniform bool billboard;
+                // Quads sample layer of layerTextures; models, which have no layer attribute, sample diffuseTexture
+                uniform bool layered;
+                flat out int layer;
+
+                vec3 billboardForward() {
+                    vec3 forward = cameraPos - aBillboardCenter;
+                    if (aBillboardMode == 1)
+                        forward.y = 0;
+                    return normalize(forward);
+                }
+
+                vec3 billboardCorner(vec3 forward) {
+                    // Same axes glm.quatLookAt(forward, up) gives a Quad
+                    vec3 right = normalize(cross(forward, vec3(0, 1, 0)));
+                    vec3 up = cross(right, forward);
+                    return aBillboardCenter + right * aPos.x * aBillboardSize.x + up * aPos.y * aBillboardSize.y;
+                }
+
                 out vec2 uv;
 
+                mat4 instanceJoint(uint joint) {
+                    int texel = (aInstanceJointOffset + int(joint)) * 4;
+                    return transpose(mat4(
+                        texelFetch(jointTexture, texel), texelFetch(jointTexture, texel + 1),
+                        texelFetch(jointTexture, texel + 2), texelFetch(jointTexture, texel + 3)));
+                }
+
                 void main() {
+                    uv = aUV;
+                    layer = layered ? int(aLayer) : -1;
+                    if (billboard) {
+                        gl_Position = lvp * vec4(billboardCorner(billboardForward()), 1.0);
+                        return;
+                    }
+
                     mat4 skinMatrix = mat4(1);
-                    if (hasAnimation) {
+                    mat4 world = model;
+                    if (instanced) {
+                        world = model * aInstanceTransform;
+                        if (aInstanceJointOffset >= 0) {
+                            skinMatrix =
+                            aWeights.x * instanceJoint(aJointIDs.x) +
+                            aWeights.y * instanceJoint(aJointIDs.y) +
+                            aWeights.z * instanceJoint(aJointIDs.z) +
+                            aWeights.w * instanceJoint(aJointIDs.w);
+                        }
+                    }
+                    else if (hasAnimation) {
                         skinMatrix =
                         aWeights.x * jointMatrices[aJointIDs.x] +
                         aWeights.y * jointMatrices[aJointIDs.y] +
                         aWeights.z * jointMatrices[aJointIDs.z] +
                         aWeights.w * jointMatrices[aJointIDs.w];
                     }
-                    gl_Position = lvp * model * skinMatrix * vec4(aPos, 1.0);
-                    uv = aUV;
+                    gl_Position = lvp * world * skinMatrix * vec4(aPos, 1.0);
                 }
                 """,
                 """
                 #version 330 core
 
                 uniform sampler2D diffuseTexture;
+                uniform sampler2DArray layerTextures;
                 uniform bool hasDiffuseTex;
                 in vec2 uv;
+                flat in int layer;
 
                 void main() {
-                    if (hasDiffuseTex && texture(diffuseTexture, uv).a < 0.1) {
+                    float alpha = 1.0;
+                    if (layer >= 0)
+                        alpha = texture(layerTextures, vec3(uv, layer)).a;
+                    else if (hasDiffuseTex)
+                        alpha = texture(diffuseTexture, uv).a;
+                    if (alpha < 0.1) {
                         discard;
                     }
                 }
@@ -141,6 +277,7 @@ class Game(Application):
                 )
 
         self.shadowPass = ShadowPass(shadowMapShader, 2048, 2048)
+        self.cascadedShadowPass = CascadedShadowPass(shadowMapShader, 2048, 3)
 
         self.depthNormalPass = DepthNormalPass(PIXEL_WIDTH, PIXEL_HEIGHT)
 
@@ -205,10 +342,11 @@ class Game(Application):
         self.cam = Camera(glm.vec3(0.0, 1.0, 3.0), self.window)
 
         print(f'GL_MAX_UNIFORM_BLOCK_SIZE: {glGetIntegerv(GL_MAX_UNIFORM_BLOCK_SIZE)}')
+        self.frameConstants = glUniformBuffer("FrameConstants", FRAME_CONSTANTS_FIELDS)
 
         Player()
         # Model("res/TestScene3.glb")
-        Model("res/TestScene5.glb")
+        Model.loadAsync("res/TestScene5.glb", static=True)
 
         glClearColor(0.1, 0.1, 0.1, 1)
 
@@ -227,9 +365,13 @@ class Game(Application):
     def OnWindowClose(self):
         self.postProcessingPass.delete()
         self.depthNormalPass.delete()
+        self.cascadedShadowPass.delete()
         self.shadowPass.delete()
         glFramebuffer.deleteQuad()
         self.quadRenderer.delete()
+        self.frameConstants.delete()
+        ModelLoader.ShutDown()
+        CollisionWorld.ShutDown()
         print('Close from Game')
 
     def OnUpdate(self):
@@ -237,6 +379,11 @@ class Game(Application):
 
         title = ""
 
+        previous_time = pg.time.get_ticks()
+        ModelLoader.Update()
+        delta_time: float = (pg.time.get_ticks() - previous_time)
+        title += f"load: {delta_time}ms "
+
         previous_time = pg.time.get_ticks()
         AnimationSystem.Update(self.window.deltaTime)
         delta_time: float = (pg.time.get_ticks() - previous_time)
@@ -247,10 +394,18 @@ class Game(Application):
         delta_time: float = (pg.time.get_ticks() - previous_time)
         title += f"obj: {delta_time}ms "
 
+        previous_time = pg.time.get_ticks()
+        CollisionWorld.Update()
+        delta_time: float = (pg.time.get_ticks() - previous_time)
+        title += f"collision: {delta_time}ms "
+
         previous_time = pg.time.get_ticks()
 
         t = pg.time.get_ticks() * 0.0001
 
+        # Joint palettes are uploaded once here and shared by every pass
+        GameObjectSystem.PrepareModelDraws()
+
         # Configure light camera
         playerLocation = GameObjectSystem.FindFirstObjectByType(Player).transform.position
         axis = glm.normalize(glm.vec3(1, 0, -1))
@@ -258,41 +413,14 @@ class Game(Application):
         aspect = self.window.width / self.window.height
         ortho = glm.ortho(-30, 30, -30 / aspect, 30 / aspect, 0.1, 100)
         forward = -glm.normalize(position)
-        p = glm.vec3(0, 1, 0)
-        rotation = glm.quatLookAt(-glm.normalize(position), p)
-        target = position + forward
-        view = glm.lookAt(position + playerLocation, target + playerLocation, rotation * p)
-        vp = ortho * view
-        lvp = vp.to_list()
-
-        # Shadow Pass
-        self.shadowPass.bind()
-        self.shadowPass.enable()
-        shader = self.shadowPass.getShader()
-        shader.setUniformMat4("lvp", 1, lvp)
-        shader.setUniform3f("lightPos", position)
-        GameObjectSystem.RenderModel(shader)
-        GameObjectSystem.RenderQuads(self.quadRenderer, shader)
-        self.shadowPass.unbind()
-
-        # Depth Normal Pass
-        self.depthNormalPass.bind()
-        self.depthNormalPass.enable()
-        shader = self.depthNormalPass.getShader()
-        GameObjectSystem.RenderModel(shader)
-        GameObjectSystem.RenderQuads(self.quadRenderer, shader)
-        self.depthNormalPass.unbind()
-
-        # Render scene to framebuffer
-        self.postProcessingPass.bind()
-        shader = Model.shader
-        shader.bind()
-
-        self.shadowPass.shadowMapTexture.bind(1)
-        shader.setUniform1i("shadowMap", 1)
-        shader.setUniformMat4("lvp", 1, lvp)
-        shader.setUniform3f("lightPos", position)
-        shader.setUniform3f("lightDir", forward)
+        camera = GameObjectSystem.mainCamera
+        cascades = self.cascadedShadowPass
+        if Game.cascadedShadows:
+            cascades.setLight(position, camera, GameObjectSystem.staticVersion, playerLocation)
+            vp = cascades.viewProjections[0]
+        else:
+            # Kept from an earlier frame while the cached static shadows are still valid
+            vp = self.shadowPass.setLight(position, playerLocation, ortho, GameObjectSystem.staticVersion)
 
         sunHeight = glm.dot(glm.vec3(0, 1, 0), -forward)
 
@@ -308,21 +436,77 @@ class Game(Application):
                     glm.vec3(0.9, 0.4, 0.3), nightColor * 0.5,
                     -sunHeight)
 
-        shader.setUniform3f("lightColor", lightColor)
+        # Frame constants are uploaded once here and shared by every pass
+        frameConstants = self.frameConstants
+        frameConstants.set("vp", camera.projectionMat * camera.getViewMatrix())
+        frameConstants.set("lvp", vp)
+        frameConstants.set("cameraPos", camera.position)
+        frameConstants.set("lightPos", position)
+        frameConstants.set("lightDir", forward)
+        frameConstants.set("lightColor", lightColor)
+        frameConstants.upload()
+        frameConstants.bind()
+
+        # Shadow Pass: static casters only when their cached map is stale, then the dynamic ones over a copy of it
+        if Game.cascadedShadows:
+            cascades.enable()
+            shader = cascades.getShader()
+            for i, cascadeVP in enumerate(cascades.viewProjections):
+                # The shadow shader projects with lvp, so every cascade swaps in its own
+                frameConstants.set("lvp", cascadeVP)
+                frameConstants.upload()
+                if cascades.staticDirty[i]:
+                    cascades.bindStatic(i)
+                    GameObjectSystem.RenderModel(shader, f"staticShadow{i}", cascadeVP, static=True)
+                cascades.bind(i)
+                GameObjectSystem.RenderModel(shader, f"shadow{i}", cascadeVP, static=False)
+                GameObjectSystem.RenderQuads(self.quadRenderer, shader)
+            cascades.unbind()
+        else:
+            self.shadowPass.enable()
+            shader = self.shadowPass.getShader()
+            if self.shadowPass.staticDirty:
+                self.shadowPass.bindStatic()
+                GameObjectSystem.RenderModel(shader, "staticShadow", vp, static=True)
+            self.shadowPass.bind()
+            GameObjectSystem.RenderModel(shader, "shadow", vp, static=False)
+            GameObjectSystem.RenderQuads(self.quadRenderer, shader)
+            self.shadowPass.unbind()
+
+        # Depth Normal Pass
+        self.depthNormalPass.bind()
+        self.depthNormalPass.enable()
+        shader = self.depthNormalPass.getShader()
+        GameObjectSystem.RenderModel(shader, "depthNormal")
+        GameObjectSystem.RenderQuads(self.quadRenderer, shader)
+        self.depthNormalPass.unbind()
+
+        # Render scene to framebuffer
+        self.postProcessingPass.bind()
+        shader = Model.shader
+        shader.bind()
+
+        self.shadowPass.shadowMapTexture.bind(1)
+        shader.setUniform1i("shadowMap", 1)
+        cascades.shadowMaps.bind(5)
+        shader.setUniform1i("shadowCascades", 5)
+        shader.setUniform1i("cascaded", int(Game.cascadedShadows))
 
         GameObjectSystem.RenderModel(shader)
 
         shader = self.quadShader
         shader.bind()
         shader.setUniform1i("shadowMap", 1)
-        shader.setUniformMat4("lvp", 1, lvp)
-        shader.setUniform3f("lightPos", position)
-        shader.setUniform3f("lightDir", forward)
-        shader.setUniform3f("lightColor", lightColor)
+        shader.setUniform1i("shadowCascades", 5)
+        shader.setUniform1i("cascaded", int(Game.cascadedShadows))
         GameObjectSystem.RenderQuads(self.quadRenderer, self.quadShader)
 
         delta_time: float = (pg.time.get_ticks() - previous_time)
         title += f"render: {delta_time}ms "
+        title += f"uniform calls saved: {glShaderProgram.lastFrameAvoidedCalls} "
+        title += f"static shadow renders: {cascades.staticUpdates if Game.cascadedShadows else self.shadowPass.staticUpdates} "
+        for queue in GameObjectSystem.renderQueues.values():
+            title += f"{queue.name}: {queue.stats.drawCalls} draws/{queue.stats.stateChanges()} changes/{queue.stats.primitives} drawn/{queue.stats.culled} culled "
         pg.display.set_caption(title)
 
         self.postProcessingPass.unbind()
@@ -346,6 +530,7 @@ class Game(Application):
 
         # Render fullscreen quad with post-processing
         glDrawArrays(GL_TRIANGLES, 0, 6)
+        glShaderProgram.EndFrame()
 
         if self.lockCursor:
             pg.mouse.set_pos((self.window.width / 2, self.window.height / 2))
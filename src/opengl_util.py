@@ -75,6 +75,157 @@ class glIndexBuffer:
     def delete(self) -> None:
         glDeleteBuffers(1, [self._id])
 
+class glStreamBuffer:
+    # Ring of `segments` batches of up to segmentSize bytes. Each write only uploads its own bytes, after the ones
+    # the GPU may still be reading; when the ring wraps the storage is orphaned so the driver never waits on a draw
+    def __init__(self, target: int, segmentSize: int, segments: int = 3, alignment: int = 4):
+        self.target = target
+        self.alignment = alignment
+        self.size = segmentSize * segments
+        self.offset = 0
+        self._id = glGenBuffers(1)
+        glBindBuffer(target, self._id)
+        glBufferData(target, self.size, None, GL_STREAM_DRAW)
+
+    def bind(self) -> None:
+        glBindBuffer(self.target, self._id)
+
+    def write(self, data: np.ndarray) -> int:
+        # Returns the byte offset the data was written at, a multiple of alignment
+        if data.nbytes > self.size:
+            raise RuntimeError(f"Stream buffer write of {data.nbytes} bytes exceeds its {self.size} bytes")
+        offset = -(-self.offset // self.alignment) * self.alignment
+        self.bind()
+        if offset + data.nbytes > self.size:
+            glBufferData(self.target, self.size, None, GL_STREAM_DRAW)
+            offset = 0
+        glBufferSubData(self.target, offset, data.nbytes, data)
+        self.offset = offset + data.nbytes
+        return offset
+
+    def delete(self) -> None:
+        glDeleteBuffers(1, [self._id])
+
+# Size and base alignment in bytes of the std140 types glUniformBuffer understands
+STD140_TYPES = {
+    'int': (4, 4),
+    'float': (4, 4),
+    'vec2': (8, 8),
+    'vec3': (12, 16),
+    'vec4': (16, 16),
+    'mat4': (64, 16),
+}
+
+def std140_layout(fields: list[tuple[str, str, int]]) -> tuple[dict[str, tuple[int, int, str, int]], int]:
+    # fields: (name, type, count) in declaration order. Returns name -> (offset, stride, type, count) and the block size.
+    # Array elements are padded to 16 bytes, as are the block size and the member after an array
+    layout = {}
+    offset = 0
+    for name, type, count in fields:
+        size, alignment = STD140_TYPES[type]
+        stride = size
+        if count > 1:
+            alignment = 16
+            stride = -(-size // 16) * 16
+        offset = -(-offset // alignment) * alignment
+        layout[name] = (offset, stride, type, count)
+        offset += stride * count
+        if count > 1:
+            offset = -(-offset // 16) * 16
+    return layout, -(-offset // 16) * 16
+
+class glUniformBuffer:
+    # Binding point per block name, shared by every program that declares the block
+    bindingPoints: dict[str, int] = {}
+
+    @staticmethod
+    def BindingPoint(blockName: str) -> int:
+        points = glUniformBuffer.bindingPoints
+        if blockName not in points:
+            if len(points) >= glGetIntegerv(GL_MAX_UNIFORM_BUFFER_BINDINGS):
+                raise RuntimeError(f"No uniform buffer binding point left for {blockName}")
+            points[blockName] = len(points)
+        return points[blockName]
+
+    def __init__(self, blockName: str, fields: list[tuple[str, str, int]], usage: int = GL_DYNAMIC_DRAW):
+        self.blockName = blockName
+        self.bindingPoint = glUniformBuffer.BindingPoint(blockName)
+        self.layout, self.size = std140_layout(fields)
+        # CPU copy of the block; set() writes here and upload() sends the changed byte range
+        self.data = np.zeros(self.size, dtype=np.uint8)
+        self.dirtyStart = 0
+        self.dirtyEnd = self.size
+
+        self._id = glGenBuffers(1)
+        glBindBuffer(GL_UNIFORM_BUFFER, self._id)
+        glBufferData(GL_UNIFORM_BUFFER, self.size, None, usage)
+        glBindBuffer(GL_UNIFORM_BUFFER, 0)
+
+    def set(self, name: str, value):
+        # glm matrices are written column-major like glUniformMatrix4fv; NumPy matrices are written as stored,
+        # so blocks filled from row-major NumPy arrays are declared row_major in GLSL
+        offset, stride, type, count = self.layout[name]
+        if hasattr(value, 'to_list'):
+            value = value.to_list()
+        components = STD140_TYPES[type][0] // 4
+        values = np.asarray(value, dtype=np.int32 if type == 'int' else np.float32).reshape(-1, components)
+        if len(values) > count:
+            raise RuntimeError(f"{name} holds {count} elements, got {len(values)}")
+
+        end = offset + stride * len(values)
+        target = self.data[offset : end].view(values.dtype).reshape(len(values), stride // 4)[:, :components]
+        if np.array_equal(target, values):
+            return
+        target[:] = values
+        self.dirtyStart = min(self.dirtyStart, offset)
+        self.dirtyEnd = max(self.dirtyEnd, end)
+
+    def upload(self):
+        if self.dirtyEnd > self.dirtyStart:
+            glBindBuffer(GL_UNIFORM_BUFFER, self._id)
+            glBufferSubData(GL_UNIFORM_BUFFER, self.dirtyStart, self.dirtyEnd - self.dirtyStart, self.data[self.dirtyStart : self.dirtyEnd])
+            glBindBuffer(GL_UNIFORM_BUFFER, 0)
+        self.dirtyStart = self.size
+        self.dirtyEnd = 0
+
+    def bind(self):
+        glBindBufferBase(GL_UNIFORM_BUFFER, self.bindingPoint, self._id)
+
+    def delete(self) -> None:
+        glDeleteBuffers(1, [self._id])
+
+class glTextureBuffer:
+    # Buffer exposed to shaders as a samplerBuffer and read with texelFetch, for data too large for a uniform block
+    def __init__(self, slot: int, internal: int = GL_RGBA32F, usage: int = GL_STREAM_DRAW):
+        self.slot = slot
+        self.usage = usage
+        self.size = 0
+        self._buffer = glGenBuffers(1)
+        glBindBuffer(GL_TEXTURE_BUFFER, self._buffer)
+        self._id = glGenTextures(1)
+        glBindTexture(GL_TEXTURE_BUFFER, self._id)
+        glTexBuffer(GL_TEXTURE_BUFFER, internal, self._buffer)
+        glBindTexture(GL_TEXTURE_BUFFER, 0)
+        glBindBuffer(GL_TEXTURE_BUFFER, 0)
+
+    def setData(self, data: np.ndarray):
+        # The store only grows; smaller updates overwrite its start
+        glBindBuffer(GL_TEXTURE_BUFFER, self._buffer)
+        if data.nbytes > self.size:
+            self.size = data.nbytes
+            glBufferData(GL_TEXTURE_BUFFER, self.size, data, self.usage)
+        else:
+            glBufferSubData(GL_TEXTURE_BUFFER, 0, data.nbytes, data)
+        glBindBuffer(GL_TEXTURE_BUFFER, 0)
+
+    def bind(self):
+        glActiveTexture(int(GL_TEXTURE0) + self.slot)
+        glBindTexture(GL_TEXTURE_BUFFER, self._id)
+
+    def delete(self) -> None:
+        glDeleteTextures(1, [self._id])
+        glDeleteBuffers(1, [self._buffer])
+
 def compile_shader(src: str, type: int) -> int:
     shader = glCreateShader(type)
     if shader is None:
@@ -104,28 +255,79 @@ def create_program(vs_src: str, fs_src: str) -> int:
     return int(program)
 
 class glShaderProgram:
+    # GL calls the location table and the shadow values saved, counted for the current and the last finished frame
+    avoidedCalls: int = 0
+    lastFrameAvoidedCalls: int = 0
+
+    @staticmethod
+    def EndFrame():
+        glShaderProgram.lastFrameAvoidedCalls = glShaderProgram.avoidedCalls
+        glShaderProgram.avoidedCalls = 0
+
     def __init__(self, vertex_src: str, fragment_src: str):
         self.vertex_src = vertex_src
         self.fragment_src =fragment_src 
         self.program = create_program(vertex_src, fragment_src);
 
+        # Locations are looked up once at link time; array uniforms are also reachable without their [0]
+        self.locations: dict[str, int] = {}
+        for i in range(glGetProgramiv(self.program, GL_ACTIVE_UNIFORMS)):
+            name = glGetActiveUniform(self.program, i)[0].decode()
+            location = glGetUniformLocation(self.program, name)
+            self.locations[name] = location
+            if name.endswith('[0]'):
+                self.locations[name[:-3]] = location
+        # Last value set per location; a program keeps its uniform values while other programs are bound
+        self.values: dict[int, object] = {}
+
+        # Every uniform block is tied to the binding point its name owns, so one glUniformBuffer serves all programs
+        for i in range(glGetProgramiv(self.program, GL_ACTIVE_UNIFORM_BLOCKS)):
+            length = np.zeros(1, dtype=np.int32)
+            glGetActiveUniformBlockiv(self.program, i, GL_UNIFORM_BLOCK_NAME_LENGTH, length)
+            name = ctypes.create_string_buffer(int(length[0]))
+            glGetActiveUniformBlockName(self.program, i, int(length[0]), None, name)
+            glUniformBlockBinding(self.program, i, glUniformBuffer.BindingPoint(name.value.decode()))
+
+    def findLocation(self, name: str, value) -> int:
+        # -1 when the uniform does not exist or already holds value
+        glShaderProgram.avoidedCalls += 1
+        id = self.locations.get(name, -1)
+        if id == -1:
+            return -1
+        last = self.values.get(id)
+        if isinstance(value, np.ndarray):
+            if isinstance(last, np.ndarray) and last.shape == value.shape and np.array_equal(last, value):
+                glShaderProgram.avoidedCalls += 1
+                return -1
+            self.values[id] = value.copy()
+        else:
+            if last is not None and not isinstance(last, np.ndarray) and last == value:
+                glShaderProgram.avoidedCalls += 1
+                return -1
+            self.values[id] = value
+        return id
+
     def setUniform3f(self, name: str, v3):
-        id = glGetUniformLocation(self.program, name)
+        id = self.findLocation(name, tuple(v3))
         if id != -1:
             glUniform3f(id, *v3)
 
     def setUniform1f(self, name: str, v):
-        id = glGetUniformLocation(self.program, name)
+        id = self.findLocation(name, float(v))
         if id != -1:
             glUniform1f(id, v)
 
     def setUniformMat4(self, name: str, count: int, mats, transpose = GL_FALSE):
-        id = glGetUniformLocation(self.program, name)
+        if isinstance(mats, np.ndarray):
+            value = np.swapaxes(mats, -1, -2) if transpose else mats
+        else:
+            value = (count, bool(transpose), mats)
+        id = self.findLocation(name, value)
         if id != -1:
             glUniformMatrix4fv(id, count, transpose, mats)
 
     def setUniform1i(self, name: str, val: int):
-        id = glGetUniformLocation(self.program, name)
+        id = self.findLocation(name, int(val))
         if id != -1:
             glUniform1i(id, val)
 
@@ -179,6 +381,100 @@ class glTexture:
     def delete(self) -> None:
         glDeleteTextures(1, [self._id])
 
+class glTextureArray:
+    # RGBA textures packed as the layers of one GL_TEXTURE_2D_ARRAY, so geometry using different textures can be
+    # drawn together by carrying a layer index. Images of another size are scaled to the layer size
+    def __init__(self, width: int = 128, height: int = 128, style: int = GL_NEAREST, capacity: int = 8):
+        self.width = width
+        self.height = height
+        self.style = style
+        self.capacity = 0
+        # CPU copy of every layer, to fill the storage again when it grows
+        self.layers: list[np.ndarray] = []
+        self.paths: dict[str, int] = {}
+        self._id = glGenTextures(1)
+        self.allocate(capacity)
+
+    def allocate(self, capacity: int):
+        self.bind()
+        glTexImage3D(GL_TEXTURE_2D_ARRAY, 0, GL_RGBA8, self.width, self.height, capacity, 0, GL_RGBA, GL_UNSIGNED_BYTE, None)
+        for layer, pixels in enumerate(self.layers):
+            glTexSubImage3D(GL_TEXTURE_2D_ARRAY, 0, 0, 0, layer, self.width, self.height, 1, GL_RGBA, GL_UNSIGNED_BYTE, pixels)
+        glTexParameteri(GL_TEXTURE_2D_ARRAY, GL_TEXTURE_MIN_FILTER, GL_NEAREST_MIPMAP_NEAREST if self.style == GL_NEAREST else GL_LINEAR_MIPMAP_LINEAR)
+        glTexParameteri(GL_TEXTURE_2D_ARRAY, GL_TEXTURE_MAG_FILTER, self.style)
+        glTexParameteri(GL_TEXTURE_2D_ARRAY, GL_TEXTURE_WRAP_S, GL_CLAMP_TO_EDGE)
+        glTexParameteri(GL_TEXTURE_2D_ARRAY, GL_TEXTURE_WRAP_T, GL_CLAMP_TO_EDGE)
+        if len(self.layers) > 0:
+            glGenerateMipmap(GL_TEXTURE_2D_ARRAY)
+        self.capacity = capacity
+
+    def addLayer(self, image: Image.Image) -> int:
+        # Returns the new layer's index
+        resample = Image.NEAREST if self.style == GL_NEAREST else Image.BILINEAR
+        image = image.convert("RGBA").resize((self.width, self.height), resample)
+        # Flip image vertically, like glTexture.loadTexture
+        pixels = np.ascontiguousarray(np.array(image)[::-1])
+        self.layers.append(pixels)
+        if len(self.layers) > self.capacity:
+            self.allocate(self.capacity * 2)
+            return len(self.layers) - 1
+
+        self.bind()
+        glTexSubImage3D(GL_TEXTURE_2D_ARRAY, 0, 0, 0, len(self.layers) - 1, self.width, self.height, 1, GL_RGBA, GL_UNSIGNED_BYTE, pixels)
+        glGenerateMipmap(GL_TEXTURE_2D_ARRAY)
+        return len(self.layers) - 1
+
+    def loadTexture(self, path: str) -> int:
+        # Layer of the image at path; every path is loaded once
+        if path not in self.paths:
+            self.paths[path] = self.addLayer(Image.open(path))
+        return self.paths[path]
+
+    def bind(self, slot: int = 0) -> None:
+        glActiveTexture(int(GL_TEXTURE0) + slot)
+        glBindTexture(GL_TEXTURE_2D_ARRAY, self._id)
+
+    def delete(self) -> None:
+        glDeleteTextures(1, [self._id])
+
+class glDepthTextureArray:
+    # Depth GL_TEXTURE_2D_ARRAY with a framebuffer rendering into each layer. Samples outside it read as unshadowed
+    def __init__(self, width: int, height: int, layers: int, internal: int = GL_DEPTH_COMPONENT16):
+        self.width = width
+        self.height = height
+        self._id = glGenTextures(1)
+        self.bind()
+        glTexImage3D(GL_TEXTURE_2D_ARRAY, 0, internal, width, height, layers, 0, GL_DEPTH_COMPONENT, GL_FLOAT, None)
+        glTexParameteri(GL_TEXTURE_2D_ARRAY, GL_TEXTURE_MIN_FILTER, GL_NEAREST)
+        glTexParameteri(GL_TEXTURE_2D_ARRAY, GL_TEXTURE_MAG_FILTER, GL_NEAREST)
+        glTexParameteri(GL_TEXTURE_2D_ARRAY, GL_TEXTURE_WRAP_S, GL_CLAMP_TO_BORDER)
+        glTexParameteri(GL_TEXTURE_2D_ARRAY, GL_TEXTURE_WRAP_T, GL_CLAMP_TO_BORDER)
+        glTexParameterfv(GL_TEXTURE_2D_ARRAY, GL_TEXTURE_BORDER_COLOR, 1.0, 1.0, 1.0, 1.0)
+
+        self.framebuffers = []
+        for layer in range(layers):
+            fbo = glGenFramebuffers(1)
+            glBindFramebuffer(GL_FRAMEBUFFER, fbo)
+            glFramebufferTextureLayer(GL_FRAMEBUFFER, GL_DEPTH_ATTACHMENT, self._id, 0, layer)
+            glDrawBuffer(GL_NONE)
+            glReadBuffer(GL_NONE)
+            if glCheckFramebufferStatus(GL_FRAMEBUFFER) != GL_FRAMEBUFFER_COMPLETE:
+                raise RuntimeError("Imcompleted framebuffer")
+            self.framebuffers.append(fbo)
+        glBindFramebuffer(GL_FRAMEBUFFER, 0)
+
+    def bindLayer(self, layer: int) -> None:
+        glBindFramebuffer(GL_DRAW_FRAMEBUFFER, self.framebuffers[layer])
+        glViewport(0, 0, self.width, self.height)
+
+    def bind(self, slot: int = 0) -> None:
+        glActiveTexture(int(GL_TEXTURE0) + slot)
+        glBindTexture(GL_TEXTURE_2D_ARRAY, self._id)
+
+    def delete(self) -> None:
+        glDeleteFramebuffers(len(self.framebuffers), self.framebuffers)
+        glDeleteTextures(1, [self._id])
+
 class glFramebuffer:
     quad_vertices = np.array([
         # positions    # texCoords
@@ -0,0 +1,65 @@
+import pytest
+from BakedClip import BakedClipCache
+
+@pytest.fixture(autouse=True)
+def empty_cache():
+    # The cache is process-wide, so later tests get it back empty and with its own budget
+    budget = BakedClipCache.budget
+    BakedClipCache.Clear()
+    yield
+    BakedClipCache.Clear()
+    BakedClipCache.SetBudget(budget)
+
+class FakeBake:
+    def __init__(self, nbytes: int):
+        self.nbytes = nbytes
+
+def getter(bakes: list):
+    def get(key, nbytes: int = 100):
+        def bake():
+            bakes.append(key)
+            return FakeBake(nbytes)
+        return BakedClipCache.Get(key, bake)
+    return get
+
+def test_working_set_within_budget_bakes_once():
+    BakedClipCache.SetBudget(300)
+    bakes = []
+    get = getter(bakes)
+    for _ in range(10):
+        for key in ('a', 'b', 'c'):
+            assert get(key) != None
+    assert bakes == ['a', 'b', 'c']
+
+def test_oversized_clip_is_sampled():
+    BakedClipCache.SetBudget(300)
+    bakes = []
+    get = getter(bakes)
+    assert get('big', 400) == None
+    assert get('big', 400) == None
+    assert bakes == ['big']
+
+def test_working_set_over_budget_stops_rebaking():
+    BakedClipCache.SetBudget(300)
+    bakes = []
+    get = getter(bakes)
+    # Four clips in turn, one more than fits: without the limit every Get would rebake
+    for _ in range(50):
+        for key in ('a', 'b', 'c', 'd'):
+            get(key)
+    assert len(bakes) < 10
+    assert BakedClipCache.size <= BakedClipCache.budget
+
+    # A new budget gives every clip another chance
+    BakedClipCache.SetBudget(400)
+    bakes.clear()
+    for _ in range(10):
+        for key in ('a', 'b', 'c', 'd'):
+            assert get(key) != None
+    assert len(bakes) == len(set(bakes))
+    assert set(BakedClipCache.clips) == {'a', 'b', 'c', 'd'}
+
+def test_budget_is_restored():
+    # Runs after the tests above have shrunk the budget
+    assert BakedClipCache.budget == 64 * 1024 * 1024
+    assert BakedClipCache.size == 0
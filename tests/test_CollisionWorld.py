@@ -0,0 +1,49 @@
+import numpy as np
+from pyglm import glm
+from CollisionWorld import CollisionWorld, minimum_translation
+from Model import Transform
+
+def brute_pairs(mins, maxs) -> set[tuple[int, int]]:
+    staticMins, staticMaxs = CollisionWorld.staticMins, CollisionWorld.staticMaxs
+    overlap = np.all((mins[:, None] <= staticMaxs[None]) & (maxs[:, None] >= staticMins[None]), axis=2)
+    return set(zip(*(axis.tolist() for axis in np.nonzero(overlap))))
+
+def setup_world(rng: np.random.Generator):
+    CollisionWorld.SetUp()
+    mins = rng.uniform(-100, 100, (3000, 3)) * (1, 0, 1)
+    CollisionWorld.AddStaticBoxes(mins, mins + rng.uniform(0.5, 3.0, (3000, 3)))
+    # Ground and walls far bigger than a cell
+    CollisionWorld.AddStaticBoxes([(-200, -1, -200), (-100, 0, -100), (90, 0, -100)], [(200, 0, 200), (-90, 5, 100), (100, 5, 100)])
+
+def test_overlap_pairs_match_brute_force():
+    rng = np.random.default_rng(0)
+    setup_world(rng)
+    mins = rng.uniform(-100, 100, (500, 3)) * (1, 0, 1)
+    maxs = mins + (0.6, 2, 0.6)
+    first, second = CollisionWorld.OverlapPairs(mins, maxs)
+    assert len(CollisionWorld.largeBoxes) == 3
+    assert set(zip(first.tolist(), second.tolist())) == brute_pairs(mins, maxs)
+    CollisionWorld.ShutDown()
+
+def test_update_matches_testing_every_box():
+    rng = np.random.default_rng(1)
+    setup_world(rng)
+    bodies = []
+    for position in rng.uniform(-100, 100, (200, 3)) * (1, 0, 1):
+        transform = Transform()
+        transform.position = glm.vec3(*position)
+        CollisionWorld.AddBody(transform, (-0.3, 0, -0.3), (0.3, 2, 0.3))
+        bodies.append(transform)
+
+    positions = np.array([body.position.to_list() for body in bodies])
+    mins, maxs = positions + CollisionWorld.bodyMins, positions + CollisionWorld.bodyMaxs
+    expected = positions.copy()
+    for i in range(len(bodies)):
+        hits = np.flatnonzero(np.all((mins[i] <= CollisionWorld.staticMaxs) & (maxs[i] >= CollisionWorld.staticMins), axis=1))
+        if len(hits) > 0:
+            mtv = minimum_translation(np.tile(mins[i], (len(hits), 1)), np.tile(maxs[i], (len(hits), 1)), CollisionWorld.staticMins[hits], CollisionWorld.staticMaxs[hits])
+            expected[i] += mtv.sum(axis=0)
+
+    CollisionWorld.Update()
+    assert np.allclose([body.position.to_list() for body in bodies], expected, atol=1e-5)
+    CollisionWorld.ShutDown()
@@ -0,0 +1,62 @@
+import numpy as np
+import pytest
+from pyglm import glm
+from Animator import Animator
+from Model import MeshData, Model, PrimitiveEntry, SharedMesh, Transform, build_static_batches
+
+def make_static_model(rng: np.random.Generator) -> tuple[Model, MeshData]:
+    # Two primitives with rotated, scaled and translated node matrices; no GL objects are made
+    layout, vertices, bounds = [], [], []
+    for meshIndex in range(2):
+        entry = PrimitiveEntry()
+        entry.vertexOffset = 50 * meshIndex
+        entry.vertexCount = 50
+        entry.meshIndex = meshIndex
+        layout.append(entry)
+        points = rng.uniform(-1, 1, (50, 3)).astype(np.float32)
+        vertices.append(points)
+        bounds.append((points.min(0), points.max(0)))
+    vertices = np.concatenate(vertices)
+    meshData = MeshData(layout, np.zeros(0, dtype=np.uint32), vertices, np.zeros_like(vertices), np.zeros((100, 2), dtype=np.float32),
+                        np.zeros((0, 4), dtype=np.uint8), np.zeros((0, 4), dtype=np.float32), np.array(bounds))
+
+    mesh = SharedMesh('static.glb', True)
+    mesh.layout = layout
+    mesh.modelMats = {
+        0: glm.translate(glm.mat4(1.0), glm.vec3(3, 0, 0)) * glm.mat4_cast(glm.angleAxis(0.7, glm.vec3(0, 1, 0))),
+        1: glm.translate(glm.mat4(1.0), glm.vec3(0, 2, -4)) * glm.scale(glm.mat4(1.0), glm.vec3(2, 0.5, 1)),
+    }
+    mesh.nodeMatrices = np.array([np.eye(4)] + [np.array(mesh.modelMats[entry.meshIndex]) for entry in layout])
+    mesh.setBounds(meshData, set(), None, [])
+    baked, mesh.staticBatches, mesh.dynamicEntries = build_static_batches(meshData, [None, None], mesh.modelMats, set())
+
+    model = Model.__new__(Model)
+    model.mesh = mesh
+    model.static = True
+    model.transform = Transform()
+    model.matrixVersion = -1
+    return model, baked
+
+def test_moved_static_bounds_hold_the_drawn_vertices():
+    model, baked = make_static_model(np.random.default_rng(0))
+    model.transform.position = glm.vec3(10, -2, 5)
+    model.transform.rotation = glm.angleAxis(1.1, glm.normalize(glm.vec3(1, 2, 0)))
+    model.transform.scale = glm.vec3(1.5, 1, 2)
+    model.updateMatrices()
+
+    # Static batches draw the baked vertices under the transform alone
+    transform = np.array(model.transform.getMatrix())
+    drawn = baked.vertices @ transform[:3, :3].T + transform[:3, 3]
+    for entry, center, extent in zip(model.mesh.layout, model.boundsCenters, model.boundsExtents):
+        points = drawn[entry.vertexOffset:entry.vertexOffset + entry.vertexCount]
+        assert np.all(points >= center - extent - 1e-4)
+        assert np.all(points <= center + extent + 1e-4)
+        # The box is fitted to the points, not just somewhere around them
+        assert np.allclose((points.min(0) + points.max(0)) / 2, center, atol=np.max(extent))
+
+def test_animator_waits_for_a_streamed_model():
+    model = Model.__new__(Model)
+    model.path = 'streamed.glb'
+    model.ready = False
+    with pytest.raises(RuntimeError, match='onReady'):
+        Animator(model)
@@ -0,0 +1,64 @@
+import os
+import numpy as np
+from ModelCache import MAGIC, model_cache_path, read_model_cache, write_model_cache
+
+ARRAYS = {'vertices': np.arange(30, dtype=np.float32).reshape(10, 3), 'indices': np.arange(12, dtype=np.uint32)}
+
+def make_source(tmp_path) -> str:
+    path = str(tmp_path / 'model.glb')
+    with open(path, 'wb') as file:
+        file.write(b'glTF' + bytes(range(256)))
+    return path
+
+def test_round_trip(tmp_path):
+    path = make_source(tmp_path)
+    assert write_model_cache(path, {'name': 'model'}, ARRAYS)
+    header, arrays = read_model_cache(path)
+    assert header['name'] == 'model'
+    for name, array in ARRAYS.items():
+        assert np.array_equal(arrays[name], array)
+
+def test_corrupt_cache_is_a_miss(tmp_path):
+    path = make_source(tmp_path)
+    write_model_cache(path, {}, ARRAYS)
+    cache = model_cache_path(path)
+    with open(cache, 'rb') as file:
+        data = file.read()
+
+    corruptions = [
+        data[:len(MAGIC) + 20],                                   # truncated header
+        data[:len(data) // 2],                                    # truncated arrays
+        data[:len(MAGIC) + 8] + b'{' * (len(data) - len(MAGIC) - 8),  # unparsable header
+        data[:len(MAGIC)] + np.uint64(1 << 40).tobytes() + data[len(MAGIC) + 8:],  # header size past the end
+    ]
+    for corrupt in corruptions:
+        with open(cache, 'wb') as file:
+            file.write(corrupt)
+        assert read_model_cache(path) == None
+
+    # The next write replaces the corrupt file
+    assert write_model_cache(path, {}, ARRAYS)
+    assert read_model_cache(path) != None
+
+def test_unwritable_directory_skips_the_cache(tmp_path, monkeypatch):
+    path = make_source(tmp_path)
+
+    def fail(*args, **kwargs):
+        raise OSError(28, 'No space left on device')
+    monkeypatch.setattr(os, 'replace', fail)
+    assert not write_model_cache(path, {}, ARRAYS)
+    assert not os.path.exists(model_cache_path(path) + '.tmp')
+    assert read_model_cache(path) == None
+
+def test_touched_source_stores_the_new_mtime(tmp_path, monkeypatch):
+    path = make_source(tmp_path)
+    write_model_cache(path, {}, ARRAYS)
+    stat = os.stat(path)
+    os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10**9))
+    assert read_model_cache(path) != None
+
+    # The stored mtime now matches, so the source is not hashed again
+    import ModelCache
+    monkeypatch.setattr(ModelCache, 'source_hash', lambda path: 'changed')
+    header, arrays = read_model_cache(path)
+    assert np.array_equal(arrays['vertices'], ARRAYS['vertices'])
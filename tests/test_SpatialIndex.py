@@ -0,0 +1,105 @@
+import numpy as np
+from pyglm import glm
+from Frustum import Frustum
+from SpatialIndex import SpatialIndex, MODEL_LAYER, COLLIDER_LAYER
+
+BOX_COUNT = 50000
+
+def random_boxes(rng: np.random.Generator, count: int) -> tuple[np.ndarray, np.ndarray]:
+    mins = rng.uniform(-100, 100, (count, 3))
+    return mins, mins + rng.uniform(0.1, 3, (count, 3))
+
+def brute_overlap(mins, maxs, boxMin, boxMax) -> np.ndarray:
+    return np.flatnonzero(np.all((mins <= boxMax) & (maxs >= boxMin), axis=1))
+
+def brute_distances(mins, maxs, point) -> np.ndarray:
+    return np.linalg.norm(np.maximum(np.maximum(mins - point, point - maxs), 0), axis=1)
+
+def brute_ray(mins, maxs, origin, direction) -> np.ndarray:
+    inverse = 1 / np.where(direction == 0, 1e-30, direction)
+    t1, t2 = (mins - origin) * inverse, (maxs - origin) * inverse
+    near, far = np.minimum(t1, t2).max(axis=1), np.maximum(t1, t2).min(axis=1)
+    return np.where((near <= far) & (far >= 0), np.maximum(near, 0), np.inf)
+
+def build(count: int = BOX_COUNT, seed: int = 0):
+    rng = np.random.default_rng(seed)
+    mins, maxs = random_boxes(rng, count)
+    index = SpatialIndex()
+    ids = index.insert(None, mins, maxs)
+    return rng, index, ids, mins, maxs
+
+def test_empty_index():
+    index = SpatialIndex()
+    assert len(index.queryBox((0, 0, 0), (1, 1, 1))) == 0
+    assert len(index.queryFrustum(Frustum(glm.ortho(-1, 1, -1, 1, 0.1, 10)))) == 0
+    assert index.rayCast((0, 0, 0), (1, 0, 0)) == None
+    assert index.nearest((0, 0, 0)) == None
+
+def test_query_box():
+    rng, index, ids, mins, maxs = build()
+    for _ in range(50):
+        boxMin, boxMax = random_boxes(rng, 1)
+        boxMax = boxMin + (boxMax - boxMin) * 5
+        assert np.array_equal(np.sort(index.queryBox(boxMin[0], boxMax[0])), ids[brute_overlap(mins, maxs, boxMin, boxMax)])
+
+def test_query_frustum():
+    _, index, ids, mins, maxs = build()
+    viewProjection = glm.ortho(-20, 20, -10, 10, 0.1, 60) * glm.lookAt(glm.vec3(10, 20, 30), glm.vec3(0), glm.vec3(0, 1, 0))
+    frustum = Frustum(viewProjection)
+    expected = np.flatnonzero(frustum.testBoxes((mins + maxs) / 2, (maxs - mins) / 2))
+    assert len(expected) > 0
+    assert np.array_equal(np.sort(index.queryFrustum(frustum)), ids[expected])
+
+def test_ray_cast():
+    rng, index, ids, mins, maxs = build()
+    for _ in range(50):
+        origin = rng.uniform(-120, 120, 3)
+        direction = rng.normal(size=3)
+        direction /= np.linalg.norm(direction)
+        distances = brute_ray(mins, maxs, origin, direction)
+        hit = index.rayCast(origin, direction)
+        if np.isinf(distances.min()):
+            assert hit == None
+        else:
+            assert np.isclose(hit[1], distances.min())
+
+def test_nearest():
+    rng, index, ids, mins, maxs = build()
+    for _ in range(50):
+        point = rng.uniform(-120, 120, 3)
+        id, distance = index.nearest(point)
+        assert np.isclose(distance, brute_distances(mins, maxs, point).min())
+
+def test_layers():
+    rng, index, ids, mins, maxs = build(2000)
+    colliderMins, colliderMaxs = random_boxes(rng, 500)
+    colliders = index.insert(None, colliderMins, colliderMaxs, COLLIDER_LAYER)
+    boxMin, boxMax = np.full(3, -50.0), np.full(3, 50.0)
+    assert np.array_equal(np.sort(index.queryBox(boxMin, boxMax, MODEL_LAYER)), ids[brute_overlap(mins, maxs, boxMin, boxMax)])
+    assert np.array_equal(np.sort(index.queryBox(boxMin, boxMax, COLLIDER_LAYER)), colliders[brute_overlap(colliderMins, colliderMaxs, boxMin, boxMax)])
+
+def test_update_and_remove():
+    rng, index, ids, mins, maxs = build(5000)
+    index.queryBox(mins[0], maxs[0])
+
+    moved = rng.choice(len(ids), 500, replace=False)
+    mins[moved], maxs[moved] = random_boxes(rng, 500)
+    index.update(ids[moved], mins[moved], maxs[moved])
+
+    removed = rng.choice(len(ids), 1000, replace=False)
+    index.remove(ids[removed])
+    alive = np.ones(len(ids), dtype=bool)
+    alive[removed] = False
+
+    # Removed ids are reused by later inserts
+    newMins, newMaxs = random_boxes(rng, 300)
+    newIds = index.insert(None, newMins, newMaxs)
+    assert set(newIds.tolist()) <= set(ids[removed].tolist())
+
+    allIds = np.concatenate([ids[alive], newIds])
+    allMins, allMaxs = np.concatenate([mins[alive], newMins]), np.concatenate([maxs[alive], newMaxs])
+    for _ in range(50):
+        boxMin, boxMax = random_boxes(rng, 1)
+        boxMax = boxMin + (boxMax - boxMin) * 5
+        expected = np.sort(allIds[brute_overlap(allMins, allMaxs, boxMin, boxMax)])
+        assert np.array_equal(np.sort(index.queryBox(boxMin[0], boxMax[0])), expected)